@@ -65,6 +65,10 @@ class EntryPointMapping:
         task_submission = TaskSubmission(**task)
         return self.queue_solution_entrypoint.enqueue(task_submission)
 
+    def enqueue_many(self, tasks):
+        task_submissions = [TaskSubmission(**task) for task in tasks]
+        return self.queue_solution_entrypoint.enqueue_many(task_submissions)
+
     def dequeue(self):
         response = self.queue_solution_entrypoint.dequeue()
         if is_dataclass(response):
@@ -72,6 +76,11 @@ class EntryPointMapping:
             return asdict(response)
         return response
 
+    def dequeue_many(self, n):
+        responses = self.queue_solution_entrypoint.dequeue_many(n)
+        # noinspection PyDataclass
+        return [asdict(response) for response in responses]
+
     def size(self):
         return self.queue_solution_entrypoint.size()
 
@@ -81,6 +90,9 @@ class EntryPointMapping:
     def purge(self):
         return self.queue_solution_entrypoint.purge()
 
+    def cancel(self, user_id, provider=None):
+        return self.queue_solution_entrypoint.cancel(user_id, provider)
+
     # ~~~~~~~~ Demo rounds ~~~~~~
     
     def increment(self, *args):
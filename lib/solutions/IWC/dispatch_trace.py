@@ -0,0 +1,126 @@
+"""Dispatch decision records and a sampled ring buffer to keep them in.
+
+``HeapQueue.explain`` describes where a queued task currently ranks and a
+``DecisionTrace`` attached with ``HeapQueue.trace_decisions`` keeps what
+every sampled dequeue picked and what came second, broken down into the
+legacy ``sort_key`` components.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Iterator
+
+# Which ``sort_key`` branch produced a key; see ``DispatchKey.rule``. The
+# window rules apply to any provider with a deprioritisation window.
+RULE_WINDOW_DEFERRED = "window_deferred"
+RULE_WINDOW_AGED_OUT = "window_aged_out"
+RULE_HIGH_PRIORITY = "high_priority"
+RULE_HIGH_PRIORITY_IN_WINDOW = "high_priority_in_window"
+RULE_NORMAL = "normal"
+
+
+@dataclass(frozen=True, slots=True)
+class DispatchKey:
+    """One task's legacy sort key, component by component.
+
+    ``rule`` names the ``sort_key`` branch the task fell into and
+    ``window`` the provider whose deprioritisation window that rule came
+    from, ``None`` for rules no window is involved in. ``group_sort`` is
+    ``None`` for HIGH tasks without a group. ``rule_of_3`` is whether the
+    user has enough queued tasks for the rule of 3 to promote them.
+    """
+
+    provider: str
+    user_id: int
+    rule: str
+    window: str | None
+    tier: int
+    timestamp: datetime
+    sub_tier: int
+    group_sort: datetime | None
+    user_task_count: int
+    rule_of_3: bool
+
+
+@dataclass(frozen=True, slots=True)
+class TaskExplanation:
+    """Where a queued task stands if the queue were drained now.
+
+    ``rank`` counts the tasks that would be dispatched before it.
+    """
+
+    rank: int
+    queue_size: int
+    key: DispatchKey
+
+
+@dataclass(frozen=True, slots=True)
+class DispatchDecision:
+    """What one dequeue picked, and the task that would have come next."""
+
+    dequeue_number: int
+    queue_size: int
+    winner: DispatchKey
+    runner_up: DispatchKey | None
+
+
+class DecisionTrace:
+    """Ring buffer of the last ``capacity`` sampled ``DispatchDecision`` s.
+
+    One dequeue in every ``sample_every`` is recorded; describing it costs a
+    few tuple reads on top of the dequeue, the rest cost a counter check.
+    """
+
+    def __init__(self, capacity: int = 1024, sample_every: int = 1) -> None:
+        if capacity < 1 or sample_every < 1:
+            raise ValueError("capacity and sample_every must be at least 1")
+        self.sample_every = sample_every
+        self._decisions: deque[DispatchDecision] = deque(maxlen=capacity)
+        self._dequeues = 0
+
+    def __len__(self) -> int:
+        return len(self._decisions)
+
+    def __iter__(self) -> Iterator[DispatchDecision]:
+        return iter(list(self._decisions))
+
+    def sample(self) -> int | None:
+        """Count a dequeue; return its number when it should be recorded."""
+        self._dequeues += 1
+        if self._dequeues % self.sample_every:
+            return None
+        return self._dequeues
+
+    def record(self, decision: DispatchDecision) -> None:
+        self._decisions.append(decision)
+
+    def dump(self) -> list[dict[str, object]]:
+        """The buffered decisions, oldest first, as JSON-ready dicts."""
+        return [_jsonable(asdict(decision)) for decision in self._decisions]
+
+    def clear(self) -> None:
+        self._decisions.clear()
+
+
+def _jsonable(value: object) -> object:
+    if isinstance(value, dict):
+        return {name: _jsonable(item) for name, item in value.items()}
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+__all__ = [
+    "DispatchKey",
+    "TaskExplanation",
+    "DispatchDecision",
+    "DecisionTrace",
+    "RULE_WINDOW_DEFERRED",
+    "RULE_WINDOW_AGED_OUT",
+    "RULE_HIGH_PRIORITY",
+    "RULE_HIGH_PRIORITY_IN_WINDOW",
+    "RULE_NORMAL",
+]
@@ -0,0 +1,343 @@
+"""Binary min-heap addressable by handle, used by the heap-backed queue engine."""
+
+from __future__ import annotations
+
+import heapq
+from typing import Any, Generic, Hashable, Iterable, Iterator, TypeVar
+
+H = TypeVar("H", bound=Hashable)
+
+
+class IndexedHeap(Generic[H]):
+    """Min-heap of ``(handle, key)`` pairs with a handle -> position index.
+
+    Each handle may be stored at most once. Besides ``push``/``pop`` the index
+    allows ``update`` (decrease-key and increase-key) and ``remove`` of an
+    arbitrary handle in O(log N).
+    """
+
+    def __init__(self) -> None:
+        self._keys: list[Any] = []
+        self._handles: list[H] = []
+        self._positions: dict[H, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def __bool__(self) -> bool:
+        return bool(self._handles)
+
+    def __contains__(self, handle: object) -> bool:
+        return handle in self._positions
+
+    def __iter__(self) -> Iterator[H]:
+        """Iterate handles in heap (not sorted) order."""
+        return iter(self._handles)
+
+    def key_of(self, handle: H) -> Any:
+        return self._keys[self._positions[handle]]
+
+    def peek(self) -> tuple[H, Any]:
+        if not self._handles:
+            raise IndexError("peek from an empty heap")
+        return self._handles[0], self._keys[0]
+
+    def iter_sorted(self) -> Iterator[tuple[H, Any]]:
+        """Yield ``(handle, key)`` pairs in key order without popping.
+
+        A frontier of candidate positions replaces the pops, so the first k
+        pairs cost O(k log k). The heap must not change while iterating.
+        """
+        keys, handles = self._keys, self._handles
+        size = len(keys)
+        if not size:
+            return
+        frontier = [(keys[0], 0)]
+        while frontier:
+            key, position = heapq.heappop(frontier)
+            yield handles[position], key
+            child = 2 * position + 1
+            if child < size:
+                heapq.heappush(frontier, (keys[child], child))
+                if child + 1 < size:
+                    heapq.heappush(frontier, (keys[child + 1], child + 1))
+
+    def count_below(self, key: Any) -> int:
+        """Number of keys strictly smaller than ``key``, in O(that number)."""
+        keys = self._keys
+        size = len(keys)
+        count = 0
+        stack = [0] if size and keys[0] < key else []
+        while stack:
+            position = stack.pop()
+            count += 1
+            child = 2 * position + 1
+            if child < size and keys[child] < key:
+                stack.append(child)
+            if child + 1 < size and keys[child + 1] < key:
+                stack.append(child + 1)
+        return count
+
+    def push(self, handle: H, key: Any) -> None:
+        if handle in self._positions:
+            raise ValueError(f"handle already in heap: {handle!r}")
+        position = len(self._handles)
+        self._keys.append(key)
+        self._handles.append(handle)
+        self._positions[handle] = position
+        self._sift_up(position)
+
+    def push_many(self, items: Iterable[tuple[H, Any]]) -> None:
+        """Push several ``(handle, key)`` pairs.
+
+        When the batch is at least as large as the heap already is, the whole
+        heap is rebuilt bottom-up in O(N) instead of sifting each item up.
+        """
+        start = len(self._handles)
+        for handle, key in items:
+            if handle in self._positions:
+                raise ValueError(f"handle already in heap: {handle!r}")
+            self._positions[handle] = len(self._handles)
+            self._keys.append(key)
+            self._handles.append(handle)
+        size = len(self._handles)
+        if size - start >= start:
+            for position in reversed(range(size // 2)):
+                self._sift_down(position)
+        else:
+            for position in range(start, size):
+                self._sift_up(position)
+
+    def load(self, items: Iterable[tuple[H, Any]]) -> None:
+        """Replace the contents with ``items`` already in heap order.
+
+        A list sorted by key qualifies, as does an earlier heap's own order,
+        so restoring a saved heap costs no comparisons at all.
+        """
+        self.clear()
+        keys, handles, positions = self._keys, self._handles, self._positions
+        for handle, key in items:
+            positions[handle] = len(handles)
+            keys.append(key)
+            handles.append(handle)
+        if len(positions) != len(handles):
+            self.clear()
+            raise ValueError("duplicate handles in heap load")
+
+    def pop(self) -> tuple[H, Any]:
+        if not self._handles:
+            raise IndexError("pop from an empty heap")
+        handle, key = self._handles[0], self._keys[0]
+        self._delete_at(0)
+        return handle, key
+
+    def remove(self, handle: H) -> Any:
+        position = self._positions[handle]
+        key = self._keys[position]
+        self._delete_at(position)
+        return key
+
+    def update(self, handle: H, key: Any) -> None:
+        position = self._positions[handle]
+        old_key = self._keys[position]
+        self._keys[position] = key
+        if key < old_key:
+            self._sift_up(position)
+        else:
+            self._sift_down(position)
+
+    def clear(self) -> None:
+        self._keys.clear()
+        self._handles.clear()
+        self._positions.clear()
+
+    def _delete_at(self, position: int) -> None:
+        last = len(self._handles) - 1
+        del self._positions[self._handles[position]]
+        if position == last:
+            self._keys.pop()
+            self._handles.pop()
+            return
+        self._keys[position] = self._keys.pop()
+        self._handles[position] = self._handles.pop()
+        self._positions[self._handles[position]] = position
+        if position > 0 and self._keys[position] < self._keys[(position - 1) >> 1]:
+            self._sift_up(position)
+        else:
+            self._sift_down(position)
+
+    def _sift_up(self, position: int) -> None:
+        keys, handles, positions = self._keys, self._handles, self._positions
+        key, handle = keys[position], handles[position]
+        while position > 0:
+            parent = (position - 1) >> 1
+            if not key < keys[parent]:
+                break
+            keys[position] = keys[parent]
+            handles[position] = handles[parent]
+            positions[handles[position]] = position
+            position = parent
+        keys[position] = key
+        handles[position] = handle
+        positions[handle] = position
+
+    def _sift_down(self, position: int) -> None:
+        keys, handles, positions = self._keys, self._handles, self._positions
+        size = len(keys)
+        key, handle = keys[position], handles[position]
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            right = child + 1
+            if right < size and keys[right] < keys[child]:
+                child = right
+            if not keys[child] < key:
+                break
+            keys[position] = keys[child]
+            handles[position] = handles[child]
+            positions[handles[position]] = position
+            position = child
+        keys[position] = key
+        handles[position] = handle
+        positions[handle] = position
+
+
+class IntrusiveIndexedHeap(IndexedHeap[H]):
+    """``IndexedHeap`` that keeps each handle's position on the handle itself.
+
+    The position lives in the handle's ``attribute`` (typically a slot)
+    instead of a handle -> position dict, which saves the dict entry, about
+    50 bytes per handle. A handle is in this heap exactly when the attribute
+    points at it, so stale values left by an earlier heap are harmless, but
+    two heaps must not share one attribute while a handle is in both.
+    """
+
+    def __init__(self, attribute: str) -> None:
+        self._keys: list[Any] = []
+        self._handles: list[H] = []
+        self._attribute = attribute
+
+    def __contains__(self, handle: object) -> bool:
+        position = getattr(handle, self._attribute, -1)
+        handles = self._handles
+        return 0 <= position < len(handles) and handles[position] is handle
+
+    def _position(self, handle: H) -> int:
+        if handle not in self:
+            raise KeyError(handle)
+        return getattr(handle, self._attribute)
+
+    def key_of(self, handle: H) -> Any:
+        return self._keys[self._position(handle)]
+
+    def push(self, handle: H, key: Any) -> None:
+        if handle in self:
+            raise ValueError(f"handle already in heap: {handle!r}")
+        position = len(self._handles)
+        self._keys.append(key)
+        self._handles.append(handle)
+        setattr(handle, self._attribute, position)
+        self._sift_up(position)
+
+    def push_many(self, items: Iterable[tuple[H, Any]]) -> None:
+        keys, handles, attribute = self._keys, self._handles, self._attribute
+        start = len(handles)
+        for handle, key in items:
+            if handle in self:
+                raise ValueError(f"handle already in heap: {handle!r}")
+            setattr(handle, attribute, len(handles))
+            keys.append(key)
+            handles.append(handle)
+        size = len(handles)
+        if size - start >= start:
+            for position in reversed(range(size // 2)):
+                self._sift_down(position)
+        else:
+            for position in range(start, size):
+                self._sift_up(position)
+
+    def load(self, items: Iterable[tuple[H, Any]]) -> None:
+        self.clear()
+        keys, handles, attribute = self._keys, self._handles, self._attribute
+        for handle, key in items:
+            setattr(handle, attribute, len(handles))
+            keys.append(key)
+            handles.append(handle)
+        # A repeated handle points at its last position only.
+        if any(getattr(handle, attribute) != position for position, handle in enumerate(handles)):
+            self.clear()
+            raise ValueError("duplicate handles in heap load")
+
+    def remove(self, handle: H) -> Any:
+        position = self._position(handle)
+        key = self._keys[position]
+        self._delete_at(position)
+        return key
+
+    def update(self, handle: H, key: Any) -> None:
+        position = self._position(handle)
+        old_key = self._keys[position]
+        self._keys[position] = key
+        if key < old_key:
+            self._sift_up(position)
+        else:
+            self._sift_down(position)
+
+    def clear(self) -> None:
+        self._keys.clear()
+        self._handles.clear()
+
+    def _delete_at(self, position: int) -> None:
+        keys, handles = self._keys, self._handles
+        setattr(handles[position], self._attribute, -1)
+        if position == len(handles) - 1:
+            keys.pop()
+            handles.pop()
+            return
+        keys[position] = keys.pop()
+        handles[position] = handles.pop()
+        setattr(handles[position], self._attribute, position)
+        if position > 0 and keys[position] < keys[(position - 1) >> 1]:
+            self._sift_up(position)
+        else:
+            self._sift_down(position)
+
+    def _sift_up(self, position: int) -> None:
+        keys, handles, attribute = self._keys, self._handles, self._attribute
+        key, handle = keys[position], handles[position]
+        while position > 0:
+            parent = (position - 1) >> 1
+            if not key < keys[parent]:
+                break
+            keys[position] = keys[parent]
+            setattr(handles[parent], attribute, position)
+            handles[position] = handles[parent]
+            position = parent
+        keys[position] = key
+        handles[position] = handle
+        setattr(handle, attribute, position)
+
+    def _sift_down(self, position: int) -> None:
+        keys, handles, attribute = self._keys, self._handles, self._attribute
+        size = len(keys)
+        key, handle = keys[position], handles[position]
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            right = child + 1
+            if right < size and keys[right] < keys[child]:
+                child = right
+            if not keys[child] < key:
+                break
+            keys[position] = keys[child]
+            setattr(handles[child], attribute, position)
+            handles[position] = handles[child]
+            position = child
+        keys[position] = key
+        handles[position] = handle
+        setattr(handle, attribute, position)
+
+
+__all__ = ["IndexedHeap", "IntrusiveIndexedHeap"]
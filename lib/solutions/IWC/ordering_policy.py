@@ -0,0 +1,164 @@
+"""Declarative dispatch ordering rules for the heap-backed queue engines.
+
+The legacy ``Queue`` hard-codes its ordering in the ``sort_key`` closure: a
+rule-of-3 promotion threshold, bank statements parked in tier 999 until they
+are more than 300 seconds behind the newest task, and the sub-tiers that
+interleave HIGH, NORMAL and aged-out tasks at the same timestamp. An
+``OrderingPolicy`` declares those rules as data and ``compile`` turns them
+into the key function and index layout a ``HeapQueue`` runs on::
+
+    policy = OrderingPolicy(
+        rule_of_3_threshold=4,
+        windows=(
+            DeprioritisationWindow("bank_statements", seconds=300),
+            DeprioritisationWindow("id_verification", seconds=60, tier=500),
+        ),
+    )
+    queue = HeapQueue(policy=policy)
+
+``DEFAULT_POLICY`` reproduces the legacy order exactly.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Callable
+
+from solutions.IWC.queue_solution_legacy import Priority
+
+
+@dataclass(frozen=True)
+class DeprioritisationWindow:
+    """Park a provider's NORMAL tasks in ``tier`` while they are recent.
+
+    A task stays parked until it is more than ``seconds`` older than the
+    newest queued task; from then on it sorts in the main tier ahead of
+    everything else at its timestamp. HIGH tasks are never parked but go
+    behind other HIGH tasks at their timestamp while inside the window.
+    """
+
+    provider: str
+    seconds: int = 300
+    tier: int = 999
+
+
+@dataclass(frozen=True)
+class SubTiers:
+    """Order of the task kinds that share a timestamp in the main tier."""
+
+    aged_out: int = 0
+    high: int = 1
+    high_in_window: int = 2
+    normal: int = 3
+
+
+@dataclass(frozen=True)
+class OrderingPolicy:
+    """Dispatch ordering rules; compile once and share the result."""
+
+    rule_of_3_threshold: int = 3
+    windows: tuple[DeprioritisationWindow, ...] = (
+        DeprioritisationWindow("bank_statements", seconds=300, tier=999),
+    )
+    main_tier: int = 0
+    sub_tiers: SubTiers = field(default_factory=SubTiers)
+
+    def compile(self) -> CompiledPolicy:
+        if self.rule_of_3_threshold < 1:
+            raise ValueError("rule_of_3_threshold must be at least 1")
+        providers = [window.provider for window in self.windows]
+        if len(set(providers)) != len(providers):
+            raise ValueError("each provider may have at most one deprioritisation window")
+        for window in self.windows:
+            if window.seconds < 0:
+                raise ValueError(f"negative window for {window.provider!r}")
+            # Draining must never reorder what is left, which needs the
+            # parked tasks behind every main-tier task.
+            if window.tier <= self.main_tier:
+                raise ValueError(
+                    f"tier of {window.provider!r} must come after main tier {self.main_tier}"
+                )
+        sub_tiers = self.sub_tiers
+        ordered = (sub_tiers.aged_out, sub_tiers.high, sub_tiers.high_in_window, sub_tiers.normal)
+        if len(set(ordered)) != len(ordered):
+            raise ValueError("sub-tiers must be distinct")
+        return CompiledPolicy(self)
+
+
+class CompiledPolicy:
+    """An ``OrderingPolicy`` turned into lookups and a specialised key function.
+
+    Providers with a window are numbered; a queued task stores its number
+    (``window_of``) so the key function reads two integers instead of
+    matching provider names, and the engine keeps one pair of freshness
+    heaps per window (``window_lengths``, in microseconds).
+    """
+
+    def __init__(self, policy: OrderingPolicy) -> None:
+        self.policy = policy
+        self.rule_of_3_threshold = policy.rule_of_3_threshold
+        self.main_tier = policy.main_tier
+        self.window_of: dict[str, int] = {
+            window.provider: index for index, window in enumerate(policy.windows)
+        }
+        self.window_lengths: tuple[int, ...] = tuple(
+            window.seconds * 1_000_000 for window in policy.windows
+        )
+        self.window_tiers: tuple[int, ...] = tuple(window.tier for window in policy.windows)
+        sub_tiers = policy.sub_tiers
+        self.sub_tier_names: dict[int, str] = {
+            sub_tiers.aged_out: "aged_out",
+            sub_tiers.high: "high",
+            sub_tiers.high_in_window: "high_in_window",
+            sub_tiers.normal: "normal",
+        }
+        self.sort_key: Callable[[object, int], tuple] = _build_sort_key(
+            policy.main_tier, sub_tiers, self.window_lengths, self.window_tiers
+        )
+
+    def window(self, provider: str) -> int:
+        """Window number of ``provider``, or -1 when it is never parked."""
+        return self.window_of.get(provider, -1)
+
+
+def _build_sort_key(
+    main_tier: int,
+    sub_tiers: SubTiers,
+    lengths: tuple[int, ...],
+    tiers: tuple[int, ...],
+) -> Callable[[object, int], tuple]:
+    # Every rule value is bound as a closure constant so the key function does
+    # no attribute or global lookups beyond the task's own fields.
+    high_priority = Priority.HIGH
+    aged_out, high, high_in_window, normal = (
+        sub_tiers.aged_out,
+        sub_tiers.high,
+        sub_tiers.high_in_window,
+        sub_tiers.normal,
+    )
+
+    def sort_key(task, queue_newest: int) -> tuple:
+        time_key = task.time_key
+        window = task.window
+        in_window = window >= 0 and queue_newest - time_key <= lengths[window]
+        if task.priority is high_priority:
+            return (main_tier, time_key, high_in_window if in_window else high, task.group_key)
+        if in_window:
+            return (tiers[window], time_key, 0, time_key)
+        if window >= 0:
+            return (main_tier, time_key, aged_out, time_key)
+        return (main_tier, time_key, normal, time_key)
+
+    return sort_key
+
+
+DEFAULT_POLICY = OrderingPolicy()
+
+
+__all__ = [
+    "DeprioritisationWindow",
+    "SubTiers",
+    "OrderingPolicy",
+    "CompiledPolicy",
+    "DEFAULT_POLICY",
+]
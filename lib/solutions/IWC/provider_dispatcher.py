@@ -0,0 +1,321 @@
+"""Worker pool that carries dispatched tasks to their provider's HTTP service.
+
+The ``queue_worker`` sketch in ``queue_solution_legacy`` handles one task at
+a time and stands in for the provider call with ``asyncio.sleep(2)``. A
+``Dispatcher`` runs ``workers`` coroutines that pull from an ``AsyncQueue``
+and POST each task to ``Provider.base_url``::
+
+    queue = AsyncQueue(ThreadSafeRateLimitedQueue())
+    async with Dispatcher(queue, workers=16) as dispatcher:
+        queue.enqueue(...)
+        await dispatcher.drain()
+
+Each base URL gets its own ``ConnectionPool`` of keep-alive HTTP/1.1
+connections, capped at the provider's ``max_in_flight`` when it has one.
+Timeouts, connection errors, 429 and 5xx responses are retried with
+exponential backoff; other responses are final. The outcome goes back to
+the queue as ``ack`` (2xx) or ``nack``, which releases dependants on the
+dependency-aware engines, and to the optional ``on_result`` callback.
+
+The client is a minimal asyncio HTTP/1.1 implementation (``Content-Length``
+and chunked bodies, ``http`` and ``https``) so the queue keeps to the
+standard library.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import ssl
+import time
+from dataclasses import dataclass
+from typing import Callable
+from urllib.parse import urlsplit
+
+from solutions.IWC.provider_registry import PROVIDER_REGISTRY, ProviderRegistry
+from solutions.IWC.queue_solution_async import AsyncQueue
+from solutions.IWC.task_types import TaskDispatch
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+@dataclass(frozen=True)
+class HTTPResponse:
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+
+@dataclass(frozen=True)
+class DispatchResult:
+    """Outcome of one task: the last response or error and how many attempts it took."""
+
+    dispatch: TaskDispatch
+    status: int | None
+    attempts: int
+    elapsed: float
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status is not None and 200 <= self.status < 300
+
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections to one origin, at most ``max_connections`` open.
+
+    Requests wait for a free connection rather than open more; idle ones are
+    reused most recently used first. A reused connection the server has
+    closed in the meantime is replaced once, transparently.
+    """
+
+    def __init__(self, base_url: str, max_connections: int = 8) -> None:
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme in {base_url!r}")
+        self.host = parts.hostname or ""
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self._ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self._host_header = parts.netloc
+        self._base_path = parts.path.rstrip("/")
+        self._idle: list[_Connection] = []
+        self._slots = asyncio.Semaphore(max_connections)
+        self.opened = 0
+
+    async def request(
+        self, method: str, path: str, body: bytes = b"", content_type: str = "application/json"
+    ) -> HTTPResponse:
+        head = (
+            f"{method} {self._base_path}{path} HTTP/1.1\r\n"
+            f"Host: {self._host_header}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "\r\n"
+        ).encode("latin-1")
+        async with self._slots:
+            reused = bool(self._idle)
+            connection = self._idle.pop() if reused else await self._open()
+            try:
+                try:
+                    response, keep_alive = await self._exchange(connection, head + body)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    if not reused:
+                        raise
+                    # Closed by the server while idle: one retry on a fresh socket.
+                    connection.close()
+                    connection = await self._open()
+                    response, keep_alive = await self._exchange(connection, head + body)
+            except BaseException:
+                # Timed out, cancelled or broken mid-response: never reuse it.
+                connection.close()
+                raise
+            if keep_alive:
+                self._idle.append(connection)
+            else:
+                connection.close()
+            return response
+
+    async def _open(self) -> _Connection:
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self._ssl)
+        self.opened += 1
+        return _Connection(reader, writer)
+
+    async def _exchange(
+        self, connection: _Connection, request: bytes
+    ) -> tuple[HTTPResponse, bool]:
+        connection.writer.write(request)
+        await connection.writer.drain()
+        reader = connection.reader
+        status_line = await reader.readuntil(b"\r\n")
+        version, _, rest = status_line.decode("latin-1").partition(" ")
+        try:
+            status = int(rest[:3])
+        except ValueError:
+            raise ConnectionError(f"Malformed status line {status_line!r}") from None
+        headers: dict[str, str] = {}
+        while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif status in (204, 304) or 100 <= status < 200:
+            body = b""
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return HTTPResponse(status, headers, body), keep_alive
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if not size:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        while await reader.readuntil(b"\r\n") != b"\r\n":
+            pass  # trailers
+        return b"".join(chunks)
+
+    def close(self) -> None:
+        for connection in self._idle:
+            connection.close()
+        self._idle.clear()
+
+
+class Dispatcher:
+    """Pool of async workers sending dispatched tasks to their providers.
+
+    Throughput grows with ``workers`` until a provider's limits bind: its
+    connection pool holds at most ``max_in_flight`` connections, and a
+    ``RateLimitedQueue`` engine stops handing out its tasks at either limit.
+    Failed tasks are dropped from the queue after their last retry unless
+    ``requeue_failed`` is set. Whatever goes wrong with one task, including
+    a malformed response or an ``on_result`` error, it is acked or nacked
+    and the worker carries on.
+    """
+
+    def __init__(
+        self,
+        queue: AsyncQueue,
+        registry: ProviderRegistry | None = None,
+        workers: int = 8,
+        timeout: float = 10.0,
+        retries: int = 2,
+        backoff: float = 0.1,
+        path: str = "/",
+        requeue_failed: bool = False,
+        on_result: Callable[[DispatchResult], None] | None = None,
+    ) -> None:
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self._queue = queue
+        self._registry = PROVIDER_REGISTRY if registry is None else registry
+        self._workers = workers
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._path = path
+        self._requeue_failed = requeue_failed
+        self._on_result = on_result
+        self._pools: dict[str, ConnectionPool] = {}
+        self._tasks: list[asyncio.Task[None]] = []
+        self._busy = 0
+        self._idle = asyncio.Event()
+        self.completed = 0
+        self.failed = 0
+
+    async def __aenter__(self) -> Dispatcher:
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self._workers)]
+
+    async def drain(self) -> None:
+        """Wait until the queue is empty and no task is being sent."""
+        while self._busy or self._queue.size:
+            self._idle.clear()
+            await self._idle.wait()
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for pool in self._pools.values():
+            pool.close()
+        self._pools.clear()
+
+    def pool(self, base_url: str) -> ConnectionPool:
+        pool = self._pools.get(base_url)
+        if pool is None:
+            limits = [
+                provider.max_in_flight
+                for provider in self._registry
+                if provider.base_url == base_url and provider.max_in_flight is not None
+            ]
+            pool = self._pools[base_url] = ConnectionPool(
+                base_url, min(limits, default=self._workers)
+            )
+        return pool
+
+    async def _work(self) -> None:
+        async for dispatch in self._queue:
+            self._busy += 1
+            start = time.perf_counter()
+            try:
+                result = await self._send(dispatch)
+            except Exception as exc:
+                # Never let one task end the worker, or it stays in flight forever.
+                result = DispatchResult(dispatch, None, 1, time.perf_counter() - start, repr(exc))
+            try:
+                if result.ok:
+                    self.completed += 1
+                    self._queue.ack(dispatch.user_id, dispatch.provider)
+                else:
+                    self.failed += 1
+                    self._queue.nack(dispatch.user_id, dispatch.provider, self._requeue_failed)
+                if self._on_result is not None:
+                    self._on_result(result)
+            except Exception:
+                logger.exception("Handling the result for %s failed", dispatch)
+            finally:
+                self._busy -= 1
+                self._idle.set()
+
+    async def _send(self, dispatch: TaskDispatch) -> DispatchResult:
+        start = time.perf_counter()
+        provider = self._registry.get(dispatch.provider)
+        if provider is None:
+            error = f"unknown provider {dispatch.provider!r}"
+            return DispatchResult(dispatch, None, 0, 0.0, error)
+        pool = self.pool(provider.base_url)
+        body = json.dumps({"user_id": dispatch.user_id, "provider": dispatch.provider}).encode()
+        status: int | None = None
+        error: str | None = None
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = await asyncio.wait_for(
+                    pool.request("POST", self._path, body), self._timeout
+                )
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as exc:
+                status, error = None, repr(exc)
+            except Exception as exc:
+                # Malformed response (bad chunk size, overlong header): not retried.
+                status, error = None, repr(exc)
+                break
+            else:
+                status, error = response.status, None
+                if status not in RETRYABLE_STATUSES:
+                    break
+            if attempt > self._retries:
+                break
+            await asyncio.sleep(self._backoff * 2 ** (attempt - 1))
+        return DispatchResult(dispatch, status, attempt, time.perf_counter() - start, error)
+
+
+__all__ = ["ConnectionPool", "Dispatcher", "DispatchResult", "HTTPResponse"]
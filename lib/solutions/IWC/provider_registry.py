@@ -0,0 +1,119 @@
+"""Provider lookup and precomputed dependency closures for the queue engines."""
+
+from __future__ import annotations
+
+from typing import Iterable, Iterator
+
+from solutions.IWC.queue_solution_legacy import REGISTERED_PROVIDERS, Provider
+
+
+class ProviderRegistry:
+    """Name -> ``Provider`` map with cached, topologically ordered dependencies.
+
+    ``dependency_closure`` returns the providers a task pulls in ahead of
+    itself, in the order the legacy ``_collect_dependencies`` enqueues them
+    (depth first, dependencies before dependants, first occurrence kept).
+    Dependency cycles are rejected when a provider is registered.
+    ``generation`` goes up with every ``register``, so engines that cache
+    anything derived from a provider can tell when to rebuild it.
+    """
+
+    def __init__(self, providers: Iterable[Provider] = ()) -> None:
+        self._providers: dict[str, Provider] = {}
+        self._closures: dict[str, tuple[str, ...]] = {}
+        self._generation = 0
+        for provider in providers:
+            _check_limits(provider)
+            self._providers[provider.name] = provider
+        for name in self._providers:
+            self._check_acyclic(name)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._providers
+
+    def __iter__(self) -> Iterator[Provider]:
+        return iter(self._providers.values())
+
+    def __len__(self) -> int:
+        return len(self._providers)
+
+    def get(self, name: str) -> Provider | None:
+        return self._providers.get(name)
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def register(self, provider: Provider) -> None:
+        """Add or replace ``provider`` and drop every closure it may change."""
+        _check_limits(provider)
+        previous = self._providers.get(provider.name)
+        self._providers[provider.name] = provider
+        try:
+            self._check_acyclic(provider.name)
+        except ValueError:
+            if previous is None:
+                del self._providers[provider.name]
+            else:
+                self._providers[provider.name] = previous
+            raise
+        self._closures = {
+            name: closure
+            for name, closure in self._closures.items()
+            if name != provider.name and provider.name not in closure
+        }
+        self._generation += 1
+
+    def dependency_closure(self, name: str) -> tuple[str, ...]:
+        closure = self._closures.get(name)
+        if closure is None:
+            ordered: dict[str, None] = {}
+            self._visit(name, ordered)
+            closure = self._closures[name] = tuple(ordered)
+        return closure
+
+    def _visit(self, name: str, ordered: dict[str, None]) -> None:
+        provider = self._providers.get(name)
+        if provider is None:
+            # Unknown providers are still enqueued, they just pull in nothing.
+            return
+        for dependency in provider.depends_on:
+            self._visit(dependency, ordered)
+            ordered.setdefault(dependency)
+
+    def _check_acyclic(self, name: str) -> None:
+        path: list[str] = []
+        on_path: set[str] = set()
+        done: set[str] = set()
+
+        def visit(current: str) -> None:
+            if current in on_path:
+                cycle = path[path.index(current):] + [current]
+                raise ValueError(f"Provider dependency cycle: {' -> '.join(cycle)}")
+            provider = self._providers.get(current)
+            if current in done or provider is None:
+                return
+            path.append(current)
+            on_path.add(current)
+            for dependency in provider.depends_on:
+                visit(dependency)
+            path.pop()
+            on_path.remove(current)
+            done.add(current)
+
+        visit(name)
+
+
+def _check_limits(provider: Provider) -> None:
+    if provider.max_in_flight is not None and provider.max_in_flight < 1:
+        raise ValueError(f"max_in_flight of {provider.name!r} must be at least 1")
+    if provider.rate_limit is not None and provider.rate_limit <= 0:
+        raise ValueError(f"rate_limit of {provider.name!r} must be positive")
+    if provider.burst < 1:
+        raise ValueError(f"burst of {provider.name!r} must be at least 1")
+
+
+PROVIDER_REGISTRY = ProviderRegistry(REGISTERED_PROVIDERS)
+
+
+__all__ = ["ProviderRegistry", "PROVIDER_REGISTRY"]
@@ -0,0 +1,169 @@
+"""Metrics hooks for the queue engines and a Prometheus text exporter.
+
+Instrumented code reports to a ``MetricsSink`` and only does so when one is
+attached: without a sink the hot paths cost a single ``is None`` check.
+``MetricsRegistry`` is the bundled sink; it keeps counters, gauges and
+histograms in memory and renders them in the Prometheus text format::
+
+    registry = MetricsRegistry()
+    queue = QueueSolutionEntrypoint(metrics=registry)
+    ...
+    body = registry.render()  # serve as text/plain; version=0.0.4
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+from typing import Callable, Protocol
+
+# Label pairs in a fixed order, e.g. (("operation", "dequeue"),).
+Labels = tuple[tuple[str, str], ...]
+
+# Seconds; spans a dictionary lookup up to a legacy re-sort of a deep queue.
+DEFAULT_LATENCY_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0,
+)
+
+METRIC_HELP = {
+    # Reported by ``QueueSolutionEntrypoint`` whatever the engine.
+    "iwc_queue_operation_seconds": "Entrypoint call latency by operation.",
+    "iwc_queue_submissions_total": "Submissions received by provider.",
+    "iwc_queue_dispatched_total": "Tasks dispatched by provider.",
+    "iwc_queue_depth": "Tasks currently queued.",
+    "iwc_queue_age_seconds": "Spread between the oldest and newest queued timestamps.",
+    # Reported by engines with an ``instrument`` hook.
+    "iwc_queue_tasks_offered_total": "Tasks offered after dependency expansion by provider.",
+    "iwc_queue_dedup_hits_total": "Offered tasks whose (user, provider) was already queued.",
+    "iwc_queue_rule_of_3_promotions_total": "Tasks promoted to HIGH by the rule of 3.",
+    "iwc_queue_rekey_seconds": "Time a dequeue spends re-keying tasks before its pop.",
+    "iwc_queue_tier_dispatched_total": "Tasks dispatched by sort tier.",
+    "iwc_queue_cancelled_total": "Queued tasks removed by cancel.",
+    "iwc_queue_spilled_total": "Tasks moved to the on-disk overflow store.",
+    "iwc_queue_restored_total": "Tasks paged back in from the on-disk overflow store.",
+    "iwc_queue_rule_of_3_users": "Users with at least three queued tasks.",
+    "iwc_queue_tasks": "Queued tasks by sort tier as of the last dequeue.",
+    "iwc_queue_spilled_tasks": "Tasks currently in the on-disk overflow store.",
+}
+
+
+class MetricsSink(Protocol):
+    """Receiver of the measurements instrumented code emits."""
+
+    def increment(self, name: str, labels: Labels = (), value: float = 1) -> None: ...
+
+    def set_gauge(self, name: str, value: float, labels: Labels = ()) -> None: ...
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None: ...
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self, buckets: int) -> None:
+        self.counts = [0] * buckets
+        self.total = 0.0
+        self.count = 0
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (
+        f'{key}="{value.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """In-memory ``MetricsSink`` with Prometheus text exposition.
+
+    Collectors registered with ``add_collector`` run at the start of every
+    ``render``; gauges that are costly to keep current, such as per-tier
+    task counts, are filled in there instead of on the hot path.
+    """
+
+    def __init__(self, latency_buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> None:
+        self._buckets = latency_buckets
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._gauges: dict[str, dict[Labels, float]] = {}
+        self._histograms: dict[str, dict[Labels, _Histogram]] = {}
+        self._collectors: list[Callable[[MetricsSink], None]] = []
+
+    def increment(self, name: str, labels: Labels = (), value: float = 1) -> None:
+        series = self._counters.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + value
+
+    def set_gauge(self, name: str, value: float, labels: Labels = ()) -> None:
+        self._gauges.setdefault(name, {})[labels] = value
+
+    def observe(self, name: str, value: float, labels: Labels = ()) -> None:
+        series = self._histograms.setdefault(name, {})
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = _Histogram(len(self._buckets))
+        index = bisect.bisect_left(self._buckets, value)
+        if index < len(self._buckets):
+            histogram.counts[index] += 1
+        histogram.total += value
+        histogram.count += 1
+
+    def add_collector(self, collector: Callable[[MetricsSink], None]) -> None:
+        self._collectors.append(collector)
+
+    def value(self, name: str, labels: Labels = ()) -> float | None:
+        """Current value of a counter or gauge series, ``None`` if never set."""
+        for family in (self._counters, self._gauges):
+            if name in family and labels in family[name]:
+                return family[name][labels]
+        return None
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector(self)
+        lines: list[str] = []
+        for kind, family in (("counter", self._counters), ("gauge", self._gauges)):
+            for name in sorted(family):
+                self._header(lines, name, kind)
+                for labels, value in sorted(family[name].items()):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for name in sorted(self._histograms):
+            self._header(lines, name, "histogram")
+            for labels, histogram in sorted(self._histograms[name].items()):
+                cumulative = 0
+                for bound, count in zip(self._buckets, histogram.counts):
+                    cumulative += count
+                    le = _format_labels(labels, (("le", _format_value(bound)),))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                le = _format_labels(labels, (("le", "+Inf"),))
+                lines.append(f"{name}_bucket{le} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _header(lines: list[str], name: str, kind: str) -> None:
+        help_text = METRIC_HELP.get(name)
+        if help_text is not None:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+__all__ = [
+    "Labels",
+    "MetricsSink",
+    "MetricsRegistry",
+    "METRIC_HELP",
+    "DEFAULT_LATENCY_BUCKETS",
+]
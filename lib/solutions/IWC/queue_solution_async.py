@@ -0,0 +1,176 @@
+"""asyncio front end for the queue engines.
+
+Replaces the polling worker from the usage sketch in ``queue_solution_legacy``:
+
+```python
+queue = AsyncQueue()
+
+async def queue_worker():
+    async for task in queue:
+        logger.info(f"Processing task: {task}")
+```
+
+``dequeue`` suspends until work is available and is woken directly by
+``enqueue``, so there is no sleep between a task arriving and its dispatch.
+Engines that hold queued tasks back (``DependencyAwareQueue`` until a
+dependency is acked, ``RateLimitedQueue`` until a token arrives) also wake
+waiters from ``ack``/``nack`` and at their ``throttled_until`` time.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Iterable
+
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.queue_solution_legacy import Queue
+from solutions.IWC.queue_solution_threaded import ThreadSafeQueue
+from solutions.IWC.task_types import TaskDispatch, TaskSubmission
+
+
+class AsyncQueue:
+    """Awaitable wrapper around a queue engine (``HeapQueue`` by default).
+
+    ``enqueue`` stays synchronous and may also be called from another thread
+    (a sync FastAPI endpoint runs in a threadpool): waiters are then woken
+    through ``call_soon_threadsafe``. The wrapped engine itself is not locked,
+    so pass a ``ThreadSafeQueue`` when other threads enqueue.
+    """
+
+    def __init__(self, queue: Queue | HeapQueue | ThreadSafeQueue | None = None) -> None:
+        self._queue = HeapQueue() if queue is None else queue
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def enqueue(self, item: TaskSubmission) -> int:
+        size = self._queue.enqueue(item)
+        self._notify()
+        return size
+
+    def enqueue_many(self, items: Iterable[TaskSubmission]) -> int:
+        size = self._queue.enqueue_many(items)
+        self._notify()
+        return size
+
+    def dequeue_nowait(self) -> TaskDispatch | None:
+        return self._queue.dequeue()
+
+    async def dequeue(self, timeout: float | None = None) -> TaskDispatch | None:
+        """Wait for the next dispatch; ``None`` if ``timeout`` seconds pass first."""
+        if timeout is None:
+            return await self._wait_and_dequeue()
+        try:
+            return await asyncio.wait_for(self._wait_and_dequeue(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def __aiter__(self) -> AsyncQueue:
+        return self
+
+    async def __anext__(self) -> TaskDispatch:
+        # Never exhausted: iteration ends when the consuming task is cancelled.
+        return await self._wait_and_dequeue()
+
+    @property
+    def size(self) -> int:
+        return self._queue.size
+
+    @property
+    def age(self) -> int:
+        return self._queue.age
+
+    def purge(self) -> bool:
+        return self._queue.purge()
+
+    def cancel(self, user_id: int, provider: str | None = None) -> int:
+        cancelled = self._queue.cancel(user_id, provider)
+        # Cancelling a dependency can release its dependants.
+        self._notify()
+        return cancelled
+
+    def ack(self, user_id: int, provider: str) -> bool:
+        """Report a dispatched task completed; ``False`` if the engine has no acks."""
+        ack = getattr(self._queue, "ack", None)
+        if ack is None:
+            return False
+        acked = ack(user_id, provider)
+        self._notify()
+        return acked
+
+    def nack(self, user_id: int, provider: str, requeue: bool = True) -> bool:
+        """Report a dispatched task failed; ``False`` if the engine has no acks."""
+        nack = getattr(self._queue, "nack", None)
+        if nack is None:
+            return False
+        nacked = nack(user_id, provider, requeue)
+        self._notify()
+        return nacked
+
+    async def _wait_and_dequeue(self) -> TaskDispatch:
+        while True:
+            if self._queue.size:
+                dispatch = self._queue.dequeue()
+                if dispatch is not None:
+                    return dispatch
+            loop = asyncio.get_running_loop()
+            self._loop = loop
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            timer = self._wake_when_unthrottled(loop, waiter)
+            try:
+                await waiter
+            except BaseException:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+                if not waiter.cancelled() and self._queue.size:
+                    # We were woken but are leaving: hand the wake-up on.
+                    self._wake()
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    def _wake_when_unthrottled(
+        self, loop: asyncio.AbstractEventLoop, waiter: asyncio.Future[None]
+    ) -> asyncio.TimerHandle | None:
+        throttled_until = getattr(self._queue, "throttled_until", None)
+        until = None if throttled_until is None else throttled_until()
+        if until is None:
+            return None
+
+        def wake() -> None:
+            if not waiter.done():
+                self._waiters.remove(waiter)
+                waiter.set_result(None)
+
+        # Engines report throttled_until on their default time.monotonic clock.
+        return loop.call_later(max(0.0, until - time.monotonic()), wake)
+
+    def _notify(self) -> None:
+        loop = self._loop
+        if loop is None or not self._waiters:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._wake()
+        else:
+            loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self) -> None:
+        available = self._queue.size
+        while available and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                available -= 1
+
+
+__all__ = ["AsyncQueue"]
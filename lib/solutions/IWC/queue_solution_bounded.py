@@ -0,0 +1,535 @@
+"""Heap-backed queue engine with a memory cap and an on-disk overflow.
+
+While a provider is down nothing drains, and the in-memory queue grows
+until the process runs out of memory. A ``BoundedQueue`` holds at most
+``memory_limit`` tasks in memory; past that, the tasks at the back of the
+dispatch order move to a SQLite file and are paged back in as the head
+drains towards them. Every enqueue reports a ``Backpressure`` level so the
+HTTP layer can start answering 429 before the limit is reached.
+
+The legacy dispatch order is kept exactly. A spilled task keeps its heap
+key, so only tasks whose key nothing but a watched event can change are
+spilled:
+
+* Another task for the same user (dedup, rule-of-3 promotion): a user's
+  spilled tasks are paged back in before its next enqueue, ``cancel`` or
+  ``explain``, and users due a promotion are never spilled.
+* Falling behind a deprioritisation window's cut-off: spilled tasks past
+  the cut-off are paged back in before the dequeue that re-keys them.
+  Tasks already aged out, whose cut-off can retreat, stay in memory.
+
+Spilled time keys stay in the age bounds, so ``age`` and the window
+cut-offs come out as if every task were in memory.
+"""
+
+from __future__ import annotations
+
+import heapq
+import os
+import sqlite3
+import sys
+import tempfile
+import weakref
+from dataclasses import replace
+from enum import IntEnum
+from operator import attrgetter, itemgetter
+from typing import Iterable, Iterator, Sequence
+
+from solutions.IWC.dispatch_trace import DispatchKey, TaskExplanation
+from solutions.IWC.ordering_policy import OrderingPolicy
+from solutions.IWC.provider_registry import ProviderRegistry
+from solutions.IWC.queue_metrics import MetricsSink
+from solutions.IWC.queue_solution_heap import (
+    ExpandedTask,
+    HeapQueue,
+    HeapQueueState,
+    _QueuedTask,
+    _new_task,
+    key_columns,
+    key_from_columns,
+)
+from solutions.IWC.queue_solution_legacy import Priority
+from solutions.IWC.task_types import MAX_TIME_KEY, TaskDispatch
+
+DEFAULT_MEMORY_LIMIT = 1_000_000
+DEFAULT_HIGH_WATERMARK = 0.8
+
+_KEY_COLUMNS = "k0, k1, k2, k3, k4, k5"  # the six parts of the heap key
+_KEY_PARAMS = "(?, ?, ?, ?, ?, ?)"
+_SCHEMA = f"""
+DROP TABLE IF EXISTS spilled;
+CREATE TABLE spilled (
+    k0 INTEGER, k1 INTEGER, k2 INTEGER, k3 INTEGER, k4 INTEGER, k5 INTEGER,
+    user_id INTEGER NOT NULL,
+    window_index INTEGER NOT NULL,
+    time_key INTEGER NOT NULL,
+    provider TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    group_key INTEGER NOT NULL,
+    PRIMARY KEY ({_KEY_COLUMNS})
+) WITHOUT ROWID;
+CREATE INDEX spilled_user ON spilled (user_id);
+CREATE INDEX spilled_window ON spilled (window_index, time_key);
+"""
+
+
+class Backpressure(IntEnum):
+    """How close a ``BoundedQueue`` is to its memory limit."""
+
+    NONE = 0
+    HIGH = 1  # past the high watermark: shed what load you can, e.g. with 429s
+    CRITICAL = 2  # over the limit and spilling to disk
+
+
+class EnqueueResult(int):
+    """Queue size after an enqueue, carrying the ``Backpressure`` level it left.
+
+    An ``int``, so callers that only want the size keep working.
+    """
+
+    backpressure: Backpressure
+
+    def __new__(cls, size: int, backpressure: Backpressure = Backpressure.NONE) -> EnqueueResult:
+        result = super().__new__(cls, size)
+        result.backpressure = backpressure
+        return result
+
+    def __repr__(self) -> str:
+        return f"EnqueueResult({int(self)}, {self.backpressure.name})"
+
+
+def _close_store(db: sqlite3.Connection, temporary: str | None) -> None:
+    db.close()
+    if temporary is not None:
+        try:
+            os.unlink(temporary)
+        except FileNotFoundError:
+            pass
+
+
+class _SpillStore:
+    """Spilled tasks in a SQLite table keyed by heap key.
+
+    The database is created on first use, in a temporary file removed on
+    ``close`` (or once the store is garbage collected) unless ``path`` names
+    one. It is overflow space rather than a durable copy: journaling and
+    syncing are off and any previous contents are dropped.
+    """
+
+    def __init__(self, path: str | os.PathLike | None, windows: int) -> None:
+        self._path = path
+        self._db: sqlite3.Connection | None = None
+        self._finalizer: weakref.finalize | None = None
+        self.file: str | None = None  # set once the database is open
+        self._count = 0
+        # Smallest spilled heap key, None when unknown or empty.
+        self._head: tuple | None = None
+        # Per window, a lower bound on the spilled time keys.
+        self._floors = [MAX_TIME_KEY] * windows
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            temporary = None
+            path = self._path
+            if path is None:
+                descriptor, temporary = tempfile.mkstemp(prefix="iwc-spill-", suffix=".sqlite3")
+                os.close(descriptor)
+                path = temporary
+            # Callers serialise access, as they must for the rest of the engine.
+            db = sqlite3.connect(path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode = OFF")
+            db.execute("PRAGMA synchronous = OFF")
+            db.executescript(_SCHEMA)
+            self._db = db
+            self.file = os.fspath(path)
+            self._finalizer = weakref.finalize(self, _close_store, db, temporary)
+        return self._db
+
+    def add(self, tasks: Sequence[_QueuedTask]) -> None:
+        db = self._connection()
+        db.executemany(
+            "INSERT INTO spilled VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    *key_columns(task.heap_key),
+                    task.user_id,
+                    task.window,
+                    task.time_key,
+                    task.provider,
+                    *task.state(),
+                )
+                for task in tasks
+            ],
+        )
+        db.commit()
+        lowest = min(task.heap_key for task in tasks)
+        if not self._count:
+            self._head = lowest
+        elif self._head is not None:
+            self._head = min(self._head, lowest)
+        self._count += len(tasks)
+        floors = self._floors
+        for task in tasks:
+            if task.window >= 0 and task.time_key < floors[task.window]:
+                floors[task.window] = task.time_key
+
+    def head_key(self) -> tuple | None:
+        if self._head is None and self._count:
+            row = self._db.execute(
+                f"SELECT {_KEY_COLUMNS} FROM spilled ORDER BY {_KEY_COLUMNS} LIMIT 1"
+            ).fetchone()
+            self._head = key_from_columns(row)
+        return self._head
+
+    @staticmethod
+    def _load(row: tuple) -> tuple[tuple, _QueuedTask]:
+        heap_key = key_from_columns(row)
+        user_id, window, time_key, provider, priority, group_key = row[6:]
+        task = _new_task(
+            sys.intern(provider),
+            user_id,
+            time_key,
+            window,
+            None if priority == Priority.NORMAL else group_key,
+            heap_key,
+        )
+        return heap_key, task
+
+    def _take(self, where: str, params: tuple) -> list[_QueuedTask]:
+        db = self._db
+        rows = db.execute(f"SELECT * FROM spilled WHERE {where}", params).fetchall()
+        if not rows:
+            return []
+        db.execute(f"DELETE FROM spilled WHERE {where}", params)
+        db.commit()
+        self._count -= len(rows)
+        self._head = None
+        if not self._count:
+            self._floors = [MAX_TIME_KEY] * len(self._floors)
+        return [self._load(row)[1] for row in rows]
+
+    def take_head(self, limit: int) -> list[_QueuedTask]:
+        """Remove and return the ``limit`` tasks with the smallest keys."""
+        rows = self._db.execute(
+            f"SELECT {_KEY_COLUMNS} FROM spilled ORDER BY {_KEY_COLUMNS} LIMIT 1 OFFSET ?",
+            (limit - 1,),
+        ).fetchone()
+        if rows is None:
+            return self._take("1", ())
+        return self._take(f"({_KEY_COLUMNS}) <= {_KEY_PARAMS}", tuple(rows))
+
+    def take_user(self, user_id: int) -> list[_QueuedTask]:
+        return self._take("user_id = ?", (user_id,))
+
+    def take_aged(self, window: int, cutoff: int) -> list[_QueuedTask]:
+        """Remove and return the tasks of ``window`` with a time key below ``cutoff``."""
+        if self._floors[window] >= cutoff:
+            return []
+        tasks = self._take("window_index = ? AND time_key < ?", (window, cutoff))
+        if self._count:
+            (floor,) = self._db.execute(
+                "SELECT MIN(time_key) FROM spilled WHERE window_index = ?", (window,)
+            ).fetchone()
+            self._floors[window] = MAX_TIME_KEY if floor is None else floor
+        return tasks
+
+    def count_below(self, heap_key: tuple) -> int:
+        if not self._count:
+            return 0
+        (count,) = self._db.execute(
+            f"SELECT COUNT(*) FROM spilled WHERE ({_KEY_COLUMNS}) < {_KEY_PARAMS}",
+            key_columns(heap_key),
+        ).fetchone()
+        return count
+
+    def tier_counts(self) -> list[tuple[int, int]]:
+        if not self._count:
+            return []
+        return self._db.execute("SELECT k0, COUNT(*) FROM spilled GROUP BY k0").fetchall()
+
+    def iter_sorted(self, page: int = 256) -> Iterator[tuple[tuple, _QueuedTask]]:
+        """``(heap_key, task)`` in key order, read a page at a time.
+
+        No statement is left open between pages, so an abandoned iterator
+        does not hold up later writes.
+        """
+        if not self._count:
+            return
+        db = self._db
+        rows = db.execute(
+            f"SELECT * FROM spilled ORDER BY {_KEY_COLUMNS} LIMIT ?", (page,)
+        ).fetchall()
+        while rows:
+            for row in rows:
+                yield self._load(row)
+            rows = db.execute(
+                f"SELECT * FROM spilled WHERE ({_KEY_COLUMNS}) > {_KEY_PARAMS} "
+                f"ORDER BY {_KEY_COLUMNS} LIMIT ?",
+                (*rows[-1][:6], page),
+            ).fetchall()
+
+    def clear(self) -> None:
+        if self._count:
+            self._db.execute("DELETE FROM spilled")
+            self._db.commit()
+        self._count = 0
+        self._head = None
+        self._floors = [MAX_TIME_KEY] * len(self._floors)
+
+    def close(self) -> None:
+        if self._finalizer is not None:
+            self._finalizer()
+        self._db = None
+        self._finalizer = None
+        self._count = 0
+        self._head = None
+
+
+class BoundedQueue(HeapQueue):
+    """``HeapQueue`` holding at most ``memory_limit`` tasks in memory.
+
+    ``enqueue`` and ``enqueue_many`` return an ``EnqueueResult``: the queue
+    size as before, carrying the ``backpressure()`` level. ``HIGH`` starts
+    at ``high_watermark`` times the limit; ``CRITICAL`` lasts while tasks
+    are on disk. ``size``, ``age`` and the read-only views count spilled
+    tasks too.
+
+    Only tasks with a settled key are spilled (see the module docstring),
+    so a queue full of users due a promotion or of aged-out bank statements
+    stays over the limit until it drains, reading ``CRITICAL`` meanwhile.
+    The spill file is ``spill_path``, or a temporary file removed by
+    ``close``.
+    """
+
+    def __init__(
+        self,
+        registry: ProviderRegistry | None = None,
+        policy: OrderingPolicy | None = None,
+        memory_limit: int = DEFAULT_MEMORY_LIMIT,
+        spill_path: str | os.PathLike | None = None,
+        high_watermark: float = DEFAULT_HIGH_WATERMARK,
+    ) -> None:
+        if memory_limit < 1:
+            raise ValueError("memory_limit must be at least 1")
+        if not 0 < high_watermark <= 1:
+            raise ValueError("high_watermark must be in (0, 1]")
+        super().__init__(registry=registry, policy=policy)
+        self._memory_limit = memory_limit
+        self._high_watermark = max(1, int(memory_limit * high_watermark))
+        # Spilling and paging move a tenth of the limit at a time, which
+        # amortises the scan for spill victims over many enqueues.
+        self._spill_batch = max(1, memory_limit // 10)
+        self._spill = _SpillStore(spill_path, len(self._policy.window_lengths))
+        # user_id -> number of that user's tasks on disk
+        self._spilled_users: dict[int, int] = {}
+        # In-memory size at which to look for spill victims again after a
+        # scan that could not get back under the limit.
+        self._spill_retry_at = 0
+
+    @property
+    def spilled(self) -> int:
+        return len(self._spill)
+
+    def backpressure(self) -> Backpressure:
+        in_memory = len(self._heap)
+        if self._spill or in_memory > self._memory_limit:
+            return Backpressure.CRITICAL
+        if in_memory >= self._high_watermark:
+            return Backpressure.HIGH
+        return Backpressure.NONE
+
+    def close(self) -> None:
+        """Drop the spilled tasks and remove the spill file."""
+        self._spilled_users.clear()
+        self._spill.close()
+        super().purge()
+
+    def _spill_tail(self) -> None:
+        """Move the lowest-ranked settled tasks out until a batch below the limit."""
+        excess = len(self._heap) - self._memory_limit + self._spill_batch
+        newest = self._time_bounds.newest()
+        cutoffs = [newest - length for length in self._policy.window_lengths]
+        pending, in_window = self._rule_of_3_pending, self._in_window
+        settled = (
+            task
+            for task in self._heap
+            if task.user_id not in pending
+            and (
+                task.window < 0
+                or (task.time_key >= cutoffs[task.window] and task in in_window[task.window])
+            )
+        )
+        victims = heapq.nlargest(excess, settled, key=attrgetter("heap_key"))
+        if not victims:
+            return
+        spilled_users = self._spilled_users
+        for task in victims:
+            self._discard(task)
+            # Still queued, only elsewhere: the age bounds keep counting it.
+            self._time_bounds.add(task.time_key)
+            spilled_users[task.user_id] = spilled_users.get(task.user_id, 0) + 1
+        self._spill.add(victims)
+        if self._metrics is not None:
+            self._metrics.increment("iwc_queue_spilled_total", value=len(victims))
+
+    def _restore(self, tasks: list[_QueuedTask]) -> None:
+        spilled_users = self._spilled_users
+        for task in tasks:
+            self._heap.push(task, task.heap_key)
+            if task.window >= 0:
+                self._in_window[task.window].push(task, task.time_key)
+            self._track(task)
+            self._time_bounds.discard(task.time_key)  # never left the bounds
+            count = spilled_users[task.user_id] - 1
+            if count:
+                spilled_users[task.user_id] = count
+            else:
+                del spilled_users[task.user_id]
+        if tasks and self._metrics is not None:
+            self._metrics.increment("iwc_queue_restored_total", value=len(tasks))
+
+    def _restore_users(self, user_ids: Iterable[int]) -> None:
+        spilled_users = self._spilled_users
+        if spilled_users:
+            for user_id in user_ids:
+                if user_id in spilled_users:
+                    self._restore(self._spill.take_user(user_id))
+
+    def _restore_aged(self) -> None:
+        newest = self._time_bounds.newest()
+        for window, length in enumerate(self._policy.window_lengths):
+            self._restore(self._spill.take_aged(window, newest - length))
+
+    def _settle(self) -> EnqueueResult:
+        in_memory = len(self._heap)
+        if in_memory > self._memory_limit and in_memory >= self._spill_retry_at:
+            self._spill_tail()
+            in_memory = len(self._heap)
+            over = in_memory > self._memory_limit
+            self._spill_retry_at = in_memory + self._spill_batch if over else 0
+        return EnqueueResult(self.size, self.backpressure())
+
+    def enqueue_expanded(
+        self, expanded: Iterable[ExpandedTask], first_seq: int | None = None
+    ) -> EnqueueResult:
+        expanded = list(expanded)
+        self._restore_users({entry[1] for entry in expanded})
+        super().enqueue_expanded(expanded, first_seq)
+        return self._settle()
+
+    def enqueue_many_expanded(
+        self, expanded: Sequence[ExpandedTask], seqs: Sequence[int] | None = None
+    ) -> EnqueueResult:
+        self._restore_users({entry[1] for entry in expanded})
+        super().enqueue_many_expanded(expanded, seqs)
+        return self._settle()
+
+    def dequeue(self) -> TaskDispatch | None:
+        if not self._heap and self._spill:
+            self._restore(self._spill.take_head(self._spill_batch))
+        return super().dequeue()
+
+    def _refresh_keys(self) -> None:
+        spill = self._spill
+        if spill:
+            self._restore_aged()
+        super()._refresh_keys()
+        # Spilled keys are final, so the pop is right once none is smaller.
+        while spill and spill.head_key() < self._heap.peek()[1]:
+            self._restore(spill.take_head(self._spill_batch))
+
+    def dequeue_many(self, n: int) -> list[TaskDispatch]:
+        dispatches: list[TaskDispatch] = []
+        while len(dispatches) < n and self.size:
+            dispatches.append(self.dequeue())
+        return dispatches
+
+    def _describe(self, task: _QueuedTask, heap_key: tuple) -> DispatchKey:
+        key = super()._describe(task, heap_key)
+        spilled = self._spilled_users.get(task.user_id)
+        if not spilled:
+            return key
+        count = key.user_task_count + spilled
+        return replace(key, user_task_count=count, rule_of_3=count >= self._rule_of_3_threshold)
+
+    def explain(self, user_id: int, provider: str) -> TaskExplanation | None:
+        if self._spill:
+            self._restore_users((user_id,))
+            self._restore_aged()
+        explanation = super().explain(user_id, provider)
+        if explanation is None or not self._spill:
+            return explanation
+        task = self._user_task(user_id, provider)
+        heap_key = self._preview_keys().get(task, task.heap_key)
+        return replace(explanation, rank=explanation.rank + self._spill.count_below(heap_key))
+
+    def _ordered_entries(self) -> Iterator[tuple[tuple, _QueuedTask]]:
+        if not self._spill:
+            return super()._ordered_entries()
+        # Paging in what the next dequeue would re-key leaves the order alone.
+        self._restore_aged()
+        return heapq.merge(super()._ordered_entries(), self._spill.iter_sorted())
+
+    def _tier_counts(self) -> dict[int, int]:
+        by_tier = super()._tier_counts()
+        for tier, count in self._spill.tier_counts():
+            by_tier[tier] = by_tier.get(tier, 0) + count
+        return by_tier
+
+    def collect_metrics(self, sink: MetricsSink) -> None:
+        super().collect_metrics(sink)
+        sink.set_gauge("iwc_queue_spilled_tasks", len(self._spill))
+
+    @property
+    def size(self) -> int:
+        return len(self._heap) + len(self._spill)
+
+    def cancel(self, user_id: int, provider: str | None = None) -> int:
+        self._restore_users((user_id,))
+        return super().cancel(user_id, provider)
+
+    def purge(self) -> bool:
+        self._spill.clear()
+        self._spilled_users.clear()
+        return super().purge()
+
+    def export_state(self) -> HeapQueueState:
+        """``HeapQueue.export_state`` covering spilled tasks too.
+
+        Tasks are listed in key order, which is also a heap order, so any
+        ``HeapQueue`` can load the result.
+        """
+        state = super().export_state()
+        if self._spill:
+            spilled = (
+                (
+                    task.provider,
+                    task.user_id,
+                    task.time_key,
+                    *task.state(),
+                    heap_key,
+                    False,  # aged-out tasks are never spilled
+                )
+                for heap_key, task in self._spill.iter_sorted()
+            )
+            in_memory = sorted(state.tasks, key=itemgetter(5))
+            state.tasks = list(heapq.merge(in_memory, spilled, key=itemgetter(5)))
+        return state
+
+    def load_state(self, state: HeapQueueState) -> None:
+        """Replace the queue contents, spilling straight away past the memory limit."""
+        super().load_state(state)
+        self._spill_retry_at = 0
+        self._settle()
+
+
+__all__ = [
+    "Backpressure",
+    "BoundedQueue",
+    "DEFAULT_HIGH_WATERMARK",
+    "DEFAULT_MEMORY_LIMIT",
+    "EnqueueResult",
+]
@@ -0,0 +1,753 @@
+"""Array-backed queue engine: the legacy dispatch order in a third of the memory.
+
+``HeapQueue`` keeps a slotted object per task, its heap key tuple and a dict
+entry per user, which leaves about 370 bytes per queued task however the
+objects are trimmed: headers and boxed integers dominate. ``CompactQueue``
+keeps the same state in columns instead. A task is a *slot* number and its
+fields sit at that index in typed ``array`` columns; the heaps hold slot
+numbers and compare them column by column, a user's tasks are chained
+through a ``next`` column, and the dedup index is an open-addressing table
+over two arrays. Nothing queued is a Python object, so a task costs about
+110 bytes.
+
+The ordering is the heap engine's: the same key columns, rule-of-3
+promotion, deprioritisation windows and ``TieBreakLabeler`` labels, with
+tiers and sub-tiers stored as their rank among the policy's values, which
+orders them the same way. The price is speed: keys are compared column by
+column in Python rather than as tuples in C, so an enqueue or dequeue costs
+about 1.7x what it does on ``HeapQueue`` (still far below the legacy
+re-sort). Pick it when queue depth, not throughput, is the constraint.
+
+It covers the legacy ``Queue`` interface plus ``cancel``; previews,
+explanations, decision traces, metrics and snapshots stay with
+``HeapQueue``. User ids must fit in a signed 64-bit integer.
+"""
+
+from __future__ import annotations
+
+from array import array
+from datetime import datetime
+from typing import Callable, Iterable, Sequence
+
+from solutions.IWC.ordering_policy import DEFAULT_POLICY, OrderingPolicy
+from solutions.IWC.provider_registry import PROVIDER_REGISTRY, ProviderRegistry
+from solutions.IWC.queue_solution_heap import (
+    ExpandedTask,
+    TieBreakLabeler,
+    _explicit_priority,
+    expand_submission,
+)
+from solutions.IWC.queue_solution_legacy import Priority
+from solutions.IWC.task_types import MAX_TIME_KEY, TaskDispatch, TaskSubmission, timestamp_key
+
+# No slot: the end of a chain, or an empty entry in the user index.
+_NONE = -1
+# A user index entry whose user has left; probing carries on past it.
+_DELETED = -2
+# Multiplier spreading user ids over the index (2**64 over the golden ratio).
+_SPREAD = 0x9E3779B97F4A7C15
+
+
+class _UserIndex:
+    """``user_id -> slot`` table in two arrays, probed linearly.
+
+    An entry costs 12 bytes where a dict entry plus its boxed key and value
+    costs about 100. The table is resized to at most a third full and grows
+    again at two thirds, tombstones included.
+    """
+
+    def __init__(self) -> None:
+        self.clear()
+
+    def __len__(self) -> int:
+        return self._live
+
+    def clear(self) -> None:
+        self._allocate(8)
+        self._live = 0
+
+    def _allocate(self, capacity: int) -> None:
+        self._user_ids = array("q", bytes(8 * capacity))
+        self._slots = array("i", [_NONE]) * capacity
+        self._mask = capacity - 1
+        self._filled = 0
+
+    def get(self, user_id: int) -> int:
+        """Slot stored for ``user_id``, or ``_NONE``."""
+        slots = self._slots
+        user_ids = self._user_ids
+        mask = self._mask
+        position = ((user_id * _SPREAD) >> 32) & mask
+        while True:
+            slot = slots[position]
+            if slot == _NONE:
+                return _NONE
+            if slot != _DELETED and user_ids[position] == user_id:
+                return slot
+            position = (position + 1) & mask
+
+    def set(self, user_id: int, slot: int) -> None:
+        slots = self._slots
+        user_ids = self._user_ids
+        mask = self._mask
+        position = ((user_id * _SPREAD) >> 32) & mask
+        reusable = _NONE
+        while True:
+            current = slots[position]
+            if current == _NONE:
+                break
+            if current == _DELETED:
+                if reusable == _NONE:
+                    reusable = position
+            elif user_ids[position] == user_id:
+                slots[position] = slot
+                return
+            position = (position + 1) & mask
+        if reusable == _NONE:
+            reusable = position
+            self._filled += 1
+        slots[reusable] = slot
+        user_ids[reusable] = user_id
+        self._live += 1
+        if self._filled * 3 > len(slots) * 2:
+            self._resize()
+
+    def delete(self, user_id: int) -> None:
+        slots = self._slots
+        user_ids = self._user_ids
+        mask = self._mask
+        position = ((user_id * _SPREAD) >> 32) & mask
+        while slots[position] == _DELETED or user_ids[position] != user_id:
+            position = (position + 1) & mask
+        slots[position] = _DELETED
+        self._live -= 1
+
+    def _resize(self) -> None:
+        entries = [
+            (user_id, slot) for user_id, slot in zip(self._user_ids, self._slots) if slot >= 0
+        ]
+        capacity = 8
+        while capacity < self._live * 3:
+            capacity *= 2
+        self._allocate(capacity)
+        self._filled = len(entries)
+        slots = self._slots
+        user_ids = self._user_ids
+        mask = self._mask
+        for user_id, slot in entries:
+            position = ((user_id * _SPREAD) >> 32) & mask
+            while slots[position] != _NONE:
+                position = (position + 1) & mask
+            slots[position] = slot
+            user_ids[position] = user_id
+
+
+class _SlotHeap:
+    """Binary min-heap of slots ordered by ``before(a, b)``.
+
+    A slot's position is kept in the ``positions`` column, which two heaps
+    may share as long as a slot is only ever in one of them.
+    """
+
+    def __init__(self, positions: array, before: Callable[[int, int], bool]) -> None:
+        self.slots = array("i")
+        self._positions = positions
+        self._before = before
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, slot: int) -> bool:
+        position = self._positions[slot]
+        return 0 <= position < len(self.slots) and self.slots[position] == slot
+
+    def top(self) -> int:
+        return self.slots[0]
+
+    def push(self, slot: int) -> None:
+        self.slots.append(slot)
+        self._sift_up(len(self.slots) - 1, slot)
+
+    def extend(self, slots: Sequence[int]) -> None:
+        """Push ``slots``, heapifying from scratch when they outnumber the heap."""
+        if len(slots) <= len(self.slots):
+            for slot in slots:
+                self.push(slot)
+            return
+        heap = self.slots
+        heap.extend(slots)
+        for position in reversed(range(len(heap) // 2)):
+            self._sift_down(position, heap[position])
+        positions = self._positions
+        for position, slot in enumerate(heap):
+            positions[slot] = position
+
+    def pop(self) -> int:
+        slot = self.slots[0]
+        self._delete_at(0)
+        return slot
+
+    def remove(self, slot: int) -> None:
+        self._delete_at(self._positions[slot])
+
+    def update(self, slot: int) -> None:
+        """Restore heap order after the columns ``before`` reads changed for ``slot``."""
+        position = self._positions[slot]
+        if position and self._before(slot, self.slots[(position - 1) >> 1]):
+            self._sift_up(position, slot)
+        else:
+            self._sift_down(position, slot)
+
+    def clear(self) -> None:
+        del self.slots[:]
+
+    def _delete_at(self, position: int) -> None:
+        last = self.slots.pop()
+        if position < len(self.slots):
+            self._positions[last] = position
+            self.update(last)
+
+    def _sift_up(self, position: int, slot: int) -> None:
+        heap = self.slots
+        positions = self._positions
+        before = self._before
+        while position:
+            parent = (position - 1) >> 1
+            above = heap[parent]
+            if not before(slot, above):
+                break
+            heap[position] = above
+            positions[above] = position
+            position = parent
+        heap[position] = slot
+        positions[slot] = position
+
+    def _sift_down(self, position: int, slot: int) -> None:
+        # Like ``heapq``: walk the hole down to a leaf along the smaller
+        # children, one comparison per level, then sift ``slot`` back up.
+        heap = self.slots
+        positions = self._positions
+        before = self._before
+        size = len(heap)
+        start = position
+        child = 2 * position + 1
+        while child < size:
+            if child + 1 < size and not before(heap[child], heap[child + 1]):
+                child += 1
+            below = heap[child]
+            heap[position] = below
+            positions[below] = position
+            position = child
+            child = 2 * position + 1
+        while position > start:
+            parent = (position - 1) >> 1
+            above = heap[parent]
+            if not before(slot, above):
+                break
+            heap[position] = above
+            positions[above] = position
+            position = parent
+        heap[position] = slot
+        positions[slot] = position
+
+
+class _TimeHeap(_SlotHeap):
+    """``_SlotHeap`` on the time column, earliest or latest first.
+
+    Compares inline instead of calling ``before``; these heaps see as many
+    sifts as the main one.
+    """
+
+    def __init__(self, positions: array, time_keys: array, latest_first: bool) -> None:
+        super().__init__(positions, self._time_before)
+        self._time_keys = time_keys
+        self._sign = -1 if latest_first else 1
+
+    def _time_before(self, a: int, b: int) -> bool:
+        return self._sign * self._time_keys[a] < self._sign * self._time_keys[b]
+
+    def _sift_up(self, position: int, slot: int) -> None:
+        heap = self.slots
+        positions = self._positions
+        time_keys = self._time_keys
+        sign = self._sign
+        key = sign * time_keys[slot]
+        while position:
+            parent = (position - 1) >> 1
+            above = heap[parent]
+            if key >= sign * time_keys[above]:
+                break
+            heap[position] = above
+            positions[above] = position
+            position = parent
+        heap[position] = slot
+        positions[slot] = position
+
+    def _sift_down(self, position: int, slot: int) -> None:
+        heap = self.slots
+        positions = self._positions
+        time_keys = self._time_keys
+        sign = self._sign
+        size = len(heap)
+        start = position
+        child = 2 * position + 1
+        while child < size:
+            right = child + 1
+            if right < size and sign * time_keys[heap[right]] < sign * time_keys[heap[child]]:
+                child = right
+            below = heap[child]
+            heap[position] = below
+            positions[below] = position
+            position = child
+            child = 2 * position + 1
+        key = sign * time_keys[slot]
+        while position > start:
+            parent = (position - 1) >> 1
+            above = heap[parent]
+            if key >= sign * time_keys[above]:
+                break
+            heap[position] = above
+            positions[above] = position
+            position = parent
+        heap[position] = slot
+        positions[slot] = position
+
+
+class CompactQueue:
+    """Drop-in replacement for the legacy ``Queue`` keeping tasks in array columns."""
+
+    def __init__(
+        self, registry: ProviderRegistry | None = None, policy: OrderingPolicy | None = None
+    ) -> None:
+        self._registry = PROVIDER_REGISTRY if registry is None else registry
+        self._policy = (DEFAULT_POLICY if policy is None else policy).compile()
+        self._rule_of_3_threshold = self._policy.rule_of_3_threshold
+        self._window_lengths = self._policy.window_lengths
+        # Tiers and sub-tiers as ranks among the values the policy uses, so
+        # they fit in a byte or two and still compare the same way.
+        tiers = sorted({self._policy.main_tier, *self._policy.window_tiers})
+        self._main_rank = tiers.index(self._policy.main_tier)
+        self._window_ranks = tuple(tiers.index(tier) for tier in self._policy.window_tiers)
+        sub_tiers = self._policy.policy.sub_tiers
+        subs = sorted(
+            {0, sub_tiers.aged_out, sub_tiers.high, sub_tiers.high_in_window, sub_tiers.normal}
+        )
+        self._parked_rank = subs.index(0)
+        self._aged_out_rank = subs.index(sub_tiers.aged_out)
+        self._high_rank = subs.index(sub_tiers.high)
+        self._high_in_window_rank = subs.index(sub_tiers.high_in_window)
+        self._normal_rank = subs.index(sub_tiers.normal)
+        # Providers are numbered as they are first seen.
+        self._provider_ids: dict[str, int] = {}
+        self._provider_names: list[str] = []
+        self._provider_windows: list[int] = []
+
+        # One entry per slot. The heap key is (tier, time, sub, group, label,
+        # label2); ``group`` is the group key of a HIGH task and the time key
+        # of a NORMAL one, and ``label2`` is 0 for a one-part label.
+        self._tier = array("H")
+        self._time = array("q")
+        self._sub = array("B")
+        self._group = array("q")
+        self._label = array("q")
+        self._label2 = array("q")
+        self._user = array("q")
+        self._provider = array("H")
+        self._high = array("B")  # HIGH, by metadata or rule-of-3 promotion
+        # Next slot of the same user's chain, or of the free list.
+        self._next = array("i")
+        self._heap_position = array("i")
+        self._window_position = array("i")
+        self._oldest_position = array("i")
+        self._newest_position = array("i")
+        self._columns = (
+            self._tier,
+            self._time,
+            self._sub,
+            self._group,
+            self._label,
+            self._label2,
+            self._user,
+            self._provider,
+            self._high,
+            self._next,
+            self._heap_position,
+            self._window_position,
+            self._oldest_position,
+            self._newest_position,
+        )
+        self._free = _NONE
+
+        time_keys = self._time
+        self._heap = _SlotHeap(self._heap_position, self._key_order())
+        self._oldest = _TimeHeap(self._oldest_position, time_keys, latest_first=False)
+        self._newest = _TimeHeap(self._newest_position, time_keys, latest_first=True)
+        # Per window, its provider's tasks inside the cut-off (oldest on top)
+        # and aged out of it (newest on top), as in ``HeapQueue``.
+        self._in_window = [
+            _TimeHeap(self._window_position, time_keys, latest_first=False)
+            for _ in self._window_lengths
+        ]
+        self._aged_out = [
+            _TimeHeap(self._window_position, time_keys, latest_first=True)
+            for _ in self._window_lengths
+        ]
+        self._users = _UserIndex()
+        self._rule_of_3_pending: set[int] = set()
+        self._seq = 0
+        self._sorted_through = 0
+        self._labeler = TieBreakLabeler()
+
+    def _key_order(self) -> Callable[[int, int], bool]:
+        tier, time_keys, sub, group = self._tier, self._time, self._sub, self._group
+        label, label2 = self._label, self._label2
+
+        def before(a: int, b: int) -> bool:
+            # Unrolled: nearly every comparison is settled by tier or time.
+            x, y = tier[a], tier[b]
+            if x != y:
+                return x < y
+            x, y = time_keys[a], time_keys[b]
+            if x != y:
+                return x < y
+            x, y = sub[a], sub[b]
+            if x != y:
+                return x < y
+            x, y = group[a], group[b]
+            if x != y:
+                return x < y
+            x, y = label[a], label[b]
+            if x != y:
+                return x < y
+            return label2[a] < label2[b]
+
+        return before
+
+    def _provider_id(self, provider: str) -> int:
+        provider_id = self._provider_ids.get(provider)
+        if provider_id is None:
+            provider_id = self._provider_ids[provider] = len(self._provider_names)
+            self._provider_names.append(provider)
+            self._provider_windows.append(self._policy.window(provider))
+        return provider_id
+
+    def _make_task(
+        self, seq: int, provider: str, user_id: int, time_key: int, metadata: dict[str, object]
+    ) -> int:
+        """Fill a free slot with a new task under its provisional key."""
+        high = _explicit_priority(metadata) == Priority.HIGH
+        group = time_key
+        if high:
+            group_timestamp = metadata.get("group_earliest_timestamp")
+            group = MAX_TIME_KEY if group_timestamp is None else timestamp_key(group_timestamp)
+        provider_id = self._provider_id(provider)
+        window = self._provider_windows[provider_id]
+        # Keyed against the task's own time, like ``HeapQueue._initial_key``:
+        # a windowed task starts inside its window.
+        if high:
+            tier = self._main_rank
+            sub = self._high_rank if window < 0 else self._high_in_window_rank
+        elif window >= 0:
+            tier, sub = self._window_ranks[window], self._parked_rank
+        else:
+            tier, sub = self._main_rank, self._normal_rank
+
+        slot = self._free
+        if slot == _NONE:
+            slot = len(self._time)
+            for column in self._columns:
+                column.append(0)
+        else:
+            self._free = self._next[slot]
+        self._tier[slot] = tier
+        self._time[slot] = time_key
+        self._sub[slot] = sub
+        self._group[slot] = group
+        self._label[slot] = seq
+        self._label2[slot] = 0
+        self._user[slot] = user_id
+        self._provider[slot] = provider_id
+        self._high[slot] = high
+        return slot
+
+    def _insert(self, slot: int) -> None:
+        self._heap.push(slot)
+        self._oldest.push(slot)
+        self._newest.push(slot)
+        window = self._provider_windows[self._provider[slot]]
+        if window >= 0:
+            self._in_window[window].push(slot)
+        self._track(slot)
+
+    def _insert_many(self, slots: list[int]) -> None:
+        self._heap.extend(slots)
+        self._oldest.extend(slots)
+        self._newest.extend(slots)
+        windows = self._provider_windows
+        providers = self._provider
+        for window, in_window in enumerate(self._in_window):
+            in_window.extend([slot for slot in slots if windows[providers[slot]] == window])
+        for slot in slots:
+            self._track(slot)
+
+    def _track(self, slot: int) -> None:
+        user_id = self._user[slot]
+        self._next[slot] = self._users.get(user_id)
+        self._users.set(user_id, slot)
+        if len(self._user_slots(user_id)) >= self._rule_of_3_threshold:
+            self._rule_of_3_pending.add(user_id)
+
+    def _forget(self, slot: int) -> None:
+        """Unlink a task that has left the main heap and free its slot."""
+        user_id = self._user[slot]
+        chain = self._next
+        first = self._users.get(user_id)
+        if first == slot:
+            if chain[slot] == _NONE:
+                self._users.delete(user_id)
+            else:
+                self._users.set(user_id, chain[slot])
+        else:
+            while chain[first] != slot:
+                first = chain[first]
+            chain[first] = chain[slot]
+        self._oldest.remove(slot)
+        self._newest.remove(slot)
+        window = self._provider_windows[self._provider[slot]]
+        if window >= 0:
+            in_window = self._in_window[window]
+            if slot in in_window:
+                in_window.remove(slot)
+            else:
+                self._aged_out[window].remove(slot)
+        chain[slot] = self._free
+        self._free = slot
+
+    def _user_slots(self, user_id: int) -> list[int]:
+        slots = []
+        slot = self._users.get(user_id)
+        while slot != _NONE:
+            slots.append(slot)
+            slot = self._next[slot]
+        return slots
+
+    def _user_task(self, user_id: int, provider: str) -> int:
+        """Slot of the user's queued task for ``provider``, or ``_NONE``."""
+        provider_id = self._provider_ids.get(provider)
+        if provider_id is None:
+            return _NONE
+        slot = self._users.get(user_id)
+        while slot != _NONE and self._provider[slot] != provider_id:
+            slot = self._next[slot]
+        return slot
+
+    def _discard(self, slot: int) -> None:
+        self._heap.remove(slot)
+        self._forget(slot)
+
+    def _offer(
+        self,
+        seq: int,
+        provider: str,
+        user_id: int,
+        timestamp: datetime | str,
+        time_key: int,
+        metadata: dict[str, object],
+    ) -> None:
+        existing = self._user_task(user_id, provider)
+        if existing != _NONE:
+            if time_key >= self._time[existing]:
+                return  # keep the earlier task already in the queue
+            self._discard(existing)
+        self._insert(self._make_task(seq, provider, user_id, time_key, metadata))
+
+    def expand(self, item: TaskSubmission) -> list[ExpandedTask]:
+        """Tasks ``item`` enqueues, dependencies first."""
+        return expand_submission(item, self._registry.dependency_closure(item.provider))
+
+    def enqueue(self, item: TaskSubmission) -> int:
+        for entry in self.expand(item):
+            self._seq += 1
+            self._offer(self._seq, *entry)
+        return self.size
+
+    def enqueue_many(self, items: Iterable[TaskSubmission]) -> int:
+        """Enqueue a batch with the same outcome as enqueueing items one by one.
+
+        Resolves duplicates first, as ``HeapQueue.enqueue_many_expanded`` does,
+        then heapifies the survivors in.
+        """
+        expanded = [entry for item in items for entry in self.expand(item)]
+        batch: dict[tuple[int, str], tuple[int, int, dict[str, object]]] = {}
+        for seq, (provider, user_id, _, time_key, metadata) in enumerate(
+            expanded, start=self._seq + 1
+        ):
+            key = (user_id, provider)
+            pending = batch.get(key)
+            if pending is not None:
+                if time_key >= pending[1]:
+                    continue
+                del batch[key]
+            else:
+                existing = self._user_task(user_id, provider)
+                if existing != _NONE and time_key >= self._time[existing]:
+                    continue
+            batch[key] = (seq, time_key, metadata)
+        self._seq += len(expanded)
+
+        slots: list[int] = []
+        for (user_id, provider), (seq, time_key, metadata) in batch.items():
+            existing = self._user_task(user_id, provider)
+            if existing != _NONE:
+                self._discard(existing)
+            slots.append(self._make_task(seq, provider, user_id, time_key, metadata))
+        self._insert_many(slots)
+        return self.size
+
+    def _apply_rule_of_3(self) -> dict[int, int]:
+        """Promote NORMAL tasks of users at the rule-of-3 count; ``{slot: group}``.
+
+        The new group key is only written when the task is re-keyed, since
+        ``_prepare_dequeue`` still needs the old key.
+        """
+        promoted: dict[int, int] = {}
+        time_keys = self._time
+        high = self._high
+        for user_id in self._rule_of_3_pending:
+            slots = self._user_slots(user_id)
+            if len(slots) < self._rule_of_3_threshold:
+                continue
+            earliest = min(time_keys[slot] for slot in slots)
+            for slot in slots:
+                if not high[slot]:
+                    high[slot] = True
+                    promoted[slot] = earliest
+        self._rule_of_3_pending.clear()
+        return promoted
+
+    def _sweep_windows(self, queue_newest: int) -> list[int]:
+        """Move tasks across their window's cut-off and return the ones that moved."""
+        time_keys = self._time
+        flipped: list[int] = []
+        for length, fresh, old in zip(self._window_lengths, self._in_window, self._aged_out):
+            cutoff = queue_newest - length
+            while fresh and time_keys[fresh.top()] < cutoff:
+                slot = fresh.pop()
+                old.push(slot)
+                flipped.append(slot)
+            while old and time_keys[old.top()] >= cutoff:
+                slot = old.pop()
+                fresh.push(slot)
+                flipped.append(slot)
+        return flipped
+
+    def _ranks(self, slot: int, queue_newest: int) -> tuple[int, int]:
+        """``(tier, sub)`` ranks of the policy's ``sort_key`` for ``slot``."""
+        time_key = self._time[slot]
+        window = self._provider_windows[self._provider[slot]]
+        in_window = window >= 0 and queue_newest - time_key <= self._window_lengths[window]
+        if self._high[slot]:
+            return self._main_rank, self._high_in_window_rank if in_window else self._high_rank
+        if in_window:
+            return self._window_ranks[window], self._parked_rank
+        if window >= 0:
+            return self._main_rank, self._aged_out_rank
+        return self._main_rank, self._normal_rank
+
+    def _heap_key(self, slot: int) -> tuple:
+        return (
+            self._tier[slot],
+            self._time[slot],
+            self._sub[slot],
+            self._group[slot],
+            self._label[slot],
+            self._label2[slot],
+        )
+
+    def _set_key(self, slot: int, tier: int, sub: int, group: int) -> None:
+        self._tier[slot] = tier
+        self._sub[slot] = sub
+        self._group[slot] = group
+
+    def _prepare_dequeue(self, queue_newest: int) -> None:
+        """Re-key every task whose key changed, as ``HeapQueue`` does."""
+        promoted = self._apply_rule_of_3()
+        flipped = self._sweep_windows(queue_newest)
+        moved: list[tuple[int, tuple, tuple]] = []
+        for slot in dict.fromkeys([*promoted, *flipped]):
+            tier, sub = self._ranks(slot, queue_newest)
+            group = promoted.get(slot, self._group[slot])
+            if (tier, sub, group) == (self._tier[slot], self._sub[slot], self._group[slot]):
+                continue
+            if self._label[slot] > self._sorted_through:
+                # Still at the tail of the legacy list: insertion order holds.
+                self._set_key(slot, tier, sub, group)
+                self._heap.update(slot)
+            else:
+                moved.append((slot, self._heap_key(slot), (tier, self._time[slot], sub, group)))
+        for slot, heap_key in self._labeler.relabel(moved, self._sorted_through):
+            self._set_key(slot, heap_key[0], heap_key[2], heap_key[3])
+            self._label[slot] = heap_key[4]
+            self._label2[slot] = heap_key[5] if len(heap_key) == 6 else 0
+            self._heap.update(slot)
+
+    def dequeue(self) -> TaskDispatch | None:
+        if not self._heap:
+            return None
+
+        self._prepare_dequeue(self._time[self._newest.top()])
+        self._sorted_through = self._seq
+        slot = self._heap.pop()
+        dispatch = TaskDispatch(
+            provider=self._provider_names[self._provider[slot]],
+            user_id=self._user[slot],
+        )
+        self._forget(slot)
+        return dispatch
+
+    def dequeue_many(self, n: int) -> list[TaskDispatch]:
+        """Dispatch up to ``n`` tasks in the order ``n`` dequeues would."""
+        dispatches: list[TaskDispatch] = []
+        while len(dispatches) < n and self._heap:
+            dispatches.append(self.dequeue())
+        return dispatches
+
+    @property
+    def size(self) -> int:
+        return len(self._heap)
+
+    @property
+    def age(self) -> int:
+        if self.size <= 1:
+            return 0
+
+        return (self._time[self._newest.top()] - self._time[self._oldest.top()]) // 1_000_000
+
+    def purge(self) -> bool:
+        for column in self._columns:
+            del column[:]
+        self._free = _NONE
+        for heap in (self._heap, self._oldest, self._newest, *self._in_window, *self._aged_out):
+            heap.clear()
+        self._users.clear()
+        self._rule_of_3_pending.clear()
+        self._sorted_through = self._seq
+        return True
+
+    def cancel(self, user_id: int, provider: str | None = None) -> int:
+        """Remove the user's queued tasks, or only its ``provider`` task.
+
+        Returns the number of tasks removed; the rest of the queue keeps its
+        order, as with ``HeapQueue.cancel``.
+        """
+        if provider is None:
+            slots = self._user_slots(user_id)
+        else:
+            slot = self._user_task(user_id, provider)
+            slots = [] if slot == _NONE else [slot]
+        for slot in slots:
+            self._discard(slot)
+        return len(slots)
+
+
+__all__ = ["CompactQueue"]
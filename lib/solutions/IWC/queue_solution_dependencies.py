@@ -0,0 +1,212 @@
+"""Heap-backed queue engine that holds tasks back until their inputs are done.
+
+Enqueueing ``credit_check`` also enqueues ``companies_house`` ahead of it,
+but the plain engines would hand both to parallel workers at once. Here a
+dequeued task stays *in flight* until the worker calls ``ack`` (it
+completed) or ``nack`` (it failed), and a queued task is only dispatched
+once none of the providers it depends on is queued or in flight for the
+same user. The same (user, provider) is never in flight twice either.
+
+Readiness is kept in an index: the ``ready`` heap holds exactly the
+dispatchable tasks, under the same keys as the main heap, so ``dequeue``
+pops the best ready task in O(log N). Readiness only changes for the user
+whose tasks change, and a user holds at most one task per provider, so
+each enqueue, dispatch, ``ack`` or ``nack`` re-checks a handful of tasks.
+"""
+
+from __future__ import annotations
+
+import sys
+from dataclasses import dataclass, field
+
+from solutions.IWC.indexed_heap import IndexedHeap
+from solutions.IWC.ordering_policy import OrderingPolicy
+from solutions.IWC.provider_registry import ProviderRegistry
+from solutions.IWC.queue_solution_heap import (
+    HeapQueue,
+    HeapQueueState,
+    _QueuedTask,
+    _new_task,
+)
+from solutions.IWC.queue_solution_legacy import Priority
+from solutions.IWC.queue_solution_threaded import ThreadSafeQueue
+from solutions.IWC.task_types import TaskDispatch
+
+# (provider, user_id, time key, priority, group key) of a task awaiting ack or nack.
+InFlightState = tuple[str, int, int, int, int]
+
+
+@dataclass(slots=True)
+class DependencyQueueState(HeapQueueState):
+    """``HeapQueueState`` plus the dispatched tasks still awaiting ``ack`` or ``nack``."""
+
+    in_flight: list[InFlightState] = field(default_factory=list)
+
+
+class DependencyAwareQueue(HeapQueue):
+    """``HeapQueue`` that dispatches a task only once its dependencies completed.
+
+    Among ready tasks the legacy order holds. ``dequeue`` returns ``None``
+    while every queued task is waiting on work in flight, so ``size`` can
+    be non-zero with nothing to hand out. ``peek``, ``top_k`` and
+    ``iter_ordered`` list ready tasks only; ``explain`` ranks a task among
+    all queued ones.
+    """
+
+    def __init__(
+        self, registry: ProviderRegistry | None = None, policy: OrderingPolicy | None = None
+    ) -> None:
+        super().__init__(registry=registry, policy=policy)
+        self._candidates = IndexedHeap()
+        # (user_id, provider) -> the dispatched task awaiting ack or nack
+        self._in_flight: dict[tuple[int, str], _QueuedTask] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    @property
+    def ready(self) -> int:
+        return len(self._candidates)
+
+    def _is_ready(self, task: _QueuedTask) -> bool:
+        user_id = task.user_id
+        in_flight = self._in_flight
+        if (user_id, task.provider) in in_flight:
+            return False
+        queued = {queued.provider for queued in self._user_tasks(user_id)}
+        for dependency in self._registry.dependency_closure(task.provider):
+            if dependency in queued or (user_id, dependency) in in_flight:
+                return False
+        return True
+
+    def _refresh_user(self, user_id: int) -> None:
+        ready = self._candidates
+        for task in self._user_tasks(user_id):
+            if self._is_ready(task):
+                if task not in ready:
+                    ready.push(task, task.heap_key)
+            elif task in ready:
+                ready.remove(task)
+
+    def _track(self, task: _QueuedTask) -> None:
+        super()._track(task)
+        self._refresh_user(task.user_id)
+
+    def _forget(self, task: _QueuedTask) -> None:
+        super()._forget(task)
+        if task in self._candidates:
+            self._candidates.remove(task)
+        # Callers re-check the user: a replacement task or the move to in
+        # flight follows straight away and keeps dependants blocked.
+
+    def _rekey(self, task: _QueuedTask, heap_key: tuple) -> None:
+        super()._rekey(task, heap_key)
+        if task in self._candidates:
+            self._candidates.update(task, heap_key)
+
+    def _dispatch(self, task: _QueuedTask) -> TaskDispatch:
+        self._in_flight[(task.user_id, task.provider)] = task
+        self._refresh_user(task.user_id)
+        return super()._dispatch(task)
+
+    def ack(self, user_id: int, provider: str) -> bool:
+        """Mark a dispatched task completed; ``False`` if it was not in flight."""
+        if self._in_flight.pop((user_id, provider), None) is None:
+            return False
+        self._refresh_user(user_id)
+        return True
+
+    def nack(self, user_id: int, provider: str, requeue: bool = True) -> bool:
+        """Mark a dispatched task failed; ``False`` if it was not in flight.
+
+        With ``requeue`` it goes back into the queue with its timestamp and
+        priority, so its dependants stay blocked until a
+        retry succeeds; if a newer submission for the same provider is
+        queued meanwhile, the earlier timestamp wins as on enqueue. Without
+        it the task is dropped and its dependants become dispatchable.
+        """
+        task = self._in_flight.pop((user_id, provider), None)
+        if task is None:
+            return False
+        if requeue:
+            self._requeue(task)
+        self._refresh_user(user_id)
+        return True
+
+    def _requeue(self, task: _QueuedTask) -> None:
+        existing = self._user_task(task.user_id, task.provider)
+        if existing is not None:
+            if task.time_key >= existing.time_key:
+                return
+            self._discard(existing)
+        self._seq += 1
+        task.heap_key = self._initial_key(task, self._seq)
+        self._insert(task)
+
+    def cancel(self, user_id: int, provider: str | None = None) -> int:
+        """Remove queued tasks as ``HeapQueue.cancel``; tasks in flight are unaffected.
+
+        Cancelling a dependency releases the user's tasks that waited on it.
+        """
+        cancelled = super().cancel(user_id, provider)
+        if cancelled:
+            self._refresh_user(user_id)
+        return cancelled
+
+    def purge(self) -> bool:
+        """Drop every queued task; tasks in flight still await ``ack``/``nack``."""
+        self._candidates.clear()
+        return super().purge()
+
+    def export_state(self) -> DependencyQueueState:
+        state = super().export_state()
+        return DependencyQueueState(
+            tasks=state.tasks,
+            seq=state.seq,
+            sorted_through=state.sorted_through,
+            labels=state.labels,
+            in_flight=[
+                (task.provider, task.user_id, task.time_key, *task.state())
+                for task in self._in_flight.values()
+            ],
+        )
+
+    def load_state(self, state: HeapQueueState) -> None:
+        """Replace queued and in-flight tasks; a plain ``HeapQueueState`` has none in flight."""
+        super().load_state(state)
+        in_flight = self._in_flight
+        in_flight.clear()
+        for provider, user_id, time_key, priority, group_key in getattr(state, "in_flight", ()):
+            provider = sys.intern(provider)
+            in_flight[(user_id, provider)] = _new_task(
+                provider,
+                user_id,
+                time_key,
+                self._policy.window(provider),
+                None if priority == Priority.NORMAL else group_key,
+            )
+        for user_id in self._users:
+            self._refresh_user(user_id)
+
+
+class ThreadSafeDependencyQueue(ThreadSafeQueue):
+    """``DependencyAwareQueue`` shared by request threads and parallel workers."""
+
+    engine_type = DependencyAwareQueue
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return self._queue.in_flight
+
+    def ack(self, user_id: int, provider: str) -> bool:
+        with self._lock:
+            return self._queue.ack(user_id, provider)
+
+    def nack(self, user_id: int, provider: str, requeue: bool = True) -> bool:
+        with self._lock:
+            return self._queue.nack(user_id, provider, requeue)
+
+
+__all__ = ["DependencyAwareQueue", "DependencyQueueState", "ThreadSafeDependencyQueue"]
@@ -0,0 +1,575 @@
+"""Crash-safe wrapper around the heap-backed queue engine.
+
+Every operation that changes the queue is appended to a write-ahead log
+before the call returns, and the whole queue state is periodically written
+to a snapshot file. Recovery loads the snapshot and replays the log written
+after it, which restores the exact dispatch order (tie-break labels and
+all) rather than an approximation rebuilt from the tasks alone.
+
+Layout of the queue directory::
+
+    snapshot.bin        latest snapshot, replaced atomically
+    wal.<segment>.log   log segments; a snapshot names the first one to replay
+
+Log records are self-delimiting and written in blocks, one per group commit,
+framed as ``<length:u32><crc32:u32><records>``. Recovery stops at the first
+short or corrupt block, which is where a crash tore the tail, and truncates
+it away.
+"""
+
+from __future__ import annotations
+
+import gc
+import mmap
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from solutions.IWC.ordering_policy import OrderingPolicy
+from solutions.IWC.provider_registry import ProviderRegistry
+from solutions.IWC.queue_solution_heap import (
+    HeapQueue,
+    HeapQueueState,
+    _explicit_priority,
+    key_columns,
+    key_from_columns,
+)
+from solutions.IWC.queue_solution_legacy import Priority
+from solutions.IWC.task_types import (
+    MAX_TIME_KEY,
+    TaskDispatch,
+    TaskSubmission,
+    datetime_from_key,
+    timestamp_key,
+)
+
+SNAPSHOT_FILE = "snapshot.bin"
+DEFAULT_FSYNC_INTERVAL = 0.02
+DEFAULT_SNAPSHOT_EVERY = 1_000_000
+
+_BLOCK_HEADER = struct.Struct("<II")
+# user_id, timestamp kind, priority, group key, provider len, timestamp len
+_SUBMISSION = struct.Struct("<qBBqHH")
+_COUNT = struct.Struct("<I")
+_USER = struct.Struct("<q")
+_TEXT_LENGTH = struct.Struct("<H")
+
+_ENQUEUE = b"E"
+_ENQUEUE_MANY = b"M"
+_DEQUEUE = b"D"
+_PURGE = b"P"
+_CANCEL = b"C"  # user_id
+_CANCEL_PROVIDER = b"c"  # user_id, provider text
+
+_DEQUEUE_ONE = _DEQUEUE + _COUNT.pack(1)
+
+_TIMESTAMP_TEXT = 0
+_TIMESTAMP_DATETIME = 1
+
+_SNAPSHOT_MAGIC = b"IWCSNAP3"
+# segment, seq, sorted_through, next_low, next_high, provider count, task count
+_SNAPSHOT_HEADER = struct.Struct("<8sqqqqqII")
+# provider index, user_id, time key, priority, group key,
+# heap key tier, sub-tier, group and two labels, old bank flag; tiers and
+# sub-tiers are whatever the ordering policy says, negative ones included
+_SNAPSHOT_TASK = struct.Struct("<HqqBqqqqqqB")
+
+
+def _segment_path(directory: Path, segment: int) -> Path:
+    return directory / f"wal.{segment:08d}.log"
+
+
+def _segments(directory: Path) -> list[int]:
+    return sorted(
+        int(path.name.split(".")[1]) for path in directory.glob("wal.*.log")
+    )
+
+
+def _fsync_directory(directory: Path) -> None:
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _encode_submission(item: TaskSubmission) -> bytes:
+    """Log a submission as plain integers and text.
+
+    Of the metadata only what the heap engine orders by is kept, the
+    priority and the group time key, so replay never deserialises
+    caller-supplied objects.
+    """
+    provider = item.provider.encode()
+    timestamp = item.timestamp
+    if isinstance(timestamp, datetime):
+        kind, timestamp_text = _TIMESTAMP_DATETIME, timestamp.isoformat().encode()
+    else:
+        kind, timestamp_text = _TIMESTAMP_TEXT, str(timestamp).encode()
+    # Invalid priorities are treated as NORMAL, so they log as NORMAL.
+    priority, group_key = Priority.NORMAL, MAX_TIME_KEY
+    if item.metadata and _explicit_priority(item.metadata) == Priority.HIGH:
+        priority = Priority.HIGH
+        group_timestamp = item.metadata.get("group_earliest_timestamp")
+        if group_timestamp is not None:
+            group_key = timestamp_key(group_timestamp)
+    try:
+        header = _SUBMISSION.pack(
+            item.user_id, kind, priority, group_key, len(provider), len(timestamp_text)
+        )
+    except struct.error as error:
+        raise ValueError(f"Cannot log {item!r}: {error}") from None
+    return header + provider + timestamp_text
+
+
+def _decode_submission(payload: memoryview, offset: int) -> tuple[TaskSubmission, int]:
+    user_id, kind, priority, group_key, provider_length, timestamp_length = (
+        _SUBMISSION.unpack_from(payload, offset)
+    )
+    offset += _SUBMISSION.size
+    provider = str(payload[offset : offset + provider_length], "utf-8")
+    offset += provider_length
+    timestamp: datetime | str = str(payload[offset : offset + timestamp_length], "utf-8")
+    offset += timestamp_length
+    if kind == _TIMESTAMP_DATETIME:
+        timestamp = datetime.fromisoformat(timestamp)
+    metadata: dict[str, object] = {}
+    if priority == Priority.HIGH:
+        metadata = {
+            "priority": Priority.HIGH,
+            "group_earliest_timestamp": datetime_from_key(group_key),
+        }
+    return TaskSubmission(provider, user_id, timestamp, metadata), offset
+
+
+def _read_blocks(path: Path) -> Iterator[tuple[int, memoryview]]:
+    """Yield ``(end offset, records)`` for each intact block of a segment."""
+    data = memoryview(path.read_bytes())
+    offset = 0
+    while offset + _BLOCK_HEADER.size <= len(data):
+        length, checksum = _BLOCK_HEADER.unpack_from(data, offset)
+        start = offset + _BLOCK_HEADER.size
+        records = data[start : start + length]
+        if len(records) < length or zlib.crc32(records) != checksum:
+            return
+        offset = start + length
+        yield offset, records
+
+
+class _WriteAheadLog:
+    """Append-only log segment with group-commit ``fsync``.
+
+    ``append`` only adds the encoded record to a list guarded by the
+    owner's ``lock``, which callers already hold while they apply the
+    operation. A background thread takes that lock just long enough to swap
+    the list out, then writes and syncs it as one block, so everything
+    appended meanwhile shares one checksum and one ``fsync``; ``wait``
+    blocks until a given record is on disk. With ``fsync_interval=None``
+    every append is written and synced before it returns.
+
+    A failed write leaves the log unusable: ``check``, ``wait`` and ``sync``
+    raise ``OSError`` from then on, and the group-commit thread stops.
+    """
+
+    def __init__(self, path: Path, fsync_interval: float | None, lock: threading.Lock) -> None:
+        self._file = open(path, "ab", buffering=0)
+        self._fsync_interval = fsync_interval
+        self._lock = lock
+        self._records: list[bytes] = []
+        self._appended = 0
+        # Keeps buffers reaching the file in the order they were taken.
+        self._io_lock = threading.Lock()
+        self._durable = 0
+        self._durable_changed = threading.Condition()
+        self._failure: BaseException | None = None
+        self._stopping = threading.Event()
+        if fsync_interval is not None:
+            threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+    def check(self) -> None:
+        """Raise if an earlier write failed, so nothing more can be made durable."""
+        if self._failure is not None:
+            raise OSError("Write-ahead log stopped after a failed write") from self._failure
+
+    def append(self, record: bytes) -> int:
+        """Buffer one record and return its log sequence number; needs ``lock``."""
+        self._records.append(record)
+        self._appended += 1
+        if self._fsync_interval is None:
+            self._write(*self._take())
+        return self._appended
+
+    def wait(self, lsn: int) -> None:
+        """Block until record ``lsn`` is durable; must not hold ``lock``."""
+        with self._durable_changed:
+            while self._durable < lsn and self._failure is None and not self._file.closed:
+                self._durable_changed.wait()
+            if self._durable < lsn:
+                self.check()
+
+    def sync(self) -> None:
+        """Write and ``fsync`` everything appended so far; must not hold ``lock``."""
+        with self._lock:
+            if self._file.closed:
+                return
+            records, lsn = self._take()
+        self._write(records, lsn)
+
+    def close(self) -> None:
+        """Sync and close the segment; needs ``lock``."""
+        self._stopping.set()
+        try:
+            self._write(*self._take())
+        finally:
+            self._file.close()
+            with self._durable_changed:
+                self._durable_changed.notify_all()
+
+    def _take(self) -> tuple[list[bytes], int]:
+        # Called with ``lock`` held; returns holding ``_io_lock`` for ``_write``.
+        self._io_lock.acquire()
+        records, self._records = self._records, []
+        return records, self._appended
+
+    def _write(self, records: list[bytes], lsn: int) -> None:
+        try:
+            self.check()
+            if records:
+                buffer = bytearray(_BLOCK_HEADER.size)
+                buffer += b"".join(records)
+                with memoryview(buffer) as block:
+                    checksum = zlib.crc32(block[_BLOCK_HEADER.size :])
+                _BLOCK_HEADER.pack_into(buffer, 0, len(buffer) - _BLOCK_HEADER.size, checksum)
+                self._file.write(buffer)
+                os.fsync(self._file.fileno())
+        except Exception as error:
+            with self._durable_changed:
+                if self._failure is None:
+                    self._failure = error
+                self._durable_changed.notify_all()
+            raise
+        finally:
+            self._io_lock.release()
+        with self._durable_changed:
+            self._durable = max(self._durable, lsn)
+            self._durable_changed.notify_all()
+
+    def _flush_periodically(self) -> None:
+        while not self._stopping.wait(self._fsync_interval):
+            try:
+                self.sync()
+            except Exception:
+                return  # kept in ``_failure`` and raised to the callers
+
+
+def _encode_snapshot(state: HeapQueueState, segment: int) -> bytes:
+    providers: dict[str, int] = {}
+    pack = _SNAPSHOT_TASK.pack
+    tasks = bytearray()
+    for provider, user_id, time_key, priority, group_key, heap_key, old in state.tasks:
+        index = providers.setdefault(provider, len(providers))
+        tier, _, sub_tier, group, low_label, high_label = key_columns(heap_key)
+        tasks += pack(
+            index, user_id, time_key, priority, group_key,
+            tier, sub_tier, group, low_label, high_label, old,
+        )
+    names = b"".join(
+        _TEXT_LENGTH.pack(len(encoded)) + encoded
+        for encoded in (provider.encode() for provider in providers)
+    )
+    header = _SNAPSHOT_HEADER.pack(
+        _SNAPSHOT_MAGIC, segment, state.seq, state.sorted_through, *state.labels,
+        len(providers), len(state.tasks),
+    )
+    body = header + names + tasks
+    return body + _COUNT.pack(zlib.crc32(body))
+
+
+def _decode_snapshot(data: memoryview) -> tuple[HeapQueueState, int]:
+    body = data[: -_COUNT.size]
+    if zlib.crc32(body) != _COUNT.unpack_from(data, len(body))[0]:
+        raise ValueError("Queue snapshot is corrupt")
+    magic, segment, seq, sorted_through, next_low, next_high, provider_count, task_count = (
+        _SNAPSHOT_HEADER.unpack_from(body)
+    )
+    if magic != _SNAPSHOT_MAGIC:
+        raise ValueError("Not a queue snapshot")
+    offset = _SNAPSHOT_HEADER.size
+    providers: list[str] = []
+    for _ in range(provider_count):
+        (length,) = _TEXT_LENGTH.unpack_from(body, offset)
+        offset += _TEXT_LENGTH.size
+        providers.append(str(body[offset : offset + length], "utf-8"))
+        offset += length
+    end = offset + task_count * _SNAPSHOT_TASK.size
+    tasks = [
+        (
+            providers[index], user_id, time_key, priority, group_key,
+            key_from_columns((tier, time_key, sub_tier, group, low_label, high_label)),
+            bool(old),
+        )
+        for (
+            index, user_id, time_key, priority, group_key,
+            tier, sub_tier, group, low_label, high_label, old,
+        ) in _SNAPSHOT_TASK.iter_unpack(body[offset:end])
+    ]
+    state = HeapQueueState(
+        tasks=tasks, seq=seq, sorted_through=sorted_through, labels=(next_low, next_high)
+    )
+    return state, segment
+
+
+class DurableQueue:
+    """``HeapQueue`` whose contents survive a crash or restart.
+
+    Opening a directory recovers whatever was queued there. Records are
+    synced by a group-commit thread every ``fsync_interval`` seconds, so a
+    crash loses at most that window unless ``wait_for_commit`` makes every
+    call wait for its record; concurrent callers then share each ``fsync``.
+    Dequeues are logged after the task is taken, so a crash can redeliver a
+    task but never loses one that was not handed out. A snapshot is taken
+    after every ``snapshot_every`` logged operations (``None`` disables
+    them) and on ``close``. Reopen a directory with the ordering ``policy``
+    it was written with; snapshots store keys computed under it.
+
+    Submissions are encoded before the queue changes, so one the log cannot
+    store is rejected without being queued. Once a log write fails every
+    call that changes the queue raises ``OSError``, as do callers waiting on
+    a commit that never happened.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str],
+        *,
+        registry: ProviderRegistry | None = None,
+        policy: OrderingPolicy | None = None,
+        fsync_interval: float | None = DEFAULT_FSYNC_INTERVAL,
+        wait_for_commit: bool = False,
+        snapshot_every: int | None = DEFAULT_SNAPSHOT_EVERY,
+    ) -> None:
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._queue = HeapQueue(registry=registry, policy=policy)
+        self._fsync_interval = fsync_interval
+        self._wait_for_commit = wait_for_commit
+        self._snapshot_every = snapshot_every
+        self._lock = threading.Lock()
+        self._segment = self._recover()
+        self._since_snapshot = 0
+        self._log = _WriteAheadLog(
+            _segment_path(self._directory, self._segment), fsync_interval, self._lock
+        )
+
+    def __enter__(self) -> DurableQueue:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def _recover(self) -> int:
+        # Recovery allocates millions of objects that all stay alive;
+        # collector passes over them would only slow it down.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._load_directory()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _load_directory(self) -> int:
+        segment = 0
+        snapshot = self._directory / SNAPSHOT_FILE
+        if snapshot.exists():
+            with open(snapshot, "rb") as file, mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ
+            ) as mapped:
+                with memoryview(mapped) as data:
+                    state, segment = _decode_snapshot(data)
+            self._queue.load_state(state)
+        for number in _segments(self._directory):
+            if number < segment:
+                continue
+            path = _segment_path(self._directory, number)
+            intact = 0
+            for intact, records in _read_blocks(path):
+                self._replay(records)
+            if intact < path.stat().st_size:
+                os.truncate(path, intact)
+            segment = number
+        return segment
+
+    def _replay(self, records: memoryview) -> None:
+        queue = self._queue
+        offset = 0
+        while offset < len(records):
+            op = bytes(records[offset : offset + 1])
+            offset += 1
+            if op == _ENQUEUE:
+                item, offset = _decode_submission(records, offset)
+                queue.enqueue(item)
+            elif op == _ENQUEUE_MANY:
+                (count,) = _COUNT.unpack_from(records, offset)
+                offset += _COUNT.size
+                items = []
+                for _ in range(count):
+                    item, offset = _decode_submission(records, offset)
+                    items.append(item)
+                queue.enqueue_many(items)
+            elif op == _DEQUEUE:
+                (count,) = _COUNT.unpack_from(records, offset)
+                offset += _COUNT.size
+                queue.dequeue_many(count)
+            elif op == _PURGE:
+                queue.purge()
+            elif op == _CANCEL or op == _CANCEL_PROVIDER:
+                (user_id,) = _USER.unpack_from(records, offset)
+                offset += _USER.size
+                provider = None
+                if op == _CANCEL_PROVIDER:
+                    (length,) = _TEXT_LENGTH.unpack_from(records, offset)
+                    offset += _TEXT_LENGTH.size
+                    provider = str(records[offset : offset + length], "utf-8")
+                    offset += length
+                queue.cancel(user_id, provider)
+            else:
+                raise ValueError(f"Unknown write-ahead log record {op!r}")
+
+    def _logged(self, record: bytes) -> int:
+        """Log an operation just applied; the caller holds the lock."""
+        lsn = self._log.append(record)
+        self._since_snapshot += 1
+        if self._snapshot_every is not None and self._since_snapshot >= self._snapshot_every:
+            self._snapshot_locked()
+        return lsn
+
+    def _committed(self, log: _WriteAheadLog, lsn: int) -> None:
+        # Called after releasing the lock, so other callers join the commit.
+        if self._wait_for_commit:
+            log.wait(lsn)
+
+    def enqueue(self, item: TaskSubmission) -> int:
+        record = _ENQUEUE + _encode_submission(item)
+        with self._lock:
+            self._log.check()
+            size = self._queue.enqueue(item)
+            log, lsn = self._log, self._logged(record)
+        if self._wait_for_commit:
+            log.wait(lsn)
+        return size
+
+    def enqueue_many(self, items: Iterable[TaskSubmission]) -> int:
+        items = list(items)
+        payload = b"".join(
+            [_ENQUEUE_MANY, _COUNT.pack(len(items))]
+            + [_encode_submission(item) for item in items]
+        )
+        with self._lock:
+            self._log.check()
+            size = self._queue.enqueue_many(items)
+            log, lsn = self._log, self._logged(payload)
+        self._committed(log, lsn)
+        return size
+
+    def dequeue(self) -> TaskDispatch | None:
+        with self._lock:
+            self._log.check()
+            dispatch = self._queue.dequeue()
+            if dispatch is None:
+                return None
+            log, lsn = self._log, self._logged(_DEQUEUE_ONE)
+        if self._wait_for_commit:
+            log.wait(lsn)
+        return dispatch
+
+    def dequeue_many(self, n: int) -> list[TaskDispatch]:
+        with self._lock:
+            self._log.check()
+            dispatches = self._queue.dequeue_many(n)
+            if not dispatches:
+                return dispatches
+            log, lsn = self._log, self._logged(_DEQUEUE + _COUNT.pack(len(dispatches)))
+        self._committed(log, lsn)
+        return dispatches
+
+    @property
+    def size(self) -> int:
+        return self._queue.size
+
+    @property
+    def age(self) -> int:
+        with self._lock:
+            return self._queue.age
+
+    def purge(self) -> bool:
+        with self._lock:
+            self._log.check()
+            self._queue.purge()
+            log, lsn = self._log, self._logged(_PURGE)
+        self._committed(log, lsn)
+        return True
+
+    def cancel(self, user_id: int, provider: str | None = None) -> int:
+        if provider is None:
+            payload = _CANCEL + _USER.pack(user_id)
+        else:
+            encoded = provider.encode()
+            payload = (
+                _CANCEL_PROVIDER + _USER.pack(user_id) + _TEXT_LENGTH.pack(len(encoded)) + encoded
+            )
+        with self._lock:
+            self._log.check()
+            cancelled = self._queue.cancel(user_id, provider)
+            if not cancelled:
+                return 0
+            log, lsn = self._log, self._logged(payload)
+        self._committed(log, lsn)
+        return cancelled
+
+    def sync(self) -> None:
+        """Block until every operation so far is on disk."""
+        self._log.sync()
+
+    def snapshot(self) -> None:
+        """Write a snapshot now and drop the log segments it covers."""
+        with self._lock:
+            self._snapshot_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._snapshot_every is not None:
+                self._snapshot_locked()
+            self._log.close()
+
+    def _snapshot_locked(self) -> None:
+        # Start a new segment first: the snapshot covers everything before it.
+        self._log.close()
+        self._segment += 1
+        self._log = _WriteAheadLog(
+            _segment_path(self._directory, self._segment), self._fsync_interval, self._lock
+        )
+        _fsync_directory(self._directory)
+        data = _encode_snapshot(self._queue.export_state(), self._segment)
+
+        staging = self._directory / (SNAPSHOT_FILE + ".tmp")
+        with open(staging, "w+b") as file:
+            file.truncate(len(data))
+            with mmap.mmap(file.fileno(), len(data)) as mapped:
+                mapped[:] = data
+                mapped.flush()
+            os.fsync(file.fileno())
+        os.replace(staging, self._directory / SNAPSHOT_FILE)
+        _fsync_directory(self._directory)
+
+        for number in _segments(self._directory):
+            if number < self._segment:
+                _segment_path(self._directory, number).unlink()
+        self._since_snapshot = 0
+
+
+__all__ = ["DurableQueue", "SNAPSHOT_FILE"]
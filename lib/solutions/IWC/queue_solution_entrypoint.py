@@ -2,26 +2,260 @@
 
 from __future__ import annotations
 
+import os
+import time
+from typing import Iterator
+
+from solutions.IWC.dispatch_trace import DecisionTrace, TaskExplanation
+from solutions.IWC.ordering_policy import OrderingPolicy
+from solutions.IWC.queue_metrics import MetricsSink
+from solutions.IWC.queue_solution_bounded import Backpressure, BoundedQueue
+from solutions.IWC.queue_solution_compact import CompactQueue
+from solutions.IWC.queue_solution_dependencies import ThreadSafeDependencyQueue
+from solutions.IWC.queue_solution_heap import HeapQueue
 from solutions.IWC.queue_solution_legacy import Queue
+from solutions.IWC.queue_solution_rate_limited import ThreadSafeRateLimitedQueue
+from solutions.IWC.queue_solution_sharded import ShardedQueue
+from solutions.IWC.queue_solution_threaded import ThreadSafeQueue
 from solutions.IWC.task_types import TaskDispatch, TaskSubmission
 
+# Queue engines share the legacy ``Queue`` interface and dispatch order.
+# ``sharded`` runs worker processes and ``bounded`` may hold a spill file:
+# close the entrypoint (or use it as a context manager) to release them.
+# A single ``sharded`` enqueue costs a pipe round trip, about 5x an
+# in-process engine; it pays off on large ``enqueue_many`` batches.
+# ``compact`` keeps about a third of the memory per task of the others and
+# supports no previews, explanations or traces.
+QUEUE_ENGINES = {
+    "legacy": Queue,
+    "heap": HeapQueue,
+    "threadsafe": ThreadSafeQueue,
+    "sharded": ShardedQueue,
+    "bounded": BoundedQueue,
+    "compact": CompactQueue,
+}
+# Engines that hold a task back until the providers it depends on are acked,
+# and optionally while its provider is at its dispatch limits; their order
+# differs from legacy whenever a task is held back.
+ACK_QUEUE_ENGINES = {
+    "dependencies": ThreadSafeDependencyQueue,
+    "rate_limited": ThreadSafeRateLimitedQueue,
+}
+# The legacy queue stays the default; pass ``engine`` or set the environment
+# variable to opt in to another.
+DEFAULT_QUEUE_ENGINE = "legacy"
+QUEUE_ENGINE_ENV_VAR = "IWC_QUEUE_ENGINE"
+
+QueueEngine = (
+    Queue
+    | HeapQueue
+    | ThreadSafeQueue
+    | ShardedQueue
+    | BoundedQueue
+    | CompactQueue
+    | ThreadSafeDependencyQueue
+    | ThreadSafeRateLimitedQueue
+)
+
+
+def _resolve_engine(engine: str | None) -> type[QueueEngine]:
+    name = engine or os.environ.get(QUEUE_ENGINE_ENV_VAR) or DEFAULT_QUEUE_ENGINE
+    engine_type = QUEUE_ENGINES.get(name) or ACK_QUEUE_ENGINES.get(name)
+    if engine_type is None:
+        raise ValueError(
+            f"Unknown queue engine {name!r}, "
+            f"expected one of {sorted(QUEUE_ENGINES.keys() | ACK_QUEUE_ENGINES.keys())}"
+        )
+    return engine_type
+
+
 class QueueSolutionEntrypoint:
+    """Runner-facing queue API over the selected engine.
+
+    With a ``metrics`` sink attached every call is timed per operation and
+    submissions and dispatches are counted per provider; engines with an
+    ``instrument`` hook report their own internals to the same sink. Without
+    one each call only pays an ``is None`` check.
+
+    A custom ordering ``policy`` needs an engine other than ``legacy``,
+    whose rules are hard-coded.
+    """
+
+    def __init__(
+        self,
+        engine: str | None = None,
+        metrics: MetricsSink | None = None,
+        policy: OrderingPolicy | None = None,
+    ) -> None:
+        engine_type = _resolve_engine(engine)
+        if policy is None:
+            self._queue: QueueEngine = engine_type()
+        elif engine_type is Queue:
+            raise ValueError("The legacy queue engine cannot take an ordering policy")
+        else:
+            self._queue = engine_type(policy=policy)
+        self._metrics: MetricsSink | None = None
+        # Sinks that already hold this entrypoint's collector.
+        self._collected_by: list[MetricsSink] = []
+        if metrics is not None:
+            self.attach_metrics(metrics)
+
+    def __enter__(self) -> QueueSolutionEntrypoint:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release what the engine holds outside the heap: processes, files."""
+        close = getattr(self._queue, "close", None)
+        if close is not None:
+            close()
+
+    def attach_metrics(self, sink: MetricsSink | None) -> None:
+        """Report to ``sink`` from now on; ``None`` detaches.
+
+        A sink with ``add_collector`` (such as ``MetricsRegistry``) also gets
+        the depth, age and engine gauges refreshed whenever it is rendered.
+        Attaching a sink again is a no-op, and the collector registered with
+        a replaced sink stays silent until that sink is attached again.
+        """
+        if sink is self._metrics:
+            return
+        self._metrics = sink
+        instrument = getattr(self._queue, "instrument", None)
+        if instrument is not None:
+            instrument(sink)
+        add_collector = getattr(sink, "add_collector", None)
+        if add_collector is not None and not any(seen is sink for seen in self._collected_by):
+            add_collector(self._collect)
+            self._collected_by.append(sink)
+
+    def _collect(self, target: MetricsSink) -> None:
+        if self._metrics is target:  # not detached or replaced since
+            self.collect_metrics(target)
 
-    def __init__(self) -> None:
-        self._queue: Queue = Queue()
+    def collect_metrics(self, sink: MetricsSink) -> None:
+        sink.set_gauge("iwc_queue_depth", self._queue.size)
+        sink.set_gauge("iwc_queue_age_seconds", self._queue.age)
+        collect = getattr(self._queue, "collect_metrics", None)
+        if collect is not None:
+            collect(sink)
+
+    def _engine_hook(self, name: str):
+        hook = getattr(self._queue, name, None)
+        if hook is None:
+            raise NotImplementedError(f"{type(self._queue).__name__} does not support {name}()")
+        return hook
+
+    def trace_decisions(self, trace: DecisionTrace | None) -> None:
+        """Record sampled dispatch decisions into ``trace``; ``None`` stops."""
+        self._engine_hook("trace_decisions")(trace)
+
+    def explain(self, user_id: int, provider: str) -> TaskExplanation | None:
+        """Current rank of a queued task and the sort rule behind it."""
+        return self._engine_hook("explain")(user_id, provider)
+
+    def ack(self, user_id: int, provider: str) -> bool:
+        """Report a dispatched task completed, releasing the tasks that depend on it."""
+        return self._engine_hook("ack")(user_id, provider)
+
+    def nack(self, user_id: int, provider: str, requeue: bool = True) -> bool:
+        """Report a dispatched task failed; ``requeue`` puts it back for a retry."""
+        return self._engine_hook("nack")(user_id, provider, requeue)
+
+    def throttled_until(self) -> float | None:
+        """Monotonic clock time at which a rate limit next lets a task through."""
+        return self._engine_hook("throttled_until")()
+
+    def backpressure(self) -> Backpressure:
+        """How close the queue is to its memory limit; worth a 429 from ``HIGH`` on."""
+        return self._engine_hook("backpressure")()
+
+    def _observe(self, operation: str, start: float) -> None:
+        self._metrics.observe(
+            "iwc_queue_operation_seconds", time.perf_counter() - start, (("operation", operation),)
+        )
+
+    def _count(self, name: str, providers: list[str]) -> None:
+        for provider in providers:
+            self._metrics.increment(name, (("provider", provider),))
 
     def enqueue(self, task: TaskSubmission) -> int:
-        return self._queue.enqueue(task)
+        if self._metrics is None:
+            return self._queue.enqueue(task)
+        start = time.perf_counter()
+        size = self._queue.enqueue(task)
+        self._observe("enqueue", start)
+        self._count("iwc_queue_submissions_total", [task.provider])
+        return size
+
+    def enqueue_many(self, tasks: list[TaskSubmission]) -> int:
+        if self._metrics is None:
+            return self._queue.enqueue_many(tasks)
+        start = time.perf_counter()
+        size = self._queue.enqueue_many(tasks)
+        self._observe("enqueue_many", start)
+        self._count("iwc_queue_submissions_total", [task.provider for task in tasks])
+        return size
 
     def dequeue(self) -> TaskDispatch | None:
-        return self._queue.dequeue()
+        if self._metrics is None:
+            return self._queue.dequeue()
+        start = time.perf_counter()
+        dispatch = self._queue.dequeue()
+        self._observe("dequeue", start)
+        if dispatch is not None:
+            self._count("iwc_queue_dispatched_total", [dispatch.provider])
+        return dispatch
+
+    def dequeue_many(self, n: int) -> list[TaskDispatch]:
+        if self._metrics is None:
+            return self._queue.dequeue_many(n)
+        start = time.perf_counter()
+        dispatches = self._queue.dequeue_many(n)
+        self._observe("dequeue_many", start)
+        self._count("iwc_queue_dispatched_total", [dispatch.provider for dispatch in dispatches])
+        return dispatches
+
+    def peek(self) -> TaskDispatch | None:
+        return self._engine_hook("peek")()
+
+    def top_k(self, k: int) -> list[TaskDispatch]:
+        return self._engine_hook("top_k")(k)
+
+    def iter_ordered(self) -> Iterator[TaskDispatch]:
+        return self._engine_hook("iter_ordered")()
 
     def size(self) -> int:
-        return self._queue.size
+        if self._metrics is None:
+            return self._queue.size
+        start = time.perf_counter()
+        size = self._queue.size
+        self._observe("size", start)
+        return size
 
     def age(self) -> int:
-        return self._queue.age
+        if self._metrics is None:
+            return self._queue.age
+        start = time.perf_counter()
+        age = self._queue.age
+        self._observe("age", start)
+        return age
 
     def purge(self) -> bool:
-        return self._queue.purge()
+        if self._metrics is None:
+            return self._queue.purge()
+        start = time.perf_counter()
+        purged = self._queue.purge()
+        self._observe("purge", start)
+        return purged
 
+    def cancel(self, user_id: int, provider: str | None = None) -> int:
+        """Drop a user's queued tasks, or only its ``provider`` task; returns how many."""
+        if self._metrics is None:
+            return self._queue.cancel(user_id, provider)
+        start = time.perf_counter()
+        cancelled = self._queue.cancel(user_id, provider)
+        self._observe("cancel", start)
+        return cancelled
@@ -0,0 +1,946 @@
+"""Heap-backed queue engine producing the legacy ``Queue`` dispatch order.
+
+The legacy queue re-sorts its whole list on every ``dequeue``. Here every queued
+task keeps the key the legacy ``sort_key`` would give it inside an
+``IndexedHeap``; a dequeue only re-keys the tasks whose key actually changed
+(rule-of-3 promotion, bank statements crossing the freshness threshold) and pops
+the minimum. The rules themselves come from an ``OrderingPolicy``, which
+defaults to the legacy ones.
+
+Ties are the subtle part: the legacy list is sorted with a *stable* sort, so two
+tasks with equal keys come out in the order a previous sort left them in. Each
+task therefore carries a ``label`` appended to its key that reproduces that
+order (see ``TieBreakLabeler``).
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import sys
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Hashable, Iterable, Iterator, Sequence, TypeVar
+
+from solutions.IWC.dispatch_trace import (
+    RULE_HIGH_PRIORITY,
+    RULE_HIGH_PRIORITY_IN_WINDOW,
+    RULE_NORMAL,
+    RULE_WINDOW_AGED_OUT,
+    RULE_WINDOW_DEFERRED,
+    DecisionTrace,
+    DispatchDecision,
+    DispatchKey,
+    TaskExplanation,
+)
+from solutions.IWC.indexed_heap import IndexedHeap, IntrusiveIndexedHeap
+from solutions.IWC.ordering_policy import DEFAULT_POLICY, OrderingPolicy
+from solutions.IWC.provider_registry import PROVIDER_REGISTRY, ProviderRegistry
+from solutions.IWC.queue_metrics import MetricsSink
+from solutions.IWC.queue_solution_legacy import Priority
+from solutions.IWC.task_types import (
+    MAX_TIME_KEY,
+    TaskDispatch,
+    TaskSubmission,
+    datetime_from_key,
+    timestamp_key,
+)
+
+H = TypeVar("H", bound=Hashable)
+
+# ``sort_key`` branch by ``SubTiers`` field, for keys in the main tier.
+_RULES_BY_SUB_TIER_NAME = {
+    "aged_out": RULE_WINDOW_AGED_OUT,
+    "high": RULE_HIGH_PRIORITY,
+    "high_in_window": RULE_HIGH_PRIORITY_IN_WINDOW,
+    "normal": RULE_NORMAL,
+}
+# Rules that only a task inside or past a deprioritisation window gets.
+_WINDOW_RULES = frozenset(
+    {RULE_WINDOW_DEFERRED, RULE_WINDOW_AGED_OUT, RULE_HIGH_PRIORITY_IN_WINDOW}
+)
+
+# (provider, user_id, original timestamp, time key, metadata) of one task to offer.
+ExpandedTask = tuple[str, int, datetime | str, int, dict[str, object]]
+
+
+def _explicit_priority(metadata) -> Priority | None:
+    try:
+        return Priority(metadata.get("priority", Priority.NORMAL))
+    except (TypeError, ValueError):
+        return None
+
+
+def expand_submission(item: TaskSubmission, closure: Sequence[str]) -> list[ExpandedTask]:
+    """Tasks enqueueing ``item`` offers: its dependency ``closure``, then itself."""
+    time_key = timestamp_key(item.timestamp)
+    expanded: list[ExpandedTask] = [
+        (dependency, item.user_id, item.timestamp, time_key, {}) for dependency in closure
+    ]
+    expanded.append((item.provider, item.user_id, item.timestamp, time_key, item.metadata))
+    return expanded
+
+
+class TieBreakLabeler:
+    """Hands out tie-break labels reproducing the legacy stable sort.
+
+    A heap key is the legacy sort key plus a label of one or two parts. New
+    tasks are labelled ``(seq,)``; relabelled ones get a first part of at
+    most ``sorted_through``, so a label above it marks a task appended since
+    the previous dequeue. A one-part label sorts as if its second part were
+    0, so only labels that need a second part carry one. A task whose key
+    changes between two dequeues sits in the legacy list where its old key
+    put it, so among the tasks that already had the new key it goes first if
+    its old key was smaller, and last (but ahead of tasks appended since the
+    previous dequeue) if it was larger. Tasks moving together keep their
+    relative order.
+    """
+
+    def __init__(self, next_low: int = 0, next_high: int = 0) -> None:
+        self._next_low = next_low
+        self._next_high = next_high
+
+    @property
+    def counters(self) -> tuple[int, int]:
+        """``(next_low, next_high)``, enough to recreate this labeler."""
+        return self._next_low, self._next_high
+
+    def relabel(
+        self, moved: list[tuple[H, tuple, tuple]], sorted_through: int
+    ) -> list[tuple[H, tuple]]:
+        """Map ``(handle, old_heap_key, new_key)`` to ``(handle, new_heap_key)``.
+
+        ``sorted_through`` is the highest ``seq`` present at the previous
+        dequeue; anything newer still counts as appended.
+        """
+        from_below = sorted(
+            (entry for entry in moved if entry[1][:4] < entry[2]),
+            key=lambda entry: entry[1],
+            reverse=True,
+        )
+        from_above = sorted(
+            (entry for entry in moved if entry[1][:4] > entry[2]),
+            key=lambda entry: entry[1],
+        )
+        relabelled: list[tuple[H, tuple]] = []
+        for handle, _, key in from_below:
+            self._next_low -= 1
+            relabelled.append((handle, key + (self._next_low,)))
+        for handle, _, key in from_above:
+            self._next_high += 1
+            relabelled.append((handle, key + (sorted_through, self._next_high)))
+        return relabelled
+
+
+def key_columns(heap_key: tuple) -> tuple:
+    """``heap_key`` padded to the six columns fixed-width formats store."""
+    return heap_key if len(heap_key) == 6 else heap_key + (0,)
+
+
+def key_from_columns(columns: Sequence[int]) -> tuple:
+    """Inverse of ``key_columns``; a second label part is never 0."""
+    return tuple(columns[:5]) if columns[5] == 0 else tuple(columns[:6])
+
+
+# (provider, user_id, time key, priority, group key, heap key, aged out of its window?)
+TaskState = tuple[str, int, int, int, int, tuple, bool]
+
+
+@dataclass(slots=True)
+class HeapQueueState:
+    """Everything a ``HeapQueue`` needs to resume with the same dispatch order.
+
+    ``tasks`` are listed in heap order. Heap keys only make sense to a queue
+    running the same ordering policy.
+    """
+
+    tasks: list[TaskState]
+    seq: int
+    sorted_through: int
+    labels: tuple[int, int]
+
+
+@dataclass(slots=True, eq=False)
+class _QueuedTask:
+    """Compact engine-side record of one queued task.
+
+    Only what ordering needs is kept, since the engine holds one per queued
+    task: the caller's timestamp and metadata are dropped after the enqueue.
+    ``time_key`` and ``group_key`` are epoch microseconds (see
+    ``timestamp_key``). Only HIGH tasks have a group key, so ``group_key`` is
+    None exactly for NORMAL tasks and doubles as the priority. ``heap_key``
+    is the legacy sort key followed by the tie-break label, and is
+    the very tuple stored in the heap. ``next_task`` links the user's other
+    queued tasks (see ``HeapQueue._users``) and ``heap_position`` indexes the
+    task in the heap. Conversion to ``TaskDispatch`` only happens when the
+    task leaves the queue.
+    """
+
+    provider: str
+    user_id: int
+    time_key: int
+    group_key: int | None
+    heap_key: tuple = ()
+    next_task: _QueuedTask | None = None
+    heap_position: int = -1
+
+    # Number of the provider's deprioritisation window, none here; tasks of
+    # providers with one are ``_WindowedTask``.
+    window = -1
+
+    @property
+    def priority(self) -> Priority:
+        return Priority.NORMAL if self.group_key is None else Priority.HIGH
+
+    def state(self) -> tuple[int, int]:
+        """``(priority, group key)`` in the form ``TaskState`` stores them."""
+        if self.group_key is None:
+            return Priority.NORMAL.value, MAX_TIME_KEY
+        return Priority.HIGH.value, self.group_key
+
+
+@dataclass(slots=True, eq=False)
+class _WindowedTask(_QueuedTask):
+    """Task of a provider with a deprioritisation window.
+
+    ``window`` is the window's number in the policy, and ``window_position``
+    indexes the task in whichever of that window's two heaps holds it. Most
+    tasks have no window, so they go without both slots.
+    """
+
+    window: int = -1
+    window_position: int = -1
+
+
+def _new_task(
+    provider: str,
+    user_id: int,
+    time_key: int,
+    window: int,
+    group_key: int | None,
+    heap_key: tuple = (),
+) -> _QueuedTask:
+    if window < 0:
+        return _QueuedTask(provider, user_id, time_key, group_key, heap_key)
+    return _WindowedTask(provider, user_id, time_key, group_key, heap_key, window=window)
+
+
+def _chain(task: _QueuedTask | None) -> Iterator[_QueuedTask]:
+    """A user's tasks, starting from the one ``HeapQueue._users`` holds."""
+    while task is not None:
+        yield task
+        task = task.next_task
+
+
+# heapq's max-heap functions are public from Python 3.14 and private before.
+if hasattr(heapq, "heappush_max"):
+    _heapify_max, _heappop_max, _heappush_max = (
+        heapq.heapify_max,
+        heapq.heappop_max,
+        heapq.heappush_max,
+    )
+else:
+    _heapify_max, _heappop_max = heapq._heapify_max, heapq._heappop_max
+
+    def _heappush_max(heap: list, item: object) -> None:
+        heap.append(item)
+        heapq._siftdown_max(heap, 0, len(heap) - 1)
+
+
+class _TimeBounds:
+    """Multiset of time keys with amortised O(1) oldest/newest lookups.
+
+    A min-heap and a max-heap hold the distinct keys; a key whose count drops
+    to zero is left in place and skipped lazily once it surfaces at the top.
+    Both heaps share the key objects, rather than the max-heap holding
+    negated copies.
+    """
+
+    def __init__(self) -> None:
+        self._counts: dict[int, int] = {}
+        self._low: list[int] = []
+        self._high: list[int] = []
+
+    def add(self, time_key: int) -> None:
+        count = self._counts.get(time_key, 0)
+        self._counts[time_key] = count + 1
+        if count == 0:
+            heapq.heappush(self._low, time_key)
+            _heappush_max(self._high, time_key)
+
+    def add_many(self, time_keys: Iterable[int]) -> None:
+        counts = self._counts
+        for time_key in time_keys:
+            counts[time_key] = counts.get(time_key, 0) + 1
+        self._compact()
+
+    def discard(self, time_key: int) -> None:
+        count = self._counts[time_key] - 1
+        if count:
+            self._counts[time_key] = count
+            return
+        del self._counts[time_key]
+        if len(self._low) > 2 * len(self._counts) + 64:
+            self._compact()
+
+    def oldest(self) -> int:
+        low, counts = self._low, self._counts
+        while low[0] not in counts:
+            heapq.heappop(low)
+        return low[0]
+
+    def newest(self) -> int:
+        high, counts = self._high, self._counts
+        while high[0] not in counts:
+            _heappop_max(high)
+        return high[0]
+
+    def clear(self) -> None:
+        self._counts.clear()
+        self._low.clear()
+        self._high.clear()
+
+    def _compact(self) -> None:
+        self._low = list(self._counts)
+        heapq.heapify(self._low)
+        self._high = list(self._counts)
+        _heapify_max(self._high)
+
+
+class HeapQueue:
+    """Drop-in replacement for the legacy ``Queue`` backed by an indexed heap."""
+
+    def __init__(
+        self, registry: ProviderRegistry | None = None, policy: OrderingPolicy | None = None
+    ) -> None:
+        self._registry = PROVIDER_REGISTRY if registry is None else registry
+        self._policy = (DEFAULT_POLICY if policy is None else policy).compile()
+        self._sort_key = self._policy.sort_key
+        self._rule_of_3_threshold = self._policy.rule_of_3_threshold
+        self._heap: IndexedHeap[_QueuedTask] = IntrusiveIndexedHeap("heap_position")
+        # user_id -> that user's latest task, the others chained behind it
+        # through ``next_task``; doubles as the dedup index. Deduplication
+        # caps a chain at one task per provider, so walking it is cheap, and
+        # most users have a single task: no per-user object or dict at all.
+        self._users: dict[int, _QueuedTask] = {}
+        # Users that reached the rule-of-3 count with NORMAL tasks still to promote.
+        self._rule_of_3_pending: set[int] = set()
+        # Per deprioritisation window, its provider's tasks split at the
+        # window's cut-off as of the last dequeue. Those inside are keyed
+        # oldest-first and aged-out ones newest-first, so a moving cut-off
+        # only ever touches the tops of the two heaps. A task sits in one of
+        # them at a time, so they share its ``window_position``.
+        windows = len(self._policy.window_lengths)
+        self._in_window: list[IndexedHeap[_QueuedTask]] = [
+            IntrusiveIndexedHeap("window_position") for _ in range(windows)
+        ]
+        self._aged_out: list[IndexedHeap[_QueuedTask]] = [
+            IntrusiveIndexedHeap("window_position") for _ in range(windows)
+        ]
+        self._time_bounds = _TimeBounds()
+        # The heap ``dequeue`` takes from: every queued task here, a subset in
+        # subclasses that hold some tasks back (keys are kept in step by
+        # ``_rekey``).
+        self._candidates: IndexedHeap[_QueuedTask] = self._heap
+        self._seq = 0
+        # Highest ``seq`` that has been through a dequeue; anything newer is
+        # still sitting at the tail of the legacy list.
+        self._sorted_through = 0
+        self._labeler = TieBreakLabeler()
+        self._metrics: MetricsSink | None = None
+        self._trace: DecisionTrace | None = None
+
+    def trace_decisions(self, trace: DecisionTrace | None) -> None:
+        """Record sampled dequeue decisions into ``trace``; ``None`` stops."""
+        self._trace = trace
+
+    def instrument(self, sink: MetricsSink | None) -> None:
+        """Report dedup hits, promotions and re-keying to ``sink``; ``None`` detaches."""
+        self._metrics = sink
+
+    def collect_metrics(self, sink: MetricsSink) -> None:
+        """Set the gauges too costly to keep current on every operation."""
+        threshold = self._rule_of_3_threshold
+        sink.set_gauge(
+            "iwc_queue_rule_of_3_users",
+            sum(self._count_tasks(user) >= threshold for user in self._users.values()),
+        )
+        for tier, count in self._tier_counts().items():
+            sink.set_gauge("iwc_queue_tasks", count, (("tier", str(tier)),))
+
+    def _tier_counts(self) -> dict[int, int]:
+        # NORMAL tasks inside their window are the ones parked at the back.
+        by_tier: dict[int, int] = {}
+        for tier, in_window in zip(self._policy.window_tiers, self._in_window):
+            parked = sum(task.group_key is None for task in in_window)
+            by_tier[tier] = by_tier.get(tier, 0) + parked
+        main_tier = self._policy.main_tier
+        by_tier[main_tier] = len(self._heap) - sum(by_tier.values())
+        return by_tier
+
+    def _make_task(
+        self,
+        seq: int,
+        provider: str,
+        user_id: int,
+        time_key: int,
+        metadata: dict[str, object],
+    ) -> _QueuedTask:
+        # Invalid priorities are treated as NORMAL by the legacy dequeue.
+        group_key = None
+        if _explicit_priority(metadata) == Priority.HIGH:
+            group_timestamp = metadata.get("group_earliest_timestamp")
+            group_key = MAX_TIME_KEY if group_timestamp is None else timestamp_key(group_timestamp)
+        task = _new_task(
+            sys.intern(provider), user_id, time_key, self._policy.window(provider), group_key
+        )
+        task.heap_key = self._initial_key(task, seq)
+        return task
+
+    def _initial_key(self, task: _QueuedTask, seq: int) -> tuple:
+        # Provisional key; the next dequeue re-keys against the real queue state.
+        return self._sort_key(task, task.time_key) + (seq,)
+
+    def _insert(self, task: _QueuedTask) -> None:
+        self._heap.push(task, task.heap_key)
+        if task.window >= 0:
+            self._in_window[task.window].push(task, task.time_key)
+        self._track(task)
+
+    def _insert_many(self, tasks: list[_QueuedTask]) -> None:
+        self._heap.push_many((task, task.heap_key) for task in tasks)
+        for window, in_window in enumerate(self._in_window):
+            in_window.push_many((task, task.time_key) for task in tasks if task.window == window)
+        for task in tasks:
+            self._track(task)
+
+    def _track(self, task: _QueuedTask) -> None:
+        self._time_bounds.add(task.time_key)
+        user_id = task.user_id
+        users = self._users
+        first = users.get(user_id)
+        if first is not None:
+            # Share one user_id object between the user's tasks.
+            task.user_id = first.user_id
+        task.next_task = first
+        users[user_id] = task
+        if self._count_tasks(task) >= self._rule_of_3_threshold:
+            self._rule_of_3_pending.add(user_id)
+
+    def _forget(self, task: _QueuedTask) -> None:
+        user_id = task.user_id
+        users = self._users
+        first = users[user_id]
+        if first is task:
+            if task.next_task is None:
+                del users[user_id]
+            else:
+                users[user_id] = task.next_task
+        else:
+            while first.next_task is not task:
+                first = first.next_task
+            first.next_task = task.next_task
+        task.next_task = None
+        self._time_bounds.discard(task.time_key)
+        if task.window >= 0:
+            in_window = self._in_window[task.window]
+            if task in in_window:
+                in_window.remove(task)
+            else:
+                self._aged_out[task.window].remove(task)
+
+    @staticmethod
+    def _count_tasks(first: _QueuedTask | None) -> int:
+        count = 0
+        while first is not None:
+            count += 1
+            first = first.next_task
+        return count
+
+    def _user_task(self, user_id: int, provider: str) -> _QueuedTask | None:
+        """The user's queued task for ``provider``, if any."""
+        task = self._users.get(user_id)
+        while task is not None and task.provider != provider:
+            task = task.next_task
+        return task
+
+    def _user_tasks(self, user_id: int) -> list[_QueuedTask]:
+        return list(_chain(self._users.get(user_id)))
+
+    def _discard(self, task: _QueuedTask) -> None:
+        self._heap.remove(task)
+        self._forget(task)
+
+    def _offer(
+        self,
+        seq: int,
+        provider: str,
+        user_id: int,
+        timestamp: datetime | str,
+        time_key: int,
+        metadata: dict[str, object],
+    ) -> None:
+        existing = self._user_task(user_id, provider)
+        if existing is not None:
+            if self._metrics is not None:
+                self._metrics.increment("iwc_queue_dedup_hits_total")
+            if time_key >= existing.time_key:
+                return  # keep the earlier task already in the queue
+            self._discard(existing)
+        self._insert(self._make_task(seq, provider, user_id, time_key, metadata))
+
+    def expand(self, item: TaskSubmission) -> list[ExpandedTask]:
+        """Tasks ``item`` enqueues, dependencies first.
+
+        Reads no queue state, so callers sharing a queue across threads can
+        parse and expand submissions before taking any lock.
+        """
+        return expand_submission(item, self._registry.dependency_closure(item.provider))
+
+    def enqueue(self, item: TaskSubmission) -> int:
+        return self.enqueue_expanded(self.expand(item))
+
+    def enqueue_expanded(
+        self, expanded: Iterable[ExpandedTask], first_seq: int | None = None
+    ) -> int:
+        """Offer expanded tasks in order.
+
+        Every offered task consumes one sequence number, starting after
+        ``first_seq`` when given (a sharded coordinator hands out global ones).
+        """
+        seq = self._seq if first_seq is None else first_seq
+        metrics = self._metrics
+        for entry in expanded:
+            seq += 1
+            self._offer(seq, *entry)
+            if metrics is not None:
+                metrics.increment("iwc_queue_tasks_offered_total", (("provider", entry[0]),))
+        self._seq = max(self._seq, seq)
+
+        return self.size
+
+    def enqueue_many(self, items: Iterable[TaskSubmission]) -> int:
+        return self.enqueue_many_expanded([entry for item in items for entry in self.expand(item)])
+
+    def enqueue_many_expanded(
+        self, expanded: Sequence[ExpandedTask], seqs: Sequence[int] | None = None
+    ) -> int:
+        """Enqueue a batch with the same outcome as enqueueing items one by one.
+
+        Duplicates are resolved (earliest timestamp wins, against the batch and
+        the queue) before anything is inserted, so the survivors go into the
+        heap in a single bulk push. ``seqs`` optionally gives each entry's
+        sequence number, as ``enqueue_expanded``'s ``first_seq`` does.
+        """
+        if seqs is None:
+            seqs = range(self._seq + 1, self._seq + 1 + len(expanded))
+        # (user_id, provider) -> (seq, timestamp, time_key, metadata), kept in
+        # the order the sequential enqueues would have left the survivors.
+        batch: dict[tuple[int, str], tuple[int, datetime | str, int, dict[str, object]]] = {}
+        dedup_hits = 0
+
+        for seq, (provider, user_id, timestamp, time_key, metadata) in zip(seqs, expanded):
+            key = (user_id, provider)
+            pending = batch.get(key)
+            if pending is not None:
+                dedup_hits += 1
+                if time_key >= pending[2]:
+                    continue
+                del batch[key]
+            else:
+                existing = self._user_task(user_id, provider)
+                if existing is not None:
+                    dedup_hits += 1
+                    if time_key >= existing.time_key:
+                        continue
+            batch[key] = (seq, timestamp, time_key, metadata)
+        if seqs:
+            self._seq = max(self._seq, seqs[-1])
+        if self._metrics is not None:
+            self._report_batch(expanded, dedup_hits)
+
+        tasks: list[_QueuedTask] = []
+        for (user_id, provider), (seq, timestamp, time_key, metadata) in batch.items():
+            existing = self._user_task(user_id, provider)
+            if existing is not None:
+                self._discard(existing)
+            tasks.append(self._make_task(seq, provider, user_id, time_key, metadata))
+        self._insert_many(tasks)
+
+        return self.size
+
+    def _report_batch(self, expanded: Sequence[ExpandedTask], dedup_hits: int) -> None:
+        offered: dict[str, int] = {}
+        for entry in expanded:
+            offered[entry[0]] = offered.get(entry[0], 0) + 1
+        for provider, count in offered.items():
+            self._metrics.increment("iwc_queue_tasks_offered_total", (("provider", provider),), count)
+        if dedup_hits:
+            self._metrics.increment("iwc_queue_dedup_hits_total", value=dedup_hits)
+
+    def _apply_rule_of_3(self) -> list[_QueuedTask]:
+        """Promote the NORMAL tasks of users that reached the rule-of-3 count.
+
+        Promotion is sticky, exactly like the legacy metadata rewrite: a user
+        dropping back below the threshold keeps its HIGH tasks, so only users
+        crossing upwards ever need their tasks re-keyed.
+        """
+        promoted: list[_QueuedTask] = []
+        for user_id in self._rule_of_3_pending:
+            tasks = self._user_tasks(user_id)
+            if len(tasks) < self._rule_of_3_threshold:
+                continue
+            earliest = min(task.time_key for task in tasks)
+            for task in tasks:
+                if task.group_key is None:
+                    task.group_key = earliest
+                    promoted.append(task)
+        self._rule_of_3_pending.clear()
+        if promoted and self._metrics is not None:
+            self._metrics.increment("iwc_queue_rule_of_3_promotions_total", value=len(promoted))
+        return promoted
+
+    def _relabel(self, moved: list[tuple[_QueuedTask, tuple]]) -> None:
+        relabelled = self._labeler.relabel(
+            [(task, task.heap_key, key) for task, key in moved], self._sorted_through
+        )
+        for task, heap_key in relabelled:
+            self._rekey(task, heap_key)
+
+    def _rekey(self, task: _QueuedTask, heap_key: tuple) -> None:
+        task.heap_key = heap_key
+        self._heap.update(task, heap_key)
+
+    def _sweep_windows(self, queue_newest: int) -> list[_QueuedTask]:
+        """Move tasks across their window's cut-off and return the ones that moved.
+
+        A task has aged out of its window once its time key is below
+        ``queue_newest`` minus the window length. The cut-off usually
+        advances, but it retreats when the newest task leaves.
+        """
+        flipped: list[_QueuedTask] = []
+        for length, fresh, old in zip(self._policy.window_lengths, self._in_window, self._aged_out):
+            cutoff = queue_newest - length
+            while fresh and fresh.peek()[1] < cutoff:
+                task, _ = fresh.pop()
+                old.push(task, -task.time_key)
+                flipped.append(task)
+            while old and -old.peek()[1] >= cutoff:
+                task, _ = old.pop()
+                fresh.push(task, task.time_key)
+                flipped.append(task)
+        return flipped
+
+    def _prepare_dequeue(self, queue_newest: int) -> list[tuple[_QueuedTask, tuple]]:
+        """Bring every key up to date for a dequeue against ``queue_newest``.
+
+        Returns ``(task, new_key)`` for tasks that still need ``_relabel``;
+        tasks added since the last dequeue are re-keyed in place.
+        """
+        promoted = self._apply_rule_of_3()
+        flipped = self._sweep_windows(queue_newest)
+        # Only promotion and window cut-offs ever change a queued task's key.
+        moved: list[tuple[_QueuedTask, tuple]] = []
+        for task in dict.fromkeys(promoted + flipped):
+            key = self._sort_key(task, queue_newest)
+            if key == task.heap_key[:4]:
+                continue
+            if task.heap_key[4] > self._sorted_through:
+                # Still at the tail of the legacy list: insertion order holds.
+                self._rekey(task, key + task.heap_key[4:])
+            else:
+                moved.append((task, key))
+        return moved
+
+    def dequeue(self) -> TaskDispatch | None:
+        if not self._candidates:
+            return None
+
+        self._refresh_keys()
+        task, heap_key = self._candidates.pop()
+        if self._candidates is not self._heap:
+            self._heap.remove(task)
+        trace = self._trace
+        if trace is not None:
+            number = trace.sample()
+            if number is not None:
+                self._record_decision(trace, number, task, heap_key)
+        self._forget(task)
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.increment("iwc_queue_tier_dispatched_total", (("tier", str(heap_key[0])),))
+        return self._dispatch(task)
+
+    def _refresh_keys(self) -> None:
+        """Bring every heap key up to date for the pop a dequeue is about to make."""
+        metrics = self._metrics
+        if metrics is None:
+            self._relabel(self._prepare_dequeue(self._time_bounds.newest()))
+        else:
+            start = time.perf_counter()
+            self._relabel(self._prepare_dequeue(self._time_bounds.newest()))
+            metrics.observe("iwc_queue_rekey_seconds", time.perf_counter() - start)
+        self._sorted_through = self._seq
+
+    def _dispatch(self, task: _QueuedTask) -> TaskDispatch:
+        """Hand out a task that has just left the queue."""
+        return TaskDispatch(
+            provider=task.provider,
+            user_id=task.user_id,
+        )
+
+    def _record_decision(
+        self, trace: DecisionTrace, number: int, task: _QueuedTask, heap_key: tuple
+    ) -> None:
+        # Keys are current for this dequeue, so the new heap top is the runner-up.
+        candidates = self._candidates
+        runner_up = self._describe(*candidates.peek()) if candidates else None
+        trace.record(
+            DispatchDecision(
+                dequeue_number=number,
+                queue_size=len(self._heap) + 1,
+                winner=self._describe(task, heap_key),
+                runner_up=runner_up,
+            )
+        )
+
+    def _describe(self, task: _QueuedTask, heap_key: tuple) -> DispatchKey:
+        tier, time_key, sub_tier, group_key = heap_key[:4]
+        count = self._count_tasks(self._users.get(task.user_id))
+        # Only windows put a task outside the main tier.
+        rule = (
+            RULE_WINDOW_DEFERRED
+            if tier != self._policy.main_tier
+            else _RULES_BY_SUB_TIER_NAME[self._policy.sub_tier_names[sub_tier]]
+        )
+        return DispatchKey(
+            provider=task.provider,
+            user_id=task.user_id,
+            rule=rule,
+            window=task.provider if rule in _WINDOW_RULES else None,
+            tier=tier,
+            timestamp=datetime_from_key(time_key),
+            sub_tier=sub_tier,
+            group_sort=None if group_key == MAX_TIME_KEY else datetime_from_key(group_key),
+            user_task_count=count,
+            rule_of_3=count >= self._rule_of_3_threshold,
+        )
+
+    def _preview_keys(self) -> dict[_QueuedTask, tuple]:
+        """Heap keys the next dequeue would give the tasks it re-keys.
+
+        Mirrors ``_prepare_dequeue`` and ``_relabel`` without changing any
+        queue state, so reads see the order the next dequeue will use.
+        """
+        if not self._heap:
+            return {}
+        queue_newest = self._time_bounds.newest()
+        # task -> stand-in carrying the priority the rule of 3 would give it
+        changed: dict[_QueuedTask, _QueuedTask] = {}
+        for user_id in self._rule_of_3_pending:
+            tasks = self._user_tasks(user_id)
+            if len(tasks) < self._rule_of_3_threshold:
+                continue
+            earliest = min(task.time_key for task in tasks)
+            for task in tasks:
+                if task.group_key is None:
+                    changed[task] = replace(task, group_key=earliest)
+        for length, fresh, old in zip(self._policy.window_lengths, self._in_window, self._aged_out):
+            cutoff = queue_newest - length
+            for task, time_key in fresh.iter_sorted():
+                if time_key >= cutoff:
+                    break
+                changed.setdefault(task, task)
+            for task, negated_time_key in old.iter_sorted():
+                if -negated_time_key < cutoff:
+                    break
+                changed.setdefault(task, task)
+
+        keys: dict[_QueuedTask, tuple] = {}
+        moved: list[tuple[_QueuedTask, tuple, tuple]] = []
+        for task, stand_in in changed.items():
+            key = self._sort_key(stand_in, queue_newest)
+            if key == task.heap_key[:4]:
+                continue
+            if task.heap_key[4] > self._sorted_through:
+                keys[task] = key + task.heap_key[4:]
+            else:
+                moved.append((task, task.heap_key, key))
+        labeler = TieBreakLabeler(*self._labeler.counters)
+        keys.update(labeler.relabel(moved, self._sorted_through))
+        return keys
+
+    def explain(self, user_id: int, provider: str) -> TaskExplanation | None:
+        """Rank and sort-key breakdown of a queued task, ``None`` if not queued.
+
+        The rank counts heap entries below the task's key instead of sorting,
+        corrected for the tasks the next dequeue would re-key.
+        """
+        task = self._user_task(user_id, provider)
+        if task is None:
+            return None
+        pending = self._preview_keys()
+        heap_key = pending.get(task, task.heap_key)
+        rank = self._heap.count_below(heap_key)
+        for other, new_key in pending.items():
+            rank += (new_key < heap_key) - (other.heap_key < heap_key)
+        return TaskExplanation(rank=rank, queue_size=self.size, key=self._describe(task, heap_key))
+
+    def _ordered_entries(self) -> Iterator[tuple[tuple, _QueuedTask]]:
+        """``(heap_key, task)`` for every dispatchable task, in dispatch order.
+
+        Walks the candidate heap, so tasks an engine holds back out of it
+        are never visited.
+        """
+        candidates = self._candidates
+        pending = self._preview_keys()
+        # Heap keys are unique, so neither merge input ever compares tasks.
+        stored = ((key, task) for task, key in candidates.iter_sorted() if task not in pending)
+        previewed = sorted((key, task) for task, key in pending.items() if task in candidates)
+        return heapq.merge(stored, previewed)
+
+    def _ordered_tasks(self) -> Iterator[_QueuedTask]:
+        for _, task in self._ordered_entries():
+            yield task
+
+    def iter_ordered(self) -> Iterator[TaskDispatch]:
+        """Lazily yield every queued task in the order dequeues would return them.
+
+        Nothing is popped: the next dequeue's re-keying is previewed and the
+        heap walked in key order, so the first k tasks cost O(k log N).
+        Draining never changes the order of what is left, so this is the
+        full dispatch order until the next enqueue. The queue must not
+        change while the generator is in use.
+        """
+        for task in self._ordered_tasks():
+            yield TaskDispatch(provider=task.provider, user_id=task.user_id)
+
+    def peek(self) -> TaskDispatch | None:
+        """The task ``dequeue`` would return, without removing it."""
+        return next(self.iter_ordered(), None)
+
+    def top_k(self, k: int) -> list[TaskDispatch]:
+        """The next ``k`` tasks in dispatch order, without removing them."""
+        return list(itertools.islice(self.iter_ordered(), max(k, 0)))
+
+    def dequeue_many(self, n: int) -> list[TaskDispatch]:
+        """Dispatch up to ``n`` tasks in the order ``n`` dequeues would.
+
+        Each step is one heap pop plus the re-keying a single dequeue does, so
+        promotions and freshness changes caused by earlier pops still apply.
+        """
+        dispatches: list[TaskDispatch] = []
+        while len(dispatches) < n and self._candidates:
+            dispatches.append(self.dequeue())
+        return dispatches
+
+    @property
+    def size(self) -> int:
+        return len(self._heap)
+
+    @property
+    def age(self) -> int:
+        if self.size <= 1:
+            return 0
+
+        return (self._time_bounds.newest() - self._time_bounds.oldest()) // 1_000_000
+
+    def purge(self) -> bool:
+        self._heap.clear()
+        self._users.clear()
+        self._rule_of_3_pending.clear()
+        for in_window, aged_out in zip(self._in_window, self._aged_out):
+            in_window.clear()
+            aged_out.clear()
+        self._time_bounds.clear()
+        self._sorted_through = self._seq
+        return True
+
+    def cancel(self, user_id: int, provider: str | None = None) -> int:
+        """Remove the user's queued tasks, or only its ``provider`` task.
+
+        Goes through the per-user index, so k tasks cost O(k log N). The
+        age bounds and rule-of-3 counts follow as for a dequeue; tasks
+        already promoted keep their priority, and the rest of the queue
+        keeps its order. Returns the number of tasks removed.
+        """
+        if provider is None:
+            tasks = self._user_tasks(user_id)
+        else:
+            task = self._user_task(user_id, provider)
+            tasks = [] if task is None else [task]
+        for task in tasks:
+            self._discard(task)
+        if tasks and self._metrics is not None:
+            self._metrics.increment("iwc_queue_cancelled_total", value=len(tasks))
+        return len(tasks)
+
+    def export_state(self) -> HeapQueueState:
+        aged_out = self._aged_out
+        return HeapQueueState(
+            tasks=[
+                (
+                    task.provider,
+                    task.user_id,
+                    task.time_key,
+                    *task.state(),
+                    task.heap_key,
+                    task.window >= 0 and task in aged_out[task.window],
+                )
+                for task in self._heap
+            ],
+            seq=self._seq,
+            sorted_through=self._sorted_through,
+            labels=self._labeler.counters,
+        )
+
+    def load_state(self, state: HeapQueueState) -> None:
+        """Replace the queue contents with an ``export_state`` result."""
+        self.purge()
+        users = self._users
+        tasks: list[_QueuedTask] = []
+        in_window: list[list[_QueuedTask]] = [[] for _ in self._in_window]
+        aged_out: list[list[_QueuedTask]] = [[] for _ in self._aged_out]
+        window_of = self._policy.window
+        for provider, user_id, time_key, priority, group_key, heap_key, old in state.tasks:
+            window = window_of(provider)
+            task = _new_task(
+                sys.intern(provider),
+                user_id,
+                time_key,
+                window,
+                None if priority == Priority.NORMAL else group_key,
+                heap_key,
+            )
+            task.next_task = users.get(user_id)
+            tasks.append(task)
+            users[user_id] = task
+            if window >= 0:
+                (aged_out if old else in_window)[window].append(task)
+        # ``state.tasks`` is in heap order and sorted lists are heaps too.
+        self._heap.load((task, task.heap_key) for task in tasks)
+        for fresh, heap in zip(in_window, self._in_window):
+            fresh.sort(key=lambda task: task.time_key)
+            heap.load((task, task.time_key) for task in fresh)
+        for old, heap in zip(aged_out, self._aged_out):
+            old.sort(key=lambda task: -task.time_key)
+            heap.load((task, -task.time_key) for task in old)
+        self._time_bounds.add_many(task.time_key for task in tasks)
+        # Promotion is idempotent, so every user at the count can be re-queued.
+        self._rule_of_3_pending.update(
+            user_id
+            for user_id, first in users.items()
+            if self._count_tasks(first) >= self._rule_of_3_threshold
+        )
+        self._seq = state.seq
+        self._sorted_through = state.sorted_through
+        self._labeler = TieBreakLabeler(*state.labels)
+
+__all__ = [
+    "HeapQueue",
+    "HeapQueueState",
+    "ExpandedTask",
+    "TieBreakLabeler",
+    "expand_submission",
+]
@@ -16,6 +16,12 @@ class Provider:
     name: str
     base_url: str
     depends_on: list[str]
+    # Optional dispatch limits, enforced by the rate-limited queue engine:
+    # at most ``max_in_flight`` unacknowledged tasks, and a token bucket
+    # refilled at ``rate_limit`` tasks per second holding up to ``burst``.
+    max_in_flight: int | None = None
+    rate_limit: float | None = None
+    burst: int = 1
 
 MAX_TIMESTAMP = datetime.max.replace(tzinfo=None)
 
@@ -121,6 +127,11 @@ class Queue:
 
         return self.size
 
+    def enqueue_many(self, items: list[TaskSubmission]) -> int:
+        for item in items:
+            self.enqueue(item)
+        return self.size
+
     def dequeue(self):
         if self.size == 0:
             return None
@@ -228,6 +239,12 @@ class Queue:
             user_id=task.user_id,
         )
 
+    def dequeue_many(self, n: int) -> list[TaskDispatch]:
+        dispatches = []
+        while len(dispatches) < n and self.size > 0:
+            dispatches.append(self.dequeue())
+        return dispatches
+
     @property
     def size(self):
         return len(self._queue)
@@ -255,6 +272,15 @@ class Queue:
         self._queue.clear()
         return True
 
+    def cancel(self, user_id: int, provider: str | None = None) -> int:
+        remaining = [
+            t for t in self._queue
+            if t.user_id != user_id or (provider is not None and t.provider != provider)
+        ]
+        cancelled = len(self._queue) - len(remaining)
+        self._queue = remaining
+        return cancelled
+
 """
 ===================================================================================================
 
@@ -0,0 +1,325 @@
+"""Dependency-aware queue engine that respects per-provider dispatch limits.
+
+Every provider sits in front of an external service with its own rate
+limits, so handing out ten ``credit_check`` tasks in a row just gets them
+throttled upstream. A ``Provider`` may set ``max_in_flight`` (tasks
+dispatched but not yet acked or nacked) and a token bucket (``rate_limit``
+tokens per second, holding up to ``burst``). While a provider is at either
+limit its tasks are skipped and ``dequeue`` hands out the best task of
+another provider instead.
+
+Ready tasks are kept in one heap per provider, and a second heap orders the
+providers that may dispatch by their best task. A saturated provider simply
+leaves that second heap, so picking the next task stays O(log N) no matter
+how many tasks are stuck behind a limit. Providers waiting for a token are
+woken from a timer heap on the next call.
+
+Providers can be re-registered while the queue runs. Limits are re-read
+from the registry on the next call after a change, and a changed token
+bucket keeps its tokens, capped at the new burst.
+"""
+
+from __future__ import annotations
+
+import heapq
+import time
+from collections import Counter
+from operator import itemgetter
+from typing import Any, Callable, Iterator
+
+from solutions.IWC.indexed_heap import IndexedHeap
+from solutions.IWC.ordering_policy import OrderingPolicy
+from solutions.IWC.provider_registry import ProviderRegistry
+from solutions.IWC.queue_solution_dependencies import (
+    DependencyAwareQueue,
+    ThreadSafeDependencyQueue,
+)
+from solutions.IWC.queue_solution_heap import _QueuedTask
+from solutions.IWC.task_types import TaskDispatch
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: int, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        return self.tokens
+
+    def take(self, now: float) -> None:
+        self.refill(now)
+        self.tokens -= 1
+
+    def available_at(self) -> float:
+        """Clock time at which the bucket next holds a whole token."""
+        return self.updated + max(0.0, 1 - self.tokens) / self.rate
+
+
+class _ProviderHeaps:
+    """Ready tasks split into one ``IndexedHeap`` per provider.
+
+    Supports the ``IndexedHeap`` calls the engines make on their candidate
+    set. ``pop``, ``peek``, ``iter_sorted`` and truthiness only see providers
+    that are not blocked; ``push``, ``remove``, ``update`` and ``in`` see
+    every task.
+    """
+
+    def __init__(self) -> None:
+        self._heaps: dict[str, IndexedHeap[_QueuedTask]] = {}
+        # Unblocked providers with ready tasks, keyed by their best task.
+        self._heads: IndexedHeap[str] = IndexedHeap()
+        self.blocked: set[str] = set()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return bool(self._heads)
+
+    def __contains__(self, task: _QueuedTask) -> bool:
+        heap = self._heaps.get(task.provider)
+        return heap is not None and task in heap
+
+    def key_of(self, task: _QueuedTask) -> Any:
+        return self._heaps[task.provider].key_of(task)
+
+    def queued(self, provider: str) -> int:
+        heap = self._heaps.get(provider)
+        return 0 if heap is None else len(heap)
+
+    def _sync(self, provider: str) -> None:
+        heap = self._heaps.get(provider)
+        heads = self._heads
+        if heap and provider not in self.blocked:
+            key = heap.peek()[1]
+            if provider not in heads:
+                heads.push(provider, key)
+            elif heads.key_of(provider) != key:
+                heads.update(provider, key)
+        elif provider in heads:
+            heads.remove(provider)
+
+    def block(self, provider: str) -> None:
+        if provider not in self.blocked:
+            self.blocked.add(provider)
+            self._sync(provider)
+
+    def unblock(self, provider: str) -> None:
+        if provider in self.blocked:
+            self.blocked.discard(provider)
+            self._sync(provider)
+
+    def push(self, task: _QueuedTask, key: Any) -> None:
+        heap = self._heaps.get(task.provider)
+        if heap is None:
+            heap = self._heaps[task.provider] = IndexedHeap()
+        heap.push(task, key)
+        self._size += 1
+        self._sync(task.provider)
+
+    def remove(self, task: _QueuedTask) -> Any:
+        key = self._heaps[task.provider].remove(task)
+        self._size -= 1
+        self._sync(task.provider)
+        return key
+
+    def update(self, task: _QueuedTask, key: Any) -> None:
+        self._heaps[task.provider].update(task, key)
+        self._sync(task.provider)
+
+    def peek(self) -> tuple[_QueuedTask, Any]:
+        provider, _ = self._heads.peek()
+        return self._heaps[provider].peek()
+
+    def pop(self) -> tuple[_QueuedTask, Any]:
+        provider, _ = self._heads.peek()
+        task, key = self._heaps[provider].pop()
+        self._size -= 1
+        self._sync(provider)
+        return task, key
+
+    def iter_sorted(self) -> Iterator[tuple[_QueuedTask, Any]]:
+        heaps = self._heaps
+        return heapq.merge(
+            *(heaps[provider].iter_sorted() for provider in self._heads), key=itemgetter(1)
+        )
+
+    def clear(self) -> None:
+        self._heaps.clear()
+        self._heads.clear()
+        self._size = 0
+
+
+class RateLimitedQueue(DependencyAwareQueue):
+    """``DependencyAwareQueue`` that skips providers at their dispatch limits.
+
+    Limits come from the registry's ``Provider`` entries; providers without
+    them dispatch as in ``DependencyAwareQueue``. ``max_in_flight`` counts
+    tasks until their ``ack`` or ``nack``. A token is spent per dispatch.
+    ``dequeue`` returns ``None`` while every ready task is held back, and
+    ``throttled_until`` tells when a token frees one up. ``clock`` must be
+    monotonic and in seconds. Limits changed by re-registering a provider
+    apply from the next call on.
+    """
+
+    def __init__(
+        self,
+        registry: ProviderRegistry | None = None,
+        policy: OrderingPolicy | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        super().__init__(registry=registry, policy=policy)
+        self._candidates = _ProviderHeaps()
+        self._clock = clock
+        self._buckets: dict[str, _TokenBucket] = {}
+        self._in_flight_by_provider: Counter[str] = Counter()
+        # (clock time, provider) for providers waiting on a token.
+        self._wake_ups: list[tuple[float, str]] = []
+        self._wake_at: dict[str, float] = {}
+        self._registry_generation = self._registry.generation
+
+    def _check_registry(self, now: float) -> None:
+        """Re-apply every provider's limits if the registry changed since the last call."""
+        if self._registry.generation == self._registry_generation:
+            return
+        self._registry_generation = self._registry.generation
+        for provider, bucket in list(self._buckets.items()):
+            limits = self._registry.get(provider)
+            if limits is None or limits.rate_limit is None:
+                del self._buckets[provider]
+            elif (bucket.rate, bucket.burst) != (limits.rate_limit, limits.burst):
+                bucket.refill(now)
+                bucket.rate, bucket.burst = limits.rate_limit, limits.burst
+                bucket.tokens = min(bucket.tokens, float(limits.burst))
+        for provider in (
+            self._candidates.blocked | self._in_flight_by_provider.keys() | self._wake_at.keys()
+        ):
+            self._update_limits(provider, now)
+
+    def _bucket(self, provider: str, now: float) -> _TokenBucket | None:
+        bucket = self._buckets.get(provider)
+        if bucket is None:
+            limits = self._registry.get(provider)
+            if limits is None or limits.rate_limit is None:
+                return None
+            bucket = self._buckets[provider] = _TokenBucket(limits.rate_limit, limits.burst, now)
+        return bucket
+
+    def _update_limits(self, provider: str, now: float) -> None:
+        limits = self._registry.get(provider)
+        if limits is None:
+            return
+        candidates = self._candidates
+        if (
+            limits.max_in_flight is not None
+            and self._in_flight_by_provider[provider] >= limits.max_in_flight
+        ):
+            candidates.block(provider)
+            return
+        bucket = self._bucket(provider, now)
+        if bucket is not None and bucket.refill(now) < 1:
+            candidates.block(provider)
+            wake_at = bucket.available_at()
+            if self._wake_at.get(provider) != wake_at:
+                self._wake_at[provider] = wake_at
+                heapq.heappush(self._wake_ups, (wake_at, provider))
+            return
+        self._wake_at.pop(provider, None)
+        candidates.unblock(provider)
+
+    def _wake(self, now: float) -> None:
+        wake_ups = self._wake_ups
+        while wake_ups and wake_ups[0][0] <= now:
+            wake_at, provider = heapq.heappop(wake_ups)
+            if self._wake_at.get(provider) == wake_at:
+                del self._wake_at[provider]
+                self._update_limits(provider, now)
+
+    def _refresh(self) -> None:
+        """Catch up on due wake-ups and registry changes before reading the candidates."""
+        if self._wake_ups or self._registry.generation != self._registry_generation:
+            now = self._clock()
+            self._check_registry(now)
+            self._wake(now)
+
+    def dequeue(self) -> TaskDispatch | None:
+        self._refresh()
+        return super().dequeue()
+
+    def dequeue_many(self, n: int) -> list[TaskDispatch]:
+        self._refresh()
+        return super().dequeue_many(n)
+
+    def _dispatch(self, task: _QueuedTask) -> TaskDispatch:
+        provider = task.provider
+        self._in_flight_by_provider[provider] += 1
+        now = self._clock()
+        bucket = self._bucket(provider, now)
+        if bucket is not None:
+            bucket.take(now)
+        self._update_limits(provider, now)
+        return super()._dispatch(task)
+
+    def _release(self, provider: str) -> None:
+        self._in_flight_by_provider[provider] -= 1
+        if not self._in_flight_by_provider[provider]:
+            del self._in_flight_by_provider[provider]
+        now = self._clock()
+        self._check_registry(now)
+        self._update_limits(provider, now)
+
+    def ack(self, user_id: int, provider: str) -> bool:
+        if not super().ack(user_id, provider):
+            return False
+        self._release(provider)
+        return True
+
+    def nack(self, user_id: int, provider: str, requeue: bool = True) -> bool:
+        if not super().nack(user_id, provider, requeue):
+            return False
+        self._release(provider)
+        return True
+
+    def throttled_until(self) -> float | None:
+        """Clock time at which a token lets a held-back task through.
+
+        ``None`` when a task can be dispatched right now, or when every
+        ready task waits on ``max_in_flight`` or nothing is ready, so only
+        an ``ack``, ``nack`` or enqueue can change that.
+        """
+        now = self._clock()
+        self._check_registry(now)
+        self._wake(now)
+        candidates = self._candidates
+        if candidates:
+            return None
+        # Only providers blocked on a token are scheduled to wake up.
+        return min(
+            (wake_at for provider, wake_at in self._wake_at.items() if candidates.queued(provider)),
+            default=None,
+        )
+
+    def _ordered_tasks(self) -> Iterator[_QueuedTask]:
+        self._refresh()
+        # The re-keying preview still covers tasks of blocked providers.
+        blocked = self._candidates.blocked
+        return (task for task in super()._ordered_tasks() if task.provider not in blocked)
+
+
+class ThreadSafeRateLimitedQueue(ThreadSafeDependencyQueue):
+    """``RateLimitedQueue`` shared by request threads and parallel workers."""
+
+    engine_type = RateLimitedQueue
+
+    def throttled_until(self) -> float | None:
+        with self._lock:
+            return self._queue.throttled_until()
+
+
+__all__ = ["RateLimitedQueue", "ThreadSafeRateLimitedQueue"]
@@ -0,0 +1,348 @@
+"""Queue engine partitioned by ``user_id`` across worker processes.
+
+Everything the legacy order depends on per user (deduplication, the rule of
+3) lives entirely in one shard, because a user's tasks always hash to the
+same shard. The two pieces of global state are owned by the coordinator:
+
+* the newest timestamp in the whole queue, which decides bank freshness;
+* sequence numbers and tie-break labels, so that equal keys in different
+  shards still compare in the order the legacy stable sort leaves them.
+
+A dequeue asks every shard to re-key against the global newest timestamp,
+labels the tasks that moved with one ``TieBreakLabeler`` across all shards,
+then pops the shard holding the smallest head key. The dispatch order is
+therefore identical to ``HeapQueue`` and the legacy ``Queue``.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+from collections import defaultdict
+from datetime import datetime
+from multiprocessing.connection import Connection
+from typing import Any, Iterable, Sequence
+
+from solutions.IWC.ordering_policy import OrderingPolicy
+from solutions.IWC.provider_registry import PROVIDER_REGISTRY, ProviderRegistry
+from solutions.IWC.queue_solution_heap import (
+    ExpandedTask,
+    HeapQueue,
+    TieBreakLabeler,
+    expand_submission,
+)
+from solutions.IWC.task_types import TaskDispatch, TaskSubmission
+
+DEFAULT_SHARD_COUNT = 4
+
+# (size, oldest time key, newest time key) of one shard; ``None`` keys when empty.
+ShardBounds = tuple[int, int | None, int | None]
+
+# A submission as shipped to a shard: the ``TaskSubmission`` fields (plain
+# tuples pickle far faster than dataclass instances), the dependency closure
+# resolved by the coordinator, and the ``seq`` its first task follows.
+Submission = tuple[str, int, datetime | str, dict[str, object], tuple[str, ...], int]
+
+
+class _ShardEngine(HeapQueue):
+    """``HeapQueue`` driven step by step by a ``ShardedQueue`` coordinator.
+
+    Tasks arrive already expanded with global sequence numbers, and the
+    dequeue is split so labels can be assigned across all shards.
+    """
+
+    def __init__(self, policy: OrderingPolicy | None = None) -> None:
+        super().__init__(policy=policy)
+        # The tasks returned by the last ``prepare``, in the order returned.
+        self._moving: list[Any] = []
+
+    def bounds(self) -> ShardBounds:
+        if not self._heap:
+            return 0, None, None
+        return len(self._heap), self._time_bounds.oldest(), self._time_bounds.newest()
+
+    def offer(self, submissions: Sequence[Submission]) -> ShardBounds:
+        """Enqueue submissions in order, each as ``Submission`` fields."""
+        expanded: list[ExpandedTask] = []
+        seqs: list[int] = []
+        for provider, user_id, timestamp, metadata, closure, first_seq in submissions:
+            entries = expand_submission(
+                TaskSubmission(provider, user_id, timestamp, metadata), closure
+            )
+            expanded.extend(entries)
+            seqs.extend(range(first_seq + 1, first_seq + 1 + len(entries)))
+        self.enqueue_many_expanded(expanded, seqs)
+        return self.bounds()
+
+    def prepare(
+        self, queue_newest: int, sorted_through: int
+    ) -> tuple[list[tuple[int, tuple, tuple]], tuple | None]:
+        """Re-key against the global state.
+
+        Returns ``(number, old_heap_key, new_key)`` for the tasks that need
+        a global label, numbered for ``relabel``, or the head key when there
+        are none.
+        """
+        self._sorted_through = sorted_through
+        moved = self._prepare_dequeue(queue_newest)
+        if not moved:
+            return [], self._head_key()
+        self._moving = [task for task, _ in moved]
+        return [
+            (number, task.heap_key, key) for number, (task, key) in enumerate(moved)
+        ], None
+
+    def relabel(self, relabelled: list[tuple[int, tuple]]) -> tuple | None:
+        for number, heap_key in relabelled:
+            task = self._moving[number]
+            task.heap_key = heap_key
+            self._heap.update(task, heap_key)
+        self._moving = []
+        return self._head_key()
+
+    def withdraw(self, user_id: int, provider: str | None) -> tuple[int, ShardBounds]:
+        return self.cancel(user_id, provider), self.bounds()
+
+    def pop(self) -> tuple[TaskDispatch, ShardBounds]:
+        task, _ = self._heap.pop()
+        self._forget(task)
+        return TaskDispatch(provider=task.provider, user_id=task.user_id), self.bounds()
+
+    def _head_key(self) -> tuple | None:
+        return self._heap.peek()[1] if self._heap else None
+
+
+class _LocalShard:
+    """Shard running in the coordinator's own process."""
+
+    def __init__(self, policy: OrderingPolicy | None) -> None:
+        self._engine = _ShardEngine(policy)
+        self._reply: tuple[bool, Any] = (True, None)
+
+    def send(self, method: str, *args: Any) -> None:
+        # Errors surface on ``receive``, as they do across a pipe.
+        try:
+            self._reply = (True, getattr(self._engine, method)(*args))
+        except Exception as error:
+            self._reply = (False, error)
+
+    def receive(self) -> Any:
+        (ok, result), self._reply = self._reply, (True, None)
+        if not ok:
+            raise result
+        return result
+
+    def close(self) -> None:
+        pass
+
+
+def _serve_shard(connection: Connection, policy: OrderingPolicy | None) -> None:
+    engine = _ShardEngine(policy)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        method, args = request
+        try:
+            connection.send((True, getattr(engine, method)(*args)))
+        except Exception as error:
+            connection.send((False, error))
+    connection.close()
+
+
+class _ProcessShard:
+    """Shard running in a child process, driven over a pipe."""
+
+    def __init__(
+        self, context: multiprocessing.context.BaseContext, policy: OrderingPolicy | None
+    ) -> None:
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(
+            target=_serve_shard, args=(child_connection, policy), daemon=True
+        )
+        self._process.start()
+        child_connection.close()
+
+    def send(self, method: str, *args: Any) -> None:
+        self._connection.send((method, args))
+
+    def receive(self) -> Any:
+        ok, result = self._connection.recv()
+        if not ok:
+            raise result
+        return result
+
+    def close(self) -> None:
+        if self._process.is_alive():
+            self._connection.send(None)
+            self._process.join()
+        self._connection.close()
+
+
+class ShardedQueue:
+    """Legacy-ordered queue split across ``shards`` partitions by ``user_id``.
+
+    With ``processes`` each shard is a child process, so the index and heap
+    work of a large ``enqueue_many`` runs on several cores at once. A single
+    ``enqueue`` or ``dequeue`` is bound by the round trips to the shards
+    instead; ``processes=False`` keeps the shards in-process.
+
+    The coordinator resolves dependency closures, so providers registered
+    at runtime take effect as they do for ``HeapQueue``, while timestamps are
+    parsed in the shards. A submission a shard rejects (an unparseable
+    timestamp) fails that shard's part of the call only: ``enqueue_many``
+    still stores the other shards' batches, then raises the error.
+    """
+
+    def __init__(
+        self,
+        shards: int = DEFAULT_SHARD_COUNT,
+        processes: bool = True,
+        registry: ProviderRegistry | None = None,
+        policy: OrderingPolicy | None = None,
+    ) -> None:
+        if shards < 1:
+            raise ValueError(f"A sharded queue needs at least one shard, got {shards}")
+        self._registry = PROVIDER_REGISTRY if registry is None else registry
+        if processes:
+            context = multiprocessing.get_context()
+            self._shards: list[_LocalShard | _ProcessShard] = [
+                _ProcessShard(context, policy) for _ in range(shards)
+            ]
+        else:
+            self._shards = [_LocalShard(policy) for _ in range(shards)]
+        self._bounds: list[ShardBounds] = [(0, None, None)] * shards
+        self._labeler = TieBreakLabeler()
+        self._seq = 0
+        # Highest global ``seq`` that has been through a dequeue.
+        self._sorted_through = 0
+
+    def __enter__(self) -> ShardedQueue:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop the shard processes; the queue is unusable afterwards."""
+        for shard in self._shards:
+            shard.close()
+
+    def _shard_of(self, user_id: int) -> int:
+        return hash(user_id) % len(self._shards)
+
+    def _call(self, index: int, method: str, *args: Any) -> Any:
+        shard = self._shards[index]
+        shard.send(method, *args)
+        return shard.receive()
+
+    def _gather(self, calls: dict[int, tuple]) -> tuple[dict[int, Any], Exception | None]:
+        """Send every ``index -> (method, *args)`` call, then collect every reply.
+
+        Returns the successful replies and the first error. Each reply is
+        read even after an error, so no pipe is left holding a stale one.
+        """
+        for index, (method, *args) in calls.items():
+            self._shards[index].send(method, *args)
+        replies: dict[int, Any] = {}
+        first_error: Exception | None = None
+        for index in calls:
+            try:
+                replies[index] = self._shards[index].receive()
+            except Exception as error:
+                if first_error is None:
+                    first_error = error
+        return replies, first_error
+
+    def _call_each(self, calls: dict[int, tuple]) -> dict[int, Any]:
+        replies, error = self._gather(calls)
+        if error is not None:
+            raise error
+        return replies
+
+    def _submission(self, item: TaskSubmission) -> Submission:
+        closure = self._registry.dependency_closure(item.provider)
+        first_seq = self._seq
+        self._seq += len(closure) + 1
+        return item.provider, item.user_id, item.timestamp, item.metadata, closure, first_seq
+
+    def enqueue(self, item: TaskSubmission) -> int:
+        index = self._shard_of(item.user_id)
+        self._bounds[index] = self._call(index, "offer", [self._submission(item)])
+        return self.size
+
+    def enqueue_many(self, items: Iterable[TaskSubmission]) -> int:
+        batches: dict[int, list[Submission]] = defaultdict(list)
+        for item in items:
+            batches[self._shard_of(item.user_id)].append(self._submission(item))
+        replies, error = self._gather({index: ("offer", batch) for index, batch in batches.items()})
+        for index, bounds in replies.items():
+            self._bounds[index] = bounds
+        if error is not None:
+            raise error
+        return self.size
+
+    def dequeue(self) -> TaskDispatch | None:
+        if self.size == 0:
+            return None
+
+        queue_newest = max(newest for _, _, newest in self._bounds if newest is not None)
+        prepared = self._call_each(
+            {
+                index: ("prepare", queue_newest, self._sorted_through)
+                for index, (size, _, _) in enumerate(self._bounds)
+                if size
+            }
+        )
+        heads = {index: head for index, (_, head) in prepared.items()}
+        moved = [
+            ((index, number), old_heap_key, key)
+            for index, (shard_moved, _) in prepared.items()
+            for number, old_heap_key, key in shard_moved
+        ]
+        if moved:
+            relabelled: dict[int, list[tuple[int, tuple]]] = defaultdict(list)
+            for (index, number), heap_key in self._labeler.relabel(moved, self._sorted_through):
+                relabelled[index].append((number, heap_key))
+            heads.update(
+                self._call_each(
+                    {index: ("relabel", labels) for index, labels in relabelled.items()}
+                )
+            )
+        self._sorted_through = self._seq
+
+        index = min(heads, key=heads.__getitem__)
+        dispatch, self._bounds[index] = self._call(index, "pop")
+        return dispatch
+
+    def dequeue_many(self, n: int) -> list[TaskDispatch]:
+        dispatches: list[TaskDispatch] = []
+        while len(dispatches) < n and self.size:
+            dispatches.append(self.dequeue())
+        return dispatches
+
+    @property
+    def size(self) -> int:
+        return sum(size for size, _, _ in self._bounds)
+
+    @property
+    def age(self) -> int:
+        if self.size <= 1:
+            return 0
+
+        oldest = min(low for _, low, _ in self._bounds if low is not None)
+        newest = max(high for _, _, high in self._bounds if high is not None)
+        return (newest - oldest) // 1_000_000
+
+    def cancel(self, user_id: int, provider: str | None = None) -> int:
+        index = self._shard_of(user_id)
+        cancelled, self._bounds[index] = self._call(index, "withdraw", user_id, provider)
+        return cancelled
+
+    def purge(self) -> bool:
+        self._call_each({index: ("purge",) for index in range(len(self._shards))})
+        self._bounds = [(0, None, None)] * len(self._shards)
+        self._sorted_through = self._seq
+        return True
+
+
+__all__ = ["ShardedQueue", "DEFAULT_SHARD_COUNT"]
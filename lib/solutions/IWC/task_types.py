@@ -3,7 +3,10 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from datetime import datetime
+from datetime import datetime, timedelta
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
 
 
 @dataclass
@@ -23,4 +26,31 @@ class TaskDispatch:
     user_id: int
 
 
-__all__ = ["TaskSubmission", "TaskDispatch"]
+def timestamp_key(timestamp: datetime | str) -> int:
+    """Return ``timestamp`` as integer microseconds since the epoch.
+
+    Like the legacy queue, any timezone is dropped rather than converted, so
+    keys compare exactly as the naive datetimes the legacy ``Queue`` sorts on.
+    """
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if not isinstance(timestamp, datetime):
+        raise TypeError(f"Unsupported task timestamp: {timestamp!r}")
+    return (timestamp.replace(tzinfo=None) - _EPOCH) // _MICROSECOND
+
+
+def datetime_from_key(time_key: int) -> datetime:
+    """Inverse of ``timestamp_key``, as a naive datetime."""
+    return _EPOCH + time_key * _MICROSECOND
+
+
+MAX_TIME_KEY = timestamp_key(datetime.max)
+
+
+__all__ = [
+    "TaskSubmission",
+    "TaskDispatch",
+    "timestamp_key",
+    "datetime_from_key",
+    "MAX_TIME_KEY",
+]
@@ -0,0 +1,618 @@
+"""Micro-benchmarks for the IWC queue engines.
+
+Run from the repository root, for example::
+
+    PYTHONPATH=lib python -m test.solution_tests.IWC.bench_queue \\
+        --engines legacy heap --depths 10 1000 100000 --output bench.json
+
+For every engine and queue depth the queue is first filled from a seeded
+``WorkloadGenerator``. Then ``enqueue``, ``size``, ``age`` and ``dequeue`` are
+timed in turn, one enqueue and one dequeue per round, so the depth stays
+put while sampling. ``purge`` is timed on freshly refilled queues. Results
+carry latency percentiles and throughput per operation, plus the speed-up
+over the legacy ``Queue`` measured at the same depth. Pass an earlier
+results file to ``--compare`` to flag regressions; the exit status is 1 when
+there are any.
+
+``--memory`` also reports what each engine keeps per queued task, traced
+with ``tracemalloc`` while filling an empty queue to each depth, next to the
+legacy ``Queue`` at the same depth. Add ``compact`` to ``--engines`` to see
+the array-backed engine's share.
+
+``--durability`` compares the crash-safe ``DurableQueue`` with the in-memory
+heap engine it wraps: the mean cost of an enqueue plus a dequeue at each
+depth, with the default group-commit ``fsync``, and how long reopening the
+queue takes from the write-ahead log alone and from a snapshot.
+
+``--contention`` shares one ``ThreadSafeQueue`` between 1, 4 and 16 threads
+(``--threads``) running enqueue-and-dequeue rounds on overlapping users, and
+reports throughput next to a single thread's. The engine serialises on one
+lock, so more threads cannot go faster; what matters is that hand-offs do not
+collapse throughput.
+
+The legacy queue re-sorts and recounts every user on each dequeue, which
+takes about 0.2s at a depth of 2,000, so it is skipped above
+``--legacy-max-depth`` and every run stops sampling after ``--time-budget``
+seconds.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from solutions.IWC.queue_solution_durable import DurableQueue
+from solutions.IWC.queue_solution_entrypoint import QUEUE_ENGINES
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.queue_solution_threaded import ThreadSafeQueue
+
+from .workload import WorkloadConfig, WorkloadGenerator
+
+STEADY_STATE_OPERATIONS = ("enqueue", "size", "age", "dequeue")
+DEFAULT_DEPTHS = (10, 100, 1_000, 10_000, 100_000, 1_000_000)
+DEFAULT_LEGACY_MAX_DEPTH = 1_000
+DEFAULT_THREAD_COUNTS = (1, 4, 16)
+CONTENTION_DEPTH = 1_000
+# Wall-clock budget for the sampling rounds at one depth; a slow engine
+# stops early with fewer samples rather than running for hours.
+DEFAULT_TIME_BUDGET_SECONDS = 30.0
+BASELINE_ENGINE = "legacy"
+FILL_CHUNK = 10_000
+# Rounds timed back to back on one engine before switching to the other.
+DURABILITY_BLOCK = 500
+
+
+@dataclass
+class OperationResult:
+    engine: str
+    depth: int
+    operation: str
+    samples: int
+    mean_us: float
+    p50_us: float
+    p90_us: float
+    p99_us: float
+    max_us: float
+    ops_per_second: float
+    speedup_vs_legacy: float | None = None
+
+
+@dataclass
+class MemoryResult:
+    engine: str
+    depth: int
+    bytes_per_task: float
+    ratio_vs_legacy: float | None = None
+
+
+@dataclass
+class DurabilityResult:
+    depth: int
+    heap_round_us: float
+    durable_round_us: float
+    overhead: float
+    replay_seconds: float
+    restore_seconds: float
+
+
+@dataclass
+class ContentionResult:
+    threads: int
+    rounds: int
+    round_p50_us: float
+    round_p99_us: float
+    rounds_per_second: float
+    scaling_vs_one_thread: float | None = None
+
+
+def percentile(ordered: list[int], fraction: float) -> int:
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, round(fraction * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarise(engine: str, depth: int, operation: str, timings_ns: list[int]) -> OperationResult:
+    ordered = sorted(timings_ns)
+    mean_ns = sum(ordered) / len(ordered)
+    return OperationResult(
+        engine=engine,
+        depth=depth,
+        operation=operation,
+        samples=len(ordered),
+        mean_us=mean_ns / 1_000,
+        p50_us=percentile(ordered, 0.50) / 1_000,
+        p90_us=percentile(ordered, 0.90) / 1_000,
+        p99_us=percentile(ordered, 0.99) / 1_000,
+        max_us=ordered[-1] / 1_000,
+        ops_per_second=1e9 / mean_ns if mean_ns else float("inf"),
+    )
+
+
+def fill(queue, generator: WorkloadGenerator, depth: int) -> None:
+    """Enqueue generated tasks until ``queue`` holds at least ``depth``."""
+    stalled = 0
+    while queue.size < depth:
+        before = queue.size
+        queue.enqueue_many(generator.submissions(min(FILL_CHUNK, depth - before)))
+        stalled = stalled + 1 if queue.size == before else 0
+        if stalled > 100:
+            raise RuntimeError(
+                f"Workload cannot reach depth {depth}; raise the user count"
+            )
+
+
+def run_depth(
+    engine: str,
+    factory: Callable[[], object],
+    depth: int,
+    config: WorkloadConfig,
+    samples: int,
+    purge_samples: int,
+    time_budget: float = DEFAULT_TIME_BUDGET_SECONDS,
+) -> list[OperationResult]:
+    # Enough users for the queue to reach ``depth`` despite deduplication.
+    generator = WorkloadGenerator(replace(config, users=max(config.users, depth)))
+    queue = factory()
+    fill(queue, generator, depth)
+    items = generator.submissions(samples)
+    timings: dict[str, list[int]] = {operation: [] for operation in STEADY_STATE_OPERATIONS}
+    clock = time.perf_counter_ns
+
+    gc.collect()
+    deadline = clock() + int(time_budget * 1e9)
+    for item in items:
+        start = clock()
+        queue.enqueue(item)
+        enqueued = clock()
+        queue.size
+        sized = clock()
+        queue.age
+        aged = clock()
+        queue.dequeue()
+        dequeued = clock()
+        timings["enqueue"].append(enqueued - start)
+        timings["size"].append(sized - enqueued)
+        timings["age"].append(aged - sized)
+        timings["dequeue"].append(dequeued - aged)
+        if dequeued > deadline:
+            break
+
+    purges: list[int] = []
+    for _ in range(purge_samples):
+        if clock() > deadline and purges:
+            break
+        fill(queue, generator, depth)
+        start = clock()
+        queue.purge()
+        purges.append(clock() - start)
+    close = getattr(queue, "close", None)
+    if close is not None:
+        close()
+
+    results = [
+        summarise(engine, depth, operation, operation_timings)
+        for operation, operation_timings in timings.items()
+    ]
+    if purges:
+        results.append(summarise(engine, depth, "purge", purges))
+    return results
+
+
+def measure_memory(factory: Callable[[], object], depth: int, config: WorkloadConfig) -> float:
+    """Bytes still allocated per queued task once ``depth`` tasks are queued.
+
+    Submissions are generated while tracing, so whatever the engine keeps of
+    them counts and whatever it drops does not.
+    """
+    generator = WorkloadGenerator(replace(config, users=max(config.users, depth)))
+    gc.collect()
+    tracemalloc.start()
+    try:
+        queue = factory()
+        fill(queue, generator, depth)
+        gc.collect()
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    size = queue.size
+    close = getattr(queue, "close", None)
+    if close is not None:
+        close()
+    return allocated / size
+
+
+def run_memory(
+    engines: list[str],
+    depths: list[int],
+    config: WorkloadConfig,
+    legacy_max_depth: int = DEFAULT_LEGACY_MAX_DEPTH,
+    log: Callable[[str], None] = lambda message: None,
+) -> list[MemoryResult]:
+    results: list[MemoryResult] = []
+    for depth in depths:
+        for engine in engines:
+            if engine == BASELINE_ENGINE and depth > legacy_max_depth:
+                log(f"skipping {engine} memory at depth {depth}")
+                continue
+            log(f"{engine} memory at depth {depth}")
+            results.append(
+                MemoryResult(engine, depth, measure_memory(QUEUE_ENGINES[engine], depth, config))
+            )
+    baseline = {
+        result.depth: result.bytes_per_task
+        for result in results
+        if result.engine == BASELINE_ENGINE
+    }
+    for result in results:
+        legacy = baseline.get(result.depth)
+        if legacy:
+            result.ratio_vs_legacy = result.bytes_per_task / legacy
+    return results
+
+
+def measure_durability(
+    depth: int, config: WorkloadConfig, samples: int, directory: Path
+) -> DurabilityResult:
+    """Logging overhead and recovery times of a ``DurableQueue`` at ``depth``.
+
+    Both queues get the same submissions; rounds alternate between them in
+    blocks, and the overhead is the median ratio of paired blocks, so drift
+    in machine load and collector pauses landing on one side cancel out.
+    """
+    config = replace(config, users=max(config.users, depth))
+    heap = HeapQueue()
+    durable = DurableQueue(directory, snapshot_every=None)
+    fill(heap, WorkloadGenerator(config), depth)
+    fill(durable, WorkloadGenerator(config), depth)
+    items = WorkloadGenerator(replace(config, seed=config.seed + 1)).submissions(samples)
+    blocks: list[tuple[int, int]] = []
+    clock = time.perf_counter_ns
+
+    gc.collect()
+    for start in range(0, len(items), DURABILITY_BLOCK):
+        block = items[start : start + DURABILITY_BLOCK]
+        timings = []
+        for queue in (heap, durable):
+            began = clock()
+            for item in block:
+                queue.enqueue(item)
+                queue.dequeue()
+            timings.append(clock() - began)
+        blocks.append((timings[0], timings[1]))
+    durable.close()
+    del heap, durable
+    ratios = sorted(durable_ns / heap_ns for heap_ns, durable_ns in blocks)
+    heap_us, durable_us = (sum(side) / len(items) / 1_000 for side in zip(*blocks))
+
+    gc.collect()
+    began = clock()
+    recovered = DurableQueue(directory, snapshot_every=None)
+    replay_seconds = (clock() - began) / 1e9
+    recovered.snapshot()
+    recovered.close()
+    del recovered
+    gc.collect()
+    began = clock()
+    recovered = DurableQueue(directory, snapshot_every=None)
+    restore_seconds = (clock() - began) / 1e9
+    recovered.close()
+
+    return DurabilityResult(
+        depth=depth,
+        heap_round_us=heap_us,
+        durable_round_us=durable_us,
+        overhead=ratios[len(ratios) // 2] - 1,
+        replay_seconds=replay_seconds,
+        restore_seconds=restore_seconds,
+    )
+
+
+def run_durability(
+    depths: list[int],
+    config: WorkloadConfig,
+    samples: int = 10_000,
+    log: Callable[[str], None] = lambda message: None,
+) -> list[DurabilityResult]:
+    results = []
+    for depth in depths:
+        log(f"durable at depth {depth}")
+        with tempfile.TemporaryDirectory() as directory:
+            results.append(measure_durability(depth, config, samples, Path(directory)))
+    return results
+
+
+def measure_contention(
+    threads: int, depth: int, config: WorkloadConfig, rounds: int
+) -> ContentionResult:
+    """Throughput of one ``ThreadSafeQueue`` shared by ``threads`` threads.
+
+    Each thread runs enqueue-then-dequeue rounds, ``rounds`` in total, on
+    submissions from the same user pool, so threads collide on users and
+    deduplication and rule-of-3 promotion happen under contention too. A
+    round's latency includes waiting for the lock and the GIL.
+    """
+    generator = WorkloadGenerator(config)
+    queue = ThreadSafeQueue()
+    fill(queue, generator, depth)
+    batches = [generator.submissions(rounds // threads) for _ in range(threads)]
+    timings: list[list[int]] = [[] for _ in range(threads)]
+    start_line = threading.Barrier(threads + 1)
+    clock = time.perf_counter_ns
+
+    def hammer(items: list, out: list[int]) -> None:
+        start_line.wait()
+        for item in items:
+            began = clock()
+            queue.enqueue(item)
+            queue.dequeue()
+            out.append(clock() - began)
+
+    workers = [
+        threading.Thread(target=hammer, args=(items, out)) for items, out in zip(batches, timings)
+    ]
+    for worker in workers:
+        worker.start()
+    gc.collect()
+    start_line.wait()
+    began = clock()
+    for worker in workers:
+        worker.join()
+    elapsed = clock() - began
+    ordered = sorted(timing for out in timings for timing in out)
+    return ContentionResult(
+        threads=threads,
+        rounds=len(ordered),
+        round_p50_us=percentile(ordered, 0.50) / 1_000,
+        round_p99_us=percentile(ordered, 0.99) / 1_000,
+        rounds_per_second=len(ordered) / elapsed * 1e9,
+    )
+
+
+def run_contention(
+    thread_counts: list[int],
+    config: WorkloadConfig,
+    rounds: int = 20_000,
+    depth: int = CONTENTION_DEPTH,
+    log: Callable[[str], None] = lambda message: None,
+) -> list[ContentionResult]:
+    results = []
+    for threads in thread_counts:
+        log(f"threadsafe with {threads} threads")
+        results.append(measure_contention(threads, depth, config, rounds))
+    single = next((result for result in results if result.threads == 1), None)
+    if single is not None:
+        for result in results:
+            result.scaling_vs_one_thread = result.rounds_per_second / single.rounds_per_second
+    return results
+
+
+def run_benchmarks(
+    engines: list[str],
+    depths: list[int],
+    config: WorkloadConfig,
+    samples: int = 1_000,
+    purge_samples: int = 5,
+    legacy_max_depth: int = DEFAULT_LEGACY_MAX_DEPTH,
+    time_budget: float = DEFAULT_TIME_BUDGET_SECONDS,
+    log: Callable[[str], None] = lambda message: None,
+) -> list[OperationResult]:
+    results: list[OperationResult] = []
+    for depth in depths:
+        for engine in engines:
+            if engine == BASELINE_ENGINE and depth > legacy_max_depth:
+                log(f"skipping {engine} at depth {depth}")
+                continue
+            log(f"{engine} at depth {depth}")
+            results.extend(
+                run_depth(
+                    engine,
+                    QUEUE_ENGINES[engine],
+                    depth,
+                    config,
+                    samples,
+                    purge_samples,
+                    time_budget,
+                )
+            )
+    baseline = {
+        (result.depth, result.operation): result.p50_us
+        for result in results
+        if result.engine == BASELINE_ENGINE
+    }
+    for result in results:
+        legacy_p50 = baseline.get((result.depth, result.operation))
+        if legacy_p50 is not None and result.p50_us:
+            result.speedup_vs_legacy = legacy_p50 / result.p50_us
+    return results
+
+
+def find_regressions(
+    current: list[dict], previous: list[dict], threshold: float
+) -> list[str]:
+    """Describe every operation whose median latency grew by more than ``threshold``."""
+    before = {(row["engine"], row["depth"], row["operation"]): row for row in previous}
+    regressions = []
+    for row in current:
+        old = before.get((row["engine"], row["depth"], row["operation"]))
+        if old is None or not old["p50_us"]:
+            continue
+        ratio = row["p50_us"] / old["p50_us"]
+        if ratio > 1 + threshold:
+            regressions.append(
+                f"{row['engine']} {row['operation']} at depth {row['depth']}: "
+                f"p50 {old['p50_us']:.2f}us -> {row['p50_us']:.2f}us ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def format_table(results: list[OperationResult]) -> str:
+    lines = [
+        f"{'engine':<10} {'depth':>8} {'operation':<8} {'p50 us':>10} {'p99 us':>10} "
+        f"{'ops/s':>12} {'vs legacy':>10}"
+    ]
+    for result in results:
+        speedup = "" if result.speedup_vs_legacy is None else f"{result.speedup_vs_legacy:.1f}x"
+        lines.append(
+            f"{result.engine:<10} {result.depth:>8} {result.operation:<8} "
+            f"{result.p50_us:>10.2f} {result.p99_us:>10.2f} "
+            f"{result.ops_per_second:>12.0f} {speedup:>10}"
+        )
+    return "\n".join(lines)
+
+
+def format_memory_table(results: list[MemoryResult]) -> str:
+    lines = [f"{'engine':<10} {'depth':>8} {'bytes/task':>11} {'vs legacy':>10}"]
+    for result in results:
+        ratio = "" if result.ratio_vs_legacy is None else f"{result.ratio_vs_legacy:.2f}x"
+        lines.append(
+            f"{result.engine:<10} {result.depth:>8} {result.bytes_per_task:>11.0f} {ratio:>10}"
+        )
+    return "\n".join(lines)
+
+
+def format_durability_table(results: list[DurabilityResult]) -> str:
+    lines = [
+        f"{'depth':>8} {'heap us':>9} {'durable us':>11} {'overhead':>9} "
+        f"{'replay s':>9} {'restore s':>10}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result.depth:>8} {result.heap_round_us:>9.2f} {result.durable_round_us:>11.2f} "
+            f"{result.overhead:>9.1%} {result.replay_seconds:>9.2f} "
+            f"{result.restore_seconds:>10.2f}"
+        )
+    return "\n".join(lines)
+
+
+def format_contention_table(results: list[ContentionResult]) -> str:
+    lines = [
+        f"{'threads':>7} {'rounds':>8} {'p50 us':>9} {'p99 us':>10} "
+        f"{'rounds/s':>10} {'vs 1':>6}"
+    ]
+    for result in results:
+        scaling = (
+            "" if result.scaling_vs_one_thread is None else f"{result.scaling_vs_one_thread:.2f}x"
+        )
+        lines.append(
+            f"{result.threads:>7} {result.rounds:>8} {result.round_p50_us:>9.2f} "
+            f"{result.round_p99_us:>10.2f} {result.rounds_per_second:>10.0f} {scaling:>6}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    defaults = WorkloadConfig()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engines", nargs="+", default=[BASELINE_ENGINE, "heap"],
+                        choices=sorted(QUEUE_ENGINES))
+    parser.add_argument("--depths", nargs="+", type=int, default=list(DEFAULT_DEPTHS))
+    parser.add_argument("--samples", type=int, default=1_000)
+    parser.add_argument("--purge-samples", type=int, default=5)
+    parser.add_argument("--legacy-max-depth", type=int, default=DEFAULT_LEGACY_MAX_DEPTH)
+    parser.add_argument("--time-budget", type=float, default=DEFAULT_TIME_BUDGET_SECONDS)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--bank-share", type=float, default=defaults.bank_statement_share)
+    parser.add_argument("--spread-seconds", type=int, default=defaults.timestamp_spread_seconds)
+    parser.add_argument("--rule-of-3-fraction", type=float,
+                        default=defaults.rule_of_3_user_fraction)
+    parser.add_argument("--memory", action="store_true",
+                        help="also report memory per queued task")
+    parser.add_argument("--durability", action="store_true",
+                        help="also report write-ahead log overhead and recovery time")
+    parser.add_argument("--contention", action="store_true",
+                        help="also report ThreadSafeQueue throughput shared between threads")
+    parser.add_argument("--threads", nargs="+", type=int, default=list(DEFAULT_THREAD_COUNTS))
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    parser.add_argument("--compare", type=Path, help="earlier JSON results to check against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed p50 slow-down before a regression is flagged")
+    args = parser.parse_args(argv)
+
+    config = replace(
+        defaults,
+        seed=args.seed,
+        users=args.users,
+        bank_statement_share=args.bank_share,
+        timestamp_spread_seconds=args.spread_seconds,
+        rule_of_3_user_fraction=args.rule_of_3_fraction,
+    )
+    results = run_benchmarks(
+        args.engines,
+        args.depths,
+        config,
+        samples=args.samples,
+        purge_samples=args.purge_samples,
+        legacy_max_depth=args.legacy_max_depth,
+        time_budget=args.time_budget,
+        log=lambda message: print(message, file=sys.stderr),
+    )
+    print(format_table(results))
+    memory: list[MemoryResult] = []
+    if args.memory:
+        memory = run_memory(
+            args.engines,
+            args.depths,
+            config,
+            legacy_max_depth=args.legacy_max_depth,
+            log=lambda message: print(message, file=sys.stderr),
+        )
+        print()
+        print(format_memory_table(memory))
+    durability: list[DurabilityResult] = []
+    if args.durability:
+        durability = run_durability(
+            args.depths,
+            config,
+            samples=max(args.samples, 10 * DURABILITY_BLOCK),
+            log=lambda message: print(message, file=sys.stderr),
+        )
+        print()
+        print(format_durability_table(durability))
+    contention: list[ContentionResult] = []
+    if args.contention:
+        contention = run_contention(
+            args.threads,
+            config,
+            rounds=max(args.samples, 20_000),
+            log=lambda message: print(message, file=sys.stderr),
+        )
+        print()
+        print(format_contention_table(contention))
+
+    rows = [asdict(result) for result in results]
+    if args.output is not None:
+        report = {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workload": {**asdict(config), "start": config.start.isoformat()},
+            "samples": args.samples,
+            "results": rows,
+            "memory": [asdict(result) for result in memory],
+            "durability": [asdict(result) for result in durability],
+            "contention": [asdict(result) for result in contention],
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.compare is not None:
+        previous = json.loads(args.compare.read_text())["results"]
+        regressions = find_regressions(rows, previous, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
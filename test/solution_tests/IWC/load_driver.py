@@ -0,0 +1,310 @@
+"""Load driver for capacity planning of the IWC queue.
+
+Sends calls to ``EntryPointMapping`` exactly as the challenge runner does,
+as ``(method, params)`` pairs, either generated as open-loop traffic at a
+target rate or replayed from a JSONL trace::
+
+    PYTHONPATH=lib python -m test.solution_tests.IWC.load_driver generate \\
+        --rate 2000 --duration 10 --record trace.jsonl --output report.json
+    PYTHONPATH=lib python -m test.solution_tests.IWC.load_driver replay trace.jsonl
+
+A trace line is ``{"method": "enqueue", "params": [{...}], "at": 0.0125}``,
+where ``at`` is the intended send time in seconds from the start. Calls are
+issued at their intended time however long earlier calls took, and
+latency is reported both from the actual start of each call (service time)
+and from its intended start. The latter is corrected for coordinated
+omission: when the queue stalls, every call that should have been sent
+meanwhile is charged the wait. Lines without ``at`` are sent back to back.
+Queue depth is sampled over time alongside.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import random
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from entry_point_mapping import EntryPointMapping
+from solutions.IWC.queue_solution_entrypoint import QUEUE_ENGINES, QueueSolutionEntrypoint
+
+from .workload import WorkloadConfig, WorkloadGenerator
+
+# Share of generated calls per method.
+DEFAULT_MIX = {"enqueue": 0.5, "dequeue": 0.45, "size": 0.025, "age": 0.025}
+DEFAULT_DEPTH_INTERVAL = 0.1
+
+
+@dataclass
+class TraceCall:
+    method: str
+    params: list = field(default_factory=list)
+    at: float | None = None
+
+
+def read_trace(path: Path) -> Iterator[TraceCall]:
+    with open(path) as trace:
+        for line in trace:
+            if line.strip():
+                yield TraceCall(**json.loads(line))
+
+
+def write_trace(path: Path, calls: Iterable[TraceCall]) -> Iterator[TraceCall]:
+    """Write ``calls`` to ``path`` as they are consumed, passing them through."""
+    with open(path, "w") as trace:
+        for call in calls:
+            trace.write(json.dumps(asdict(call)) + "\n")
+            yield call
+
+
+def open_loop_calls(
+    rate: float,
+    duration: float,
+    mix: dict[str, float] = DEFAULT_MIX,
+    workload: WorkloadConfig = WorkloadConfig(),
+    poisson: bool = False,
+) -> Iterator[TraceCall]:
+    """Calls arriving at ``rate`` per second for ``duration`` seconds.
+
+    Arrivals are evenly spaced, or exponentially spaced with ``poisson``.
+    """
+    rng = random.Random(workload.seed)
+    generator = WorkloadGenerator(workload)
+    methods, weights = list(mix), list(mix.values())
+    at = 0.0
+    while True:
+        at += rng.expovariate(rate) if poisson else 1 / rate
+        if at >= duration:
+            return
+        method = rng.choices(methods, weights)[0]
+        if method == "enqueue":
+            params = [asdict(generator.submission())]
+        elif method in ("dequeue_many", "enqueue_many"):
+            count = rng.randint(1, 16)
+            params = (
+                [count]
+                if method == "dequeue_many"
+                else [[asdict(item) for item in generator.submissions(count)]]
+            )
+        else:
+            params = []
+        yield TraceCall(method=method, params=params, at=at)
+
+
+class LatencyHistogram:
+    """Log-linear latency histogram in nanoseconds, within ~6% per bucket.
+
+    Values share a bucket with the others that agree in their top five
+    bits, so memory stays small however many values are recorded.
+    """
+
+    _SUB_BUCKETS = 16
+
+    def __init__(self) -> None:
+        self._counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def _index(cls, value: int) -> int:
+        if value < 2 * cls._SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - 5
+        return cls._SUB_BUCKETS * (shift + 1) + (value >> shift) - cls._SUB_BUCKETS
+
+    @classmethod
+    def _upper_bound(cls, index: int) -> int:
+        if index < 2 * cls._SUB_BUCKETS:
+            return index
+        shift = index // cls._SUB_BUCKETS - 1
+        mantissa = index % cls._SUB_BUCKETS + cls._SUB_BUCKETS
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, value: int) -> None:
+        value = max(0, value)
+        index = self._index(value)
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def summary(self) -> dict[str, object]:
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count / 1_000 if self.count else 0.0,
+            **{
+                f"p{label}_us": self.percentile(fraction) / 1_000
+                for label, fraction in (("50", 0.5), ("90", 0.9), ("99", 0.99), ("999", 0.999))
+            },
+            "max_us": self.max / 1_000,
+            "buckets": [
+                [self._upper_bound(index), self._counts[index]] for index in sorted(self._counts)
+            ],
+        }
+
+
+@dataclass
+class LoadReport:
+    calls: int
+    elapsed_seconds: float
+    service: LatencyHistogram
+    corrected: LatencyHistogram
+    by_method: dict[str, LatencyHistogram]
+    # (seconds since start, queue size)
+    depth: list[tuple[float, int]]
+
+    @property
+    def achieved_rate(self) -> float:
+        return self.calls / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def to_dict(self) -> dict[str, object]:
+        return {
+            "calls": self.calls,
+            "elapsed_seconds": self.elapsed_seconds,
+            "achieved_rate": self.achieved_rate,
+            "service": self.service.summary(),
+            "corrected": self.corrected.summary(),
+            "by_method": {method: h.summary() for method, h in self.by_method.items()},
+            "depth": self.depth,
+        }
+
+
+class LoadDriver:
+    """Issues ``TraceCall`` s against an ``EntryPointMapping`` and measures them."""
+
+    def __init__(
+        self,
+        mapping: EntryPointMapping | None = None,
+        depth_interval: float = DEFAULT_DEPTH_INTERVAL,
+        clock: Callable[[], float] = time.perf_counter,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.mapping = EntryPointMapping() if mapping is None else mapping
+        self._depth_interval = depth_interval
+        self._clock = clock
+        self._sleep = sleep
+
+    def run(self, calls: Iterable[TraceCall], speed: float = 1.0) -> LoadReport:
+        """Issue ``calls``; ``speed`` scales the pace of timed calls (2.0 is twice as fast)."""
+        clock, mapping = self._clock, self.mapping
+        service, corrected = LatencyHistogram(), LatencyHistogram()
+        by_method: dict[str, LatencyHistogram] = {}
+        depth: list[tuple[float, int]] = []
+        next_depth_sample = 0.0
+        issued = 0
+        start = end = clock()
+        for call in calls:
+            intended = None if call.at is None else start + call.at / speed
+            if intended is not None:
+                wait = intended - clock()
+                if wait > 0:
+                    self._sleep(wait)
+            began = clock()
+            getattr(mapping, call.method)(*call.params)
+            end = clock()
+            issued += 1
+            service_ns = int((end - began) * 1e9)
+            service.record(service_ns)
+            corrected.record(int((end - (began if intended is None else intended)) * 1e9))
+            histogram = by_method.get(call.method)
+            if histogram is None:
+                histogram = by_method[call.method] = LatencyHistogram()
+            histogram.record(service_ns)
+            if end - start >= next_depth_sample:
+                depth.append((end - start, mapping.size()))
+                next_depth_sample = end - start + self._depth_interval
+        return LoadReport(
+            calls=issued,
+            elapsed_seconds=end - start,
+            service=service,
+            corrected=corrected,
+            by_method=by_method,
+            depth=depth,
+        )
+
+
+def format_report(report: LoadReport) -> str:
+    lines = [
+        f"{report.calls} calls in {report.elapsed_seconds:.2f}s "
+        f"({report.achieved_rate:.0f}/s), final depth "
+        f"{report.depth[-1][1] if report.depth else 0}",
+        f"{'':<10} {'p50 us':>10} {'p99 us':>10} {'p99.9 us':>10} {'max us':>10}",
+    ]
+    rows = [("service", report.service), ("corrected", report.corrected)]
+    rows += sorted(report.by_method.items())
+    for name, histogram in rows:
+        summary = histogram.summary()
+        lines.append(
+            f"{name:<10} {summary['p50_us']:>10.1f} {summary['p99_us']:>10.1f} "
+            f"{summary['p999_us']:>10.1f} {summary['max_us']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engine", choices=sorted(QUEUE_ENGINES))
+    parser.add_argument("--depth-interval", type=float, default=DEFAULT_DEPTH_INTERVAL)
+    parser.add_argument("--output", type=Path, help="write the report as JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="open-loop traffic at a target rate")
+    generate.add_argument("--rate", type=float, required=True, help="calls per second")
+    generate.add_argument("--duration", type=float, default=10.0, help="seconds")
+    generate.add_argument("--poisson", action="store_true", help="exponential inter-arrivals")
+    generate.add_argument("--mix", type=json.loads, default=DEFAULT_MIX,
+                          help='JSON share per method, e.g. \'{"enqueue": 0.6, "dequeue": 0.4}\'')
+    generate.add_argument("--seed", type=int, default=0)
+    generate.add_argument("--users", type=int, default=WorkloadConfig().users)
+    generate.add_argument("--record", type=Path, help="also save the generated calls as a trace")
+
+    replay = commands.add_parser("replay", help="replay a JSONL trace")
+    replay.add_argument("trace", type=Path)
+    replay.add_argument("--speed", type=float, default=1.0)
+
+    args = parser.parse_args(argv)
+    mapping = EntryPointMapping()
+    if args.engine is not None:
+        mapping.queue_solution_entrypoint = QueueSolutionEntrypoint(engine=args.engine)
+    driver = LoadDriver(mapping, depth_interval=args.depth_interval)
+
+    if args.command == "generate":
+        calls = open_loop_calls(
+            args.rate,
+            args.duration,
+            mix=args.mix,
+            workload=WorkloadConfig(seed=args.seed, users=args.users),
+            poisson=args.poisson,
+        )
+        if args.record is not None:
+            calls = write_trace(args.record, calls)
+        report = driver.run(calls)
+    else:
+        report = driver.run(read_trace(args.trace), speed=args.speed)
+
+    print(format_report(report))
+    if args.output is not None:
+        args.output.write_text(json.dumps(report.to_dict(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import copy
+import json
+from datetime import datetime
+
+import pytest
+
+from solutions.IWC.dispatch_trace import DecisionTrace
+from solutions.IWC.queue_solution_entrypoint import QueueSolutionEntrypoint
+from solutions.IWC.queue_solution_heap import HeapQueue
+
+from .utils import apply, random_operations, submission
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_explained_rank_matches_dispatch_order(seed: int) -> None:
+    queue = HeapQueue()
+    for name, payload in random_operations(seed, steps=60):
+        apply(queue, name, payload)
+        queued = [(task.user_id, task.provider) for task in queue._heap]
+        ranks = {key: queue.explain(*key).rank for key in queued}
+
+        drained = copy.deepcopy(queue).dequeue_many(len(queued))
+        assert ranks == {
+            (dispatch.user_id, dispatch.provider): position
+            for position, dispatch in enumerate(drained)
+        }
+
+
+def test_explain_names_the_rule_and_pending_promotions() -> None:
+    queue = QueueSolutionEntrypoint(engine="heap")
+    queue.enqueue(submission("bank_statements", 1))
+    queue.enqueue(submission("id_verification", 2, delta_minutes=1))
+    queue.enqueue(submission("credit_check", 3, delta_minutes=2))
+    queue.enqueue(submission("id_verification", 3, delta_minutes=3))
+
+    bank = queue.explain(1, "bank_statements")
+    assert (bank.rank, bank.queue_size, bank.key.rule, bank.key.tier) == (
+        4,
+        5,
+        "window_deferred",
+        999,
+    )
+    assert bank.key.window == "bank_statements"
+
+    # User 3 reached three tasks; the next dequeue promotes them all.
+    promoted = queue.explain(3, "id_verification")
+    assert promoted.rank == 3  # behind user 2 and its own two earlier tasks
+    assert promoted.key.rule == "high_priority"
+    assert promoted.key.rule_of_3 and promoted.key.user_task_count == 3
+    assert promoted.key.group_sort == datetime(2025, 1, 1, 12, 2)
+
+    assert queue.explain(2, "id_verification").key.rule == "normal"
+    assert promoted.key.window is None
+    assert queue.explain(2, "bank_statements") is None
+
+    # Ten minutes on, the bank statement has aged out of its window.
+    queue.enqueue(submission("companies_house", 4, delta_minutes=10))
+    aged = queue.explain(1, "bank_statements")
+    assert (aged.rank, aged.key.rule, aged.key.window) == (0, "window_aged_out", "bank_statements")
+
+
+def test_trace_records_sampled_winners_and_runners_up() -> None:
+    queue = QueueSolutionEntrypoint(engine="threadsafe")
+    trace = DecisionTrace(capacity=2, sample_every=2)
+    queue.trace_decisions(trace)
+    for user_id in range(1, 7):
+        queue.enqueue(submission("id_verification", user_id, delta_minutes=user_id))
+    dispatched = queue.dequeue_many(6)
+
+    # Dequeues 2, 4 and 6 were sampled; the buffer keeps the last two.
+    assert [decision.dequeue_number for decision in trace] == [4, 6]
+    fourth, sixth = trace
+    assert (fourth.winner.user_id, fourth.runner_up.user_id) == (dispatched[3].user_id, 5)
+    assert sixth.queue_size == 1 and sixth.runner_up is None
+
+    dumped = json.loads(json.dumps(trace.dump()))
+    assert dumped[0]["winner"]["timestamp"] == "2025-01-01T12:04:00"
+    assert dumped[0]["winner"]["rule"] == "normal"
+    assert dumped[0]["winner"]["window"] is None
+
+
+def test_engines_without_indexes_cannot_explain() -> None:
+    with pytest.raises(NotImplementedError):
+        QueueSolutionEntrypoint(engine="legacy").explain(1, "id_verification")
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from .load_driver import (
+    LatencyHistogram,
+    LoadDriver,
+    TraceCall,
+    open_loop_calls,
+    read_trace,
+    write_trace,
+)
+from .utils import iso_ts
+from .workload import WorkloadConfig
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class SlowQueue:
+    """Stands in for ``EntryPointMapping``; each dequeue stalls for a set time."""
+
+    def __init__(self, clock: FakeClock, dequeue_seconds: list[float]) -> None:
+        self._clock = clock
+        self._dequeue_seconds = dequeue_seconds
+        self.depth = 0
+
+    def enqueue(self, task: dict) -> int:
+        self.depth += 1
+        return self.depth
+
+    def dequeue(self) -> None:
+        self._clock.now += self._dequeue_seconds.pop(0)
+        self.depth -= 1
+
+    def size(self) -> int:
+        return self.depth
+
+
+def test_histogram_percentiles_within_bucket_precision() -> None:
+    histogram = LatencyHistogram()
+    for value in range(1, 100_001):
+        histogram.record(value)
+
+    assert histogram.count == 100_000
+    assert histogram.percentile(1.0) == 100_000
+    for fraction in (0.5, 0.9, 0.99):
+        exact = fraction * 100_000
+        assert exact <= histogram.percentile(fraction) <= exact * 1.07
+
+
+def test_corrected_latency_charges_calls_queued_behind_a_stall() -> None:
+    clock = FakeClock()
+    queue = SlowQueue(clock, [0.010, 0.0001, 0.0001])
+    calls = [TraceCall("dequeue", at=at) for at in (0.0, 0.001, 0.002)]
+
+    report = LoadDriver(queue, clock=clock, sleep=clock.sleep).run(calls)
+
+    # Service times stay small but the second and third calls were meant to
+    # go out while the first one stalled.
+    assert report.service.percentile(0.5) <= 110_000
+    assert report.corrected.percentile(1.0) >= 9_000_000
+    assert report.corrected.percentile(0.5) >= 8_000_000
+
+
+def test_depth_is_sampled_over_time() -> None:
+    clock = FakeClock()
+    queue = SlowQueue(clock, [])
+    calls = [TraceCall("enqueue", [{}], at=0.05 * step) for step in range(10)]
+
+    report = LoadDriver(queue, depth_interval=0.1, clock=clock, sleep=clock.sleep).run(calls)
+
+    assert [depth for _, depth in report.depth] == [1, 3, 5, 7, 9]
+
+
+def test_generated_trace_round_trips_and_replays(tmp_path: Path) -> None:
+    trace = tmp_path / "trace.jsonl"
+    generated = list(
+        write_trace(trace, open_loop_calls(1_000, 0.05, workload=WorkloadConfig(users=20)))
+    )
+
+    assert 45 <= len(generated) <= 50
+    assert list(read_trace(trace)) == generated
+    report = LoadDriver().run(read_trace(trace), speed=10)
+    assert report.calls == len(generated)
+    assert set(report.by_method) <= {"enqueue", "dequeue", "size", "age"}
+
+
+def test_untimed_calls_are_sent_back_to_back() -> None:
+    task = {"provider": "id_verification", "user_id": 1, "timestamp": iso_ts()}
+    report = LoadDriver().run([TraceCall("enqueue", [task]), TraceCall("dequeue")])
+
+    assert report.calls == 2
+    assert report.corrected.max == report.service.max
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+
+import pytest
+
+from solutions.IWC.ordering_policy import (
+    DEFAULT_POLICY,
+    DeprioritisationWindow,
+    OrderingPolicy,
+    SubTiers,
+)
+from solutions.IWC.queue_solution_entrypoint import QueueSolutionEntrypoint
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.queue_solution_legacy import Priority
+from solutions.IWC.task_types import MAX_TIME_KEY, TaskDispatch, TaskSubmission, timestamp_key
+
+from .utils import iso_ts, random_operations, replay, replay_queue
+
+# Providers without dependencies, so the reference queue needs no expansion.
+PROVIDERS = ["bank_statements", "companies_house", "id_verification"]
+
+CUSTOM_POLICY = OrderingPolicy(
+    rule_of_3_threshold=2,
+    windows=(
+        DeprioritisationWindow("bank_statements", seconds=300, tier=999),
+        DeprioritisationWindow("id_verification", seconds=120, tier=500),
+    ),
+    sub_tiers=SubTiers(aged_out=3, high=0, high_in_window=1, normal=2),
+)
+
+
+@dataclass(eq=False)
+class _ReferenceTask:
+    provider: str
+    user_id: int
+    time_key: int
+    window: int
+    priority: Priority
+    group_key: int = MAX_TIME_KEY
+
+
+class ReferenceQueue:
+    """The legacy algorithm, a stable re-sort per dequeue, driven by a policy."""
+
+    def __init__(self, policy: OrderingPolicy) -> None:
+        self._compiled = policy.compile()
+        self._tasks: list[_ReferenceTask] = []
+
+    def enqueue(self, item: TaskSubmission) -> None:
+        time_key = timestamp_key(item.timestamp)
+        existing = next(
+            (t for t in self._tasks if (t.user_id, t.provider) == (item.user_id, item.provider)),
+            None,
+        )
+        if existing is not None:
+            if time_key >= existing.time_key:
+                return
+            self._tasks.remove(existing)
+        priority = Priority.HIGH if item.metadata.get("priority") == 1 else Priority.NORMAL
+        self._tasks.append(
+            _ReferenceTask(
+                item.provider, item.user_id, time_key, self._compiled.window(item.provider), priority
+            )
+        )
+
+    def dequeue(self) -> TaskDispatch | None:
+        if not self._tasks:
+            return None
+        for task in self._tasks:
+            mine = [t for t in self._tasks if t.user_id == task.user_id]
+            if task.priority == Priority.NORMAL and len(mine) >= self._compiled.rule_of_3_threshold:
+                task.priority = Priority.HIGH
+                task.group_key = min(t.time_key for t in mine)
+        newest = max(t.time_key for t in self._tasks)
+        self._tasks.sort(key=lambda t: self._compiled.sort_key(t, newest))
+        task = self._tasks.pop(0)
+        return TaskDispatch(provider=task.provider, user_id=task.user_id)
+
+
+def random_submission(rng: random.Random) -> TaskSubmission:
+    return TaskSubmission(
+        provider=rng.choice(PROVIDERS),
+        user_id=rng.randint(1, 5),
+        timestamp=iso_ts(delta_minutes=rng.randint(0, 15)),
+        metadata={"priority": 1} if rng.random() < 0.1 else {},
+    )
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_custom_policy_matches_reference_sort(seed: int) -> None:
+    rng = random.Random(seed)
+    queue, reference = HeapQueue(policy=CUSTOM_POLICY), ReferenceQueue(CUSTOM_POLICY)
+    for _ in range(150):
+        if rng.random() < 0.55:
+            item = random_submission(rng)
+            queue.enqueue(item)
+            reference.enqueue(TaskSubmission(**{**vars(item), "metadata": dict(item.metadata)}))
+        else:
+            ordered = list(queue.iter_ordered())
+            expected = reference.dequeue()
+            assert queue.dequeue() == expected
+            assert ordered[:1] == ([expected] if expected else [])
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_explicit_default_policy_keeps_legacy_order(seed: int) -> None:
+    operations = random_operations(seed)
+
+    assert replay_queue(HeapQueue(policy=OrderingPolicy()), operations) == replay(
+        "legacy", operations
+    )
+
+
+def test_threshold_and_windows_are_configurable() -> None:
+    queue = HeapQueue(policy=CUSTOM_POLICY)
+    queue.enqueue(TaskSubmission(provider="bank_statements", user_id=1, timestamp=iso_ts()))
+    queue.enqueue(
+        TaskSubmission(provider="id_verification", user_id=2, timestamp=iso_ts(delta_minutes=1))
+    )
+    queue.enqueue(
+        TaskSubmission(provider="companies_house", user_id=3, timestamp=iso_ts(delta_minutes=2))
+    )
+
+    # id_verification waits in tier 500, ahead of bank statements in 999.
+    assert queue.top_k(3) == [
+        TaskDispatch(provider="companies_house", user_id=3),
+        TaskDispatch(provider="id_verification", user_id=2),
+        TaskDispatch(provider="bank_statements", user_id=1),
+    ]
+    # Two tasks are enough for the rule of 3 under this policy.
+    queue.enqueue(
+        TaskSubmission(provider="companies_house", user_id=2, timestamp=iso_ts(delta_minutes=3))
+    )
+    assert queue.peek() == TaskDispatch(provider="id_verification", user_id=2)
+    explanation = queue.explain(2, "id_verification")
+    assert (explanation.key.rule, explanation.key.window) == (
+        "high_priority_in_window",
+        "id_verification",
+    )
+    assert queue.explain(1, "bank_statements").key.rule == "window_deferred"
+
+
+@pytest.mark.parametrize(
+    "policy",
+    [
+        OrderingPolicy(rule_of_3_threshold=0),
+        OrderingPolicy(windows=(DeprioritisationWindow("bank_statements", tier=0),)),
+        OrderingPolicy(
+            windows=(
+                DeprioritisationWindow("bank_statements"),
+                DeprioritisationWindow("bank_statements", seconds=60),
+            )
+        ),
+        OrderingPolicy(sub_tiers=SubTiers(aged_out=1, high=1)),
+    ],
+)
+def test_invalid_policies_are_rejected(policy: OrderingPolicy) -> None:
+    with pytest.raises(ValueError):
+        policy.compile()
+
+
+def test_legacy_engine_rejects_a_policy() -> None:
+    with pytest.raises(ValueError):
+        QueueSolutionEntrypoint(engine="legacy", policy=DEFAULT_POLICY)
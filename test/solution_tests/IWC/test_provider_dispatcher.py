@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from dataclasses import replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+import pytest
+
+from solutions.IWC.provider_dispatcher import ConnectionPool, Dispatcher, DispatchResult
+from solutions.IWC.provider_registry import ProviderRegistry
+from solutions.IWC.queue_solution_async import AsyncQueue
+from solutions.IWC.queue_solution_dependencies import ThreadSafeDependencyQueue
+from solutions.IWC.queue_solution_legacy import REGISTERED_PROVIDERS
+from solutions.IWC.queue_solution_rate_limited import ThreadSafeRateLimitedQueue
+
+from .utils import submission
+
+
+class StubProviders(ThreadingHTTPServer):
+    """Local stand-in for the provider services, one path per provider."""
+
+    daemon_threads = True
+    request_queue_size = 64  # every worker connects at once
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.lock = threading.Lock()
+        self.delay = 0.0
+        self.failures: Counter[str] = Counter()  # path -> 503s still to send
+        self.malformed: set[str] = set()  # paths answering with a broken chunked body
+        self.connections = 0
+        self.active: Counter[str] = Counter()
+        self.peak: Counter[str] = Counter()
+        self.log: list[tuple[str, str, dict]] = []  # (event, path, payload)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def registry(self, **limits: dict) -> ProviderRegistry:
+        return ProviderRegistry(
+            replace(
+                provider, base_url=f"{self.url}/{provider.name}", **limits.get(provider.name, {})
+            )
+            for provider in REGISTERED_PROVIDERS
+        )
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+    server: StubProviders
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self) -> None:
+        stub, path = self.server, self.path
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with stub.lock:
+            stub.log.append(("start", path, payload))
+            stub.active[path] += 1
+            stub.peak[path] = max(stub.peak[path], stub.active[path])
+            failing = stub.failures[path] > 0
+            stub.failures[path] -= failing
+        time.sleep(stub.delay)
+        with stub.lock:
+            stub.active[path] -= 1
+            stub.log.append(("done", path, payload))
+        if path in stub.malformed:
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.write(b"zz\r\n{}\r\n0\r\n\r\n")
+            return
+        body = b"{}"
+        self.send_response(503 if failing else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def stub() -> Iterator[StubProviders]:
+    server = StubProviders()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run_dispatcher(queue: AsyncQueue, submissions, **options) -> tuple[Dispatcher, float]:
+    async def scenario() -> tuple[Dispatcher, float]:
+        async with Dispatcher(queue, **options) as dispatcher:
+            start = time.perf_counter()
+            queue.enqueue_many(submissions)
+            await asyncio.wait_for(dispatcher.drain(), 10)
+            return dispatcher, time.perf_counter() - start
+
+    return asyncio.run(scenario())
+
+
+def test_dependants_are_sent_after_their_dependency_succeeds(stub: StubProviders) -> None:
+    stub.delay = 0.01
+    registry = stub.registry()
+    queue = AsyncQueue(ThreadSafeDependencyQueue(registry=registry))
+    submissions = [submission("credit_check", user_id) for user_id in range(8)]
+    submissions += [submission("id_verification", user_id) for user_id in range(8)]
+
+    dispatcher, _ = run_dispatcher(queue, submissions, registry=registry, workers=4)
+
+    assert (dispatcher.completed, dispatcher.failed, queue.size) == (24, 0, 0)
+    for user_id in range(8):
+        events = [(event, path) for event, path, task in stub.log if task["user_id"] == user_id]
+        assert events.index(("done", "/companies_house/")) < events.index(
+            ("start", "/credit_check/")
+        )
+    # Keep-alive: one connection per concurrent request, reused across tasks.
+    assert stub.connections <= 4 * 3
+
+
+def test_failures_are_retried_then_reported(stub: StubProviders) -> None:
+    registry = stub.registry()
+    stub.failures["/id_verification/"] = 2
+    stub.failures["/bank_statements/"] = 10
+    results: list[DispatchResult] = []
+    queue = AsyncQueue(ThreadSafeDependencyQueue(registry=registry))
+
+    dispatcher, _ = run_dispatcher(
+        queue,
+        [submission("id_verification", 1), submission("bank_statements", 2)],
+        registry=registry,
+        retries=2,
+        backoff=0.001,
+        on_result=results.append,
+    )
+
+    by_provider = {result.dispatch.provider: result for result in results}
+    assert by_provider["id_verification"].ok and by_provider["id_verification"].attempts == 3
+    assert by_provider["bank_statements"].status == 503
+    assert (dispatcher.completed, dispatcher.failed, queue.size) == (1, 1, 0)
+
+
+def test_malformed_response_fails_the_task_and_keeps_the_worker(stub: StubProviders) -> None:
+    registry = stub.registry()
+    stub.malformed.add("/companies_house/")
+    results: list[DispatchResult] = []
+
+    def on_result(result: DispatchResult) -> None:
+        results.append(result)
+        raise RuntimeError("callback bug")
+
+    queue = AsyncQueue(ThreadSafeDependencyQueue(registry=registry))
+    dispatcher, _ = run_dispatcher(
+        queue,
+        [submission("credit_check", 1), submission("id_verification", 2)],
+        registry=registry,
+        workers=1,
+        on_result=on_result,
+    )
+
+    # The nacked dependency releases credit_check; the one worker survives it all.
+    assert (dispatcher.completed, dispatcher.failed, queue.size) == (2, 1, 0)
+    [broken] = [result for result in results if not result.ok]
+    assert broken.dispatch.provider == "companies_house" and "ValueError" in broken.error
+
+
+def test_timeouts_are_reported_without_a_status(stub: StubProviders) -> None:
+    stub.delay = 0.2
+    registry = stub.registry()
+    results: list[DispatchResult] = []
+
+    run_dispatcher(
+        AsyncQueue(ThreadSafeDependencyQueue(registry=registry)),
+        [submission("id_verification", 1)],
+        registry=registry,
+        timeout=0.05,
+        retries=1,
+        backoff=0.001,
+        on_result=results.append,
+    )
+
+    [result] = results
+    assert result.status is None and result.attempts == 2 and "Timeout" in result.error
+
+
+def test_throughput_scales_with_workers_up_to_the_provider_limit(stub: StubProviders) -> None:
+    stub.delay = 0.02
+    registry = stub.registry(companies_house={"max_in_flight": 2})
+
+    def elapsed(workers: int, provider: str) -> float:
+        queue = AsyncQueue(ThreadSafeRateLimitedQueue(registry=registry))
+        submissions = [submission(provider, user_id) for user_id in range(24)]
+        dispatcher, seconds = run_dispatcher(
+            queue, submissions, registry=registry, workers=workers
+        )
+        assert dispatcher.completed == 24
+        return seconds
+
+    serial, parallel = elapsed(1, "id_verification"), elapsed(8, "id_verification")
+    assert parallel < serial / 3
+
+    limited = elapsed(8, "companies_house")
+    assert stub.peak["/companies_house/"] == 2
+    assert limited > parallel * 2
+
+
+def test_pool_replaces_a_connection_closed_while_idle(stub: StubProviders) -> None:
+    async def scenario() -> tuple[list[int], int]:
+        pool = ConnectionPool(f"{stub.url}/companies_house", max_connections=1)
+        first = await pool.request("POST", "/", b'{"user_id": 1}')
+        pool._idle[0].writer.transport.abort()
+        second = await pool.request("POST", "/", b'{"user_id": 2}')
+        pool.close()
+        return [first.status, second.status], pool.opened
+
+    assert asyncio.run(scenario()) == ([200, 200], 2)
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import pytest
+
+from solutions.IWC.provider_registry import PROVIDER_REGISTRY, ProviderRegistry
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.queue_solution_legacy import Provider, REGISTERED_PROVIDERS
+from solutions.IWC.task_types import TaskDispatch, TaskSubmission
+
+from .utils import iso_ts
+
+
+def provider(name: str, *depends_on: str) -> Provider:
+    return Provider(name=name, base_url=f"https://fake.{name}.test", depends_on=list(depends_on))
+
+
+def test_default_registry_closures() -> None:
+    assert PROVIDER_REGISTRY.dependency_closure("credit_check") == ("companies_house",)
+    assert PROVIDER_REGISTRY.dependency_closure("bank_statements") == ()
+    assert PROVIDER_REGISTRY.dependency_closure("unknown") == ()
+
+
+def test_closure_is_depth_first_without_duplicates() -> None:
+    registry = ProviderRegistry([
+        provider("root"),
+        provider("left", "root"),
+        provider("right", "root"),
+        provider("report", "left", "right"),
+    ])
+
+    assert registry.dependency_closure("report") == ("root", "left", "right")
+
+
+def test_cycles_are_rejected() -> None:
+    with pytest.raises(ValueError, match="a -> b -> a"):
+        ProviderRegistry([provider("a", "b"), provider("b", "a")])
+
+    registry = ProviderRegistry([provider("a"), provider("b", "a")])
+    with pytest.raises(ValueError):
+        registry.register(provider("a", "b"))
+    assert registry.get("a").depends_on == []
+
+
+def test_register_invalidates_affected_closures() -> None:
+    registry = ProviderRegistry([provider("a"), provider("b", "a"), provider("c")])
+    assert registry.dependency_closure("b") == ("a",)
+    assert registry.dependency_closure("c") == ()
+
+    registry.register(provider("a", "c"))
+
+    assert registry.dependency_closure("b") == ("c", "a")
+    assert registry.dependency_closure("c") == ()
+
+
+def test_heap_queue_uses_runtime_registered_providers() -> None:
+    registry = ProviderRegistry(REGISTERED_PROVIDERS)
+    registry.register(provider("affordability", "credit_check", "bank_statements"))
+    queue = HeapQueue(registry=registry)
+
+    assert queue.enqueue(TaskSubmission("affordability", 1, iso_ts())) == 4
+    assert [queue.dequeue() for _ in range(4)] == [
+        TaskDispatch("companies_house", 1),
+        TaskDispatch("credit_check", 1),
+        TaskDispatch("affordability", 1),
+        TaskDispatch("bank_statements", 1),
+    ]
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+
+from solutions.IWC.queue_solution_async import AsyncQueue
+from solutions.IWC.task_types import TaskDispatch
+
+from .utils import submission
+
+
+def test_dequeue_wakes_on_enqueue() -> None:
+    async def scenario() -> TaskDispatch | None:
+        queue = AsyncQueue()
+        waiting = asyncio.create_task(queue.dequeue())
+        await asyncio.sleep(0)
+        queue.enqueue(submission("id_verification", 1))
+        return await asyncio.wait_for(waiting, 1)
+
+    assert asyncio.run(scenario()) == TaskDispatch("id_verification", 1)
+
+
+def test_dequeue_times_out_with_none() -> None:
+    async def scenario() -> tuple[TaskDispatch | None, int]:
+        queue = AsyncQueue()
+        result = await queue.dequeue(timeout=0.01)
+        return result, len(queue._waiters)
+
+    assert asyncio.run(scenario()) == (None, 0)
+
+
+def test_cancelled_waiter_does_not_swallow_task() -> None:
+    async def scenario() -> TaskDispatch | None:
+        queue = AsyncQueue()
+        cancelled = asyncio.create_task(queue.dequeue())
+        survivor = asyncio.create_task(queue.dequeue())
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        queue.enqueue(submission("companies_house", 2))
+        return await asyncio.wait_for(survivor, 1)
+
+    assert asyncio.run(scenario()) == TaskDispatch("companies_house", 2)
+
+
+def test_enqueue_from_another_thread() -> None:
+    async def scenario() -> TaskDispatch:
+        queue = AsyncQueue()
+        waiting = asyncio.create_task(queue.dequeue())
+        await asyncio.sleep(0)
+        producer = threading.Thread(target=queue.enqueue, args=(submission("bank_statements", 3),))
+        producer.start()
+        result = await asyncio.wait_for(waiting, 1)
+        producer.join()
+        return result
+
+    assert asyncio.run(scenario()) == TaskDispatch("bank_statements", 3)
+
+
+def test_async_iteration_yields_dispatch_order() -> None:
+    async def scenario() -> list[TaskDispatch]:
+        queue = AsyncQueue()
+        queue.enqueue(submission("credit_check", 1))
+        dispatched = []
+        async for task in queue:
+            dispatched.append(task)
+            if len(dispatched) == 2:
+                break
+        return dispatched
+
+    assert asyncio.run(scenario()) == [
+        TaskDispatch("companies_house", 1),
+        TaskDispatch("credit_check", 1),
+    ]
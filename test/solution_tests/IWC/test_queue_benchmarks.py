@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from collections import Counter
+
+from .bench_queue import (
+    find_regressions,
+    run_benchmarks,
+    run_contention,
+    run_durability,
+    run_memory,
+)
+from .workload import WorkloadConfig, WorkloadGenerator
+
+
+def test_workload_is_reproducible_from_its_seed() -> None:
+    config = WorkloadConfig(seed=3, users=50)
+
+    assert WorkloadGenerator(config).submissions(100) == WorkloadGenerator(config).submissions(100)
+    assert WorkloadGenerator(config).submissions(100) != WorkloadGenerator(
+        WorkloadConfig(seed=4, users=50)
+    ).submissions(100)
+
+
+def test_only_rule_of_3_users_spread_over_providers() -> None:
+    config = WorkloadConfig(users=200, rule_of_3_user_fraction=0.0)
+    providers_per_user: dict[int, set[str]] = {}
+    for item in WorkloadGenerator(config).submissions(2_000):
+        providers_per_user.setdefault(item.user_id, set()).add(item.provider)
+
+    assert {len(providers) for providers in providers_per_user.values()} == {1}
+
+
+def test_bank_statement_share() -> None:
+    config = WorkloadConfig(users=5_000, bank_statement_share=0.5, rule_of_3_user_fraction=0.0)
+    counts = Counter(item.provider for item in WorkloadGenerator(config).submissions(5_000))
+
+    assert 0.4 < counts["bank_statements"] / 5_000 < 0.6
+
+
+def test_benchmark_smoke_run_compares_against_legacy() -> None:
+    results = run_benchmarks(["legacy", "heap"], [10], WorkloadConfig(users=20), samples=5)
+
+    assert {(result.engine, result.operation) for result in results} == {
+        (engine, operation)
+        for engine in ("legacy", "heap")
+        for operation in ("enqueue", "size", "age", "dequeue", "purge")
+    }
+    assert all(result.speedup_vs_legacy is not None for result in results)
+
+
+def test_heap_engine_uses_no_more_memory_than_legacy() -> None:
+    legacy, heap = run_memory(["legacy", "heap"], [1_000], WorkloadConfig())
+
+    assert (legacy.engine, heap.engine) == ("legacy", "heap")
+    assert heap.bytes_per_task <= legacy.bytes_per_task
+    assert heap.ratio_vs_legacy is not None and heap.ratio_vs_legacy <= 1.0
+
+
+def test_compact_engine_needs_a_third_of_the_legacy_memory() -> None:
+    legacy, compact, deep = run_memory(["legacy", "compact"], [1_000, 10_000], WorkloadConfig())
+
+    assert (legacy.engine, compact.engine, deep.depth) == ("legacy", "compact", 10_000)
+    assert compact.ratio_vs_legacy is not None and compact.ratio_vs_legacy <= 1 / 3
+    # Legacy is too slow to fill that deep; the per-task cost barely grows.
+    assert deep.bytes_per_task <= 0.35 * legacy.bytes_per_task
+
+
+def test_durability_smoke_run_reports_overhead_and_recovery() -> None:
+    (result,) = run_durability([50], WorkloadConfig(users=100), samples=200)
+
+    assert result.depth == 50
+    assert result.heap_round_us > 0 and result.durable_round_us > 0
+    assert result.replay_seconds > 0 and result.restore_seconds > 0
+
+
+def test_sixteen_threads_keep_most_of_single_thread_throughput() -> None:
+    # Few users, so the threads keep deduplicating and promoting each other's tasks.
+    single, sixteen = run_contention([1, 16], WorkloadConfig(users=2_000), rounds=4_000)
+
+    assert (single.threads, sixteen.threads) == (1, 16)
+    assert single.rounds == sixteen.rounds == 4_000
+    # One lock cannot scale under the GIL, but hand-offs must not convoy.
+    assert sixteen.scaling_vs_one_thread is not None and sixteen.scaling_vs_one_thread >= 0.5
+
+
+def test_find_regressions_flags_slower_medians_only() -> None:
+    previous = [
+        {"engine": "heap", "depth": 10, "operation": "enqueue", "p50_us": 10.0},
+        {"engine": "heap", "depth": 10, "operation": "dequeue", "p50_us": 10.0},
+    ]
+    current = [
+        {"engine": "heap", "depth": 10, "operation": "enqueue", "p50_us": 11.0},
+        {"engine": "heap", "depth": 10, "operation": "dequeue", "p50_us": 13.0},
+        {"engine": "heap", "depth": 100, "operation": "dequeue", "p50_us": 99.0},
+    ]
+
+    (regression,) = find_regressions(current, previous, threshold=0.2)
+    assert regression.startswith("heap dequeue at depth 10:")
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import random
+from pathlib import Path
+
+import pytest
+
+from solutions.IWC.queue_metrics import MetricsRegistry
+from solutions.IWC.queue_solution_bounded import Backpressure, BoundedQueue
+from solutions.IWC.queue_solution_entrypoint import QueueSolutionEntrypoint
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.queue_solution_legacy import Queue
+
+from .utils import PROVIDERS, operations_with_cancels, replay_queue, replay_with_cancels, submission
+
+
+def assert_split(queue: BoundedQueue) -> None:
+    """Every task is in memory or on disk, never both, and the user counts agree."""
+    in_memory = {(task.user_id, task.provider) for task in queue._heap}
+    on_disk = [(task.user_id, task.provider) for _, task in queue._spill.iter_sorted()]
+    assert in_memory.isdisjoint(on_disk) and len(set(on_disk)) == len(on_disk)
+    assert queue.spilled == len(on_disk)
+    counts: dict[int, int] = {}
+    for user_id, _ in on_disk:
+        counts[user_id] = counts.get(user_id, 0) + 1
+    assert queue._spilled_users == counts
+
+
+@pytest.mark.parametrize("memory_limit", [1, 3, 8])
+@pytest.mark.parametrize("seed", range(60))
+def test_spilling_keeps_legacy_order(seed: int, memory_limit: int, tmp_path: Path) -> None:
+    operations = operations_with_cancels(seed, steps=150)
+    expected = replay_with_cancels(Queue(), operations)
+
+    queue = BoundedQueue(memory_limit=memory_limit, spill_path=tmp_path / "spill.sqlite3")
+    assert replay_with_cancels(queue, operations) == expected
+    assert_split(queue)
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_views_see_spilled_tasks(seed: int) -> None:
+    rng = random.Random(seed)
+    bounded, heap = BoundedQueue(memory_limit=2), HeapQueue()
+    spilled = 0
+
+    for operation in operations_with_cancels(seed, steps=120):
+        if operation[0] == "cancel":
+            assert bounded.cancel(*operation[1]) == heap.cancel(*operation[1])
+        else:
+            assert replay_queue(bounded, [operation]) == replay_queue(heap, [operation])
+        spilled = max(spilled, bounded.spilled)
+        assert list(bounded.iter_ordered()) == list(heap.iter_ordered())
+        user_id, provider = rng.randint(1, 4), rng.choice(PROVIDERS)
+        assert bounded.explain(user_id, provider) == heap.explain(user_id, provider)
+        assert_split(bounded)
+    assert spilled
+
+
+def test_backpressure_and_paging_during_an_outage() -> None:
+    queue = BoundedQueue(memory_limit=10, high_watermark=0.5)
+    results = [
+        queue.enqueue(submission("bank_statements", user_id, delta_minutes=user_id % 3))
+        for user_id in range(1, 41)
+    ]
+
+    assert [result.backpressure for result in results[3:6]] == [
+        Backpressure.NONE,
+        Backpressure.HIGH,
+        Backpressure.HIGH,
+    ]
+    assert results[-1] == 40 and results[-1].backpressure == Backpressure.CRITICAL
+    assert len(queue._heap) <= 10 and queue.spilled >= 30
+    assert queue.age == 120
+    path = Path(queue._spill.file)
+
+    expected = Queue()
+    for user_id in range(1, 41):
+        expected.enqueue(submission("bank_statements", user_id, delta_minutes=user_id % 3))
+    assert queue.top_k(40) == expected.dequeue_many(40) == queue.dequeue_many(40)
+    assert queue.backpressure() == Backpressure.NONE
+
+    queue.enqueue(submission("id_verification", 1))
+    queue.close()
+    assert queue.size == 0 and not path.exists()
+
+
+def test_tasks_that_could_change_key_stay_in_memory() -> None:
+    queue, expected = BoundedQueue(memory_limit=2), Queue()
+    for provider in ("bank_statements", "id_verification", "credit_check"):
+        queue.enqueue(submission(provider, 1))
+        expected.enqueue(submission(provider, 1))
+
+    # User 1 is due a rule-of-3 promotion, so nothing can leave memory yet.
+    assert queue.spilled == 0 and queue.backpressure() == Backpressure.CRITICAL
+    assert queue.dequeue_many(4) == expected.dequeue_many(4)
+
+
+def test_entrypoint_engine_reports_backpressure() -> None:
+    registry = MetricsRegistry()
+    queue = QueueSolutionEntrypoint(engine="bounded", metrics=registry)
+    assert queue.enqueue(submission("credit_check", 1)) == 2
+    assert queue.backpressure() == Backpressure.NONE
+
+    with pytest.raises(NotImplementedError):
+        QueueSolutionEntrypoint(engine="heap").backpressure()
+
+
+def test_spill_is_instrumented() -> None:
+    registry = MetricsRegistry()
+    queue = BoundedQueue(memory_limit=4)
+    queue.instrument(registry)
+    for user_id in range(1, 11):
+        queue.enqueue(submission("companies_house", user_id, delta_minutes=user_id))
+    queue.dequeue_many(10)
+
+    assert registry.value("iwc_queue_spilled_total") == registry.value(
+        "iwc_queue_restored_total"
+    ) > 0
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_state_covers_spilled_tasks(seed: int) -> None:
+    operations = operations_with_cancels(seed, steps=120)
+    bounded, heap = BoundedQueue(memory_limit=3), HeapQueue()
+    replay_with_cancels(bounded, operations)
+    replay_with_cancels(heap, operations)
+
+    state = bounded.export_state()
+    assert sorted(state.tasks, key=repr) == sorted(heap.export_state().tasks, key=repr)
+    restored, plain = BoundedQueue(memory_limit=3), HeapQueue()
+    restored.load_state(state)
+    plain.load_state(state)
+    assert restored.size == heap.size
+    assert_split(restored)
+    assert restored.dequeue_many(heap.size) == plain.dequeue_many(heap.size) == heap.dequeue_many(
+        heap.size
+    )
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from entry_point_mapping import EntryPointMapping
+from solutions.IWC.queue_metrics import MetricsRegistry
+from solutions.IWC.queue_solution_dependencies import DependencyAwareQueue
+from solutions.IWC.queue_solution_durable import DurableQueue
+from solutions.IWC.queue_solution_entrypoint import QueueSolutionEntrypoint
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.queue_solution_legacy import Queue
+from solutions.IWC.queue_solution_sharded import ShardedQueue
+from solutions.IWC.queue_solution_threaded import ThreadSafeQueue
+from solutions.IWC.task_types import TaskDispatch
+
+from .utils import assert_consistent, operations_with_cancels, replay_with_cancels, submission
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_cancel_keeps_legacy_order(seed: int) -> None:
+    operations = operations_with_cancels(seed)
+    expected = replay_with_cancels(Queue(), operations)
+
+    heap = HeapQueue()
+    assert replay_with_cancels(heap, operations) == expected
+    assert_consistent(heap)
+    assert replay_with_cancels(ThreadSafeQueue(), operations) == expected
+    assert replay_with_cancels(ShardedQueue(shards=3, processes=False), operations) == expected
+
+
+def test_cancel_updates_rule_of_3_and_age() -> None:
+    queue = HeapQueue()
+    queue.enqueue(submission("credit_check", 1))
+    queue.enqueue(submission("id_verification", 1, delta_minutes=1))
+    queue.enqueue(submission("id_verification", 2, delta_minutes=10))
+    assert queue.age == 600
+
+    # Back to two tasks before any dequeue: user 1 is never promoted.
+    assert queue.cancel(2) == 1 and queue.age == 60
+    assert queue.cancel(1, "credit_check") == 1
+    assert queue.cancel(1, "credit_check") == 0 and queue.cancel(7) == 0
+    queue.enqueue(submission("id_verification", 3))
+    assert queue.explain(1, "companies_house").key.rule == "normal"
+    assert queue.dequeue_many(3) == [
+        TaskDispatch(provider="companies_house", user_id=1),
+        TaskDispatch(provider="id_verification", user_id=3),
+        TaskDispatch(provider="id_verification", user_id=1),
+    ]
+
+
+def test_cancel_is_logged(tmp_path: Path) -> None:
+    queue = DurableQueue(tmp_path, fsync_interval=None, snapshot_every=None)
+    queue.enqueue(submission("credit_check", 1))
+    queue.enqueue(submission("id_verification", 1))
+    queue.enqueue(submission("id_verification", 2))
+    assert queue.cancel(1, "credit_check") == 1
+    assert queue.cancel(2) == 1
+    assert queue.cancel(2) == 0
+
+    recovered = DurableQueue(tmp_path, fsync_interval=None, snapshot_every=None)
+    assert recovered.dequeue_many(3) == [
+        TaskDispatch(provider="companies_house", user_id=1),
+        TaskDispatch(provider="id_verification", user_id=1),
+    ]
+
+
+def test_cancelling_a_dependency_releases_its_dependant() -> None:
+    queue = DependencyAwareQueue()
+    queue.enqueue(submission("credit_check", 1))
+    assert queue.top_k(2) == [TaskDispatch(provider="companies_house", user_id=1)]
+
+    assert queue.cancel(1, "companies_house") == 1
+    assert queue.dequeue() == TaskDispatch(provider="credit_check", user_id=1)
+
+
+def test_entry_point_mapping_cancel() -> None:
+    mapping = EntryPointMapping()
+    mapping.enqueue({"provider": "credit_check", "user_id": 1, "timestamp": "2025-01-01 12:00"})
+    mapping.enqueue({"provider": "bank_statements", "user_id": 2, "timestamp": "2025-01-01 12:00"})
+
+    assert mapping.cancel(1) == 2
+    assert mapping.size() == 1
+
+
+def test_cancel_is_counted() -> None:
+    registry = MetricsRegistry()
+    queue = QueueSolutionEntrypoint(engine="heap", metrics=registry)
+    queue.enqueue(submission("credit_check", 1))
+    queue.cancel(1)
+
+    assert registry.value("iwc_queue_cancelled_total") == 2
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from solutions.IWC.ordering_policy import DeprioritisationWindow, OrderingPolicy, SubTiers
+from solutions.IWC.queue_solution_compact import CompactQueue
+from solutions.IWC.queue_solution_entrypoint import QueueSolutionEntrypoint
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.queue_solution_legacy import Queue
+from solutions.IWC.task_types import TaskDispatch
+
+from .utils import (
+    PROVIDERS,
+    operations_with_cancels,
+    random_operations,
+    replay,
+    replay_queue,
+    replay_with_cancels,
+    submission,
+)
+
+# Two windows sharing a tier, a negative main tier and sub-tiers out of their
+# default order: ranks must still compare like the values they stand for.
+SKEWED_POLICY = OrderingPolicy(
+    rule_of_3_threshold=2,
+    windows=(
+        DeprioritisationWindow("bank_statements", seconds=120, tier=50),
+        DeprioritisationWindow("id_verification", seconds=300, tier=50),
+        DeprioritisationWindow("companies_house", seconds=60, tier=7),
+    ),
+    main_tier=-3,
+    sub_tiers=SubTiers(aged_out=9, high=-2, high_in_window=4, normal=0),
+)
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_compact_engine_matches_legacy(seed: int) -> None:
+    operations = random_operations(seed, steps=120)
+    assert replay("compact", operations) == replay("legacy", operations)
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_cancel_keeps_legacy_order(seed: int) -> None:
+    operations = operations_with_cancels(seed)
+    assert replay_with_cancels(CompactQueue(), operations) == replay_with_cancels(
+        Queue(), operations
+    )
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_custom_policy_matches_heap_engine(seed: int) -> None:
+    operations = operations_with_cancels(seed, steps=150)
+    assert replay_with_cancels(
+        CompactQueue(policy=SKEWED_POLICY), operations
+    ) == replay_with_cancels(HeapQueue(policy=SKEWED_POLICY), operations)
+
+
+def test_deep_queue_matches_heap_engine() -> None:
+    # Enough users to resize the user index several times, batches large
+    # enough to heapify, and slots reused after every drain.
+    rng = random.Random(7)
+    operations: list[tuple[str, object]] = []
+    for _ in range(6):
+        batch = [
+            {
+                "provider": rng.choice(PROVIDERS),
+                "user_id": rng.choice([rng.randint(1, 400), rng.randint(-(2**40), 2**40)]),
+                "timestamp": f"2025-10-20 12:{rng.randint(0, 59):02d}:00",
+                "metadata": {"priority": 1} if rng.random() < 0.05 else {},
+            }
+            for _ in range(rng.randint(200, 600))
+        ]
+        operations += [
+            ("enqueue_many", batch),
+            ("dequeue_many", rng.randint(50, 400)),
+            ("age", None),
+        ]
+        operations += [("cancel", (rng.randint(1, 400), None)) for _ in range(20)]
+    operations.append(("dequeue_many", 5_000))
+
+    compact, heap = CompactQueue(), HeapQueue()
+    assert replay_with_cancels(compact, operations) == replay_with_cancels(heap, operations)
+    assert compact.size == heap.size == 0
+
+
+def test_purge_releases_the_columns() -> None:
+    queue = CompactQueue()
+    queue.enqueue_many(submission("companies_house", user_id) for user_id in range(1, 200))
+    assert queue.purge()
+    assert (queue.size, queue.age, queue.dequeue()) == (0, 0, None)
+    assert all(len(column) == 0 for column in queue._columns)
+
+    queue.enqueue(submission("bank_statements", 5))
+    assert replay_queue(queue, [("size", None), ("dequeue", None)]) == [
+        1,
+        TaskDispatch(provider="bank_statements", user_id=5),
+    ]
+
+
+def test_entrypoint_engine_takes_a_policy() -> None:
+    queue = QueueSolutionEntrypoint(engine="compact", policy=SKEWED_POLICY)
+    queue.enqueue(submission("companies_house", 1))
+    queue.enqueue(submission("credit_check", 2, delta_minutes=1))
+
+    # User 2's pair meets the threshold of 2; its in-window task goes second.
+    assert queue.dequeue_many(3) == [
+        TaskDispatch(provider="credit_check", user_id=2),
+        TaskDispatch(provider="companies_house", user_id=2),
+        TaskDispatch(provider="companies_house", user_id=1),
+    ]
+    with pytest.raises(NotImplementedError):
+        queue.peek()
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import random
+import threading
+from datetime import datetime
+
+import pytest
+
+from solutions.IWC.queue_solution_dependencies import DependencyAwareQueue
+from solutions.IWC.queue_solution_entrypoint import QueueSolutionEntrypoint
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.task_types import TaskDispatch, TaskSubmission
+
+from .utils import apply, assert_ready_index, iso_ts, random_operations, replay_queue, submission
+
+
+class AckingQueue(DependencyAwareQueue):
+    """Completes every task as soon as it is dispatched."""
+
+    def _dispatch(self, task):
+        dispatch = super()._dispatch(task)
+        self.ack(task.user_id, task.provider)
+        return dispatch
+
+
+def without_dependants(operations: list[tuple[str, object]]) -> list[tuple[str, object]]:
+    def keep(task: dict) -> bool:
+        return task["provider"] != "credit_check"
+
+    filtered = []
+    for name, payload in operations:
+        if name == "enqueue" and not keep(payload):
+            continue
+        if name == "enqueue_many":
+            payload = [task for task in payload if keep(task)]
+        filtered.append((name, payload))
+    return filtered
+
+
+def test_dependant_waits_for_ack() -> None:
+    queue = QueueSolutionEntrypoint(engine="dependencies")
+    queue.enqueue(submission("credit_check", 1))
+    queue.enqueue(submission("id_verification", 2, delta_minutes=1))
+
+    assert queue.dequeue_many(3) == [
+        TaskDispatch(provider="companies_house", user_id=1),
+        TaskDispatch(provider="id_verification", user_id=2),
+    ]
+    assert queue.size() == 1 and queue.dequeue() is None
+
+    assert queue.ack(1, "companies_house")
+    assert not queue.ack(1, "companies_house")
+    assert queue.dequeue() == TaskDispatch(provider="credit_check", user_id=1)
+
+
+def test_nack_requeues_or_releases() -> None:
+    queue = DependencyAwareQueue()
+    queue.enqueue(submission("credit_check", 1))
+    assert queue.dequeue() == TaskDispatch(provider="companies_house", user_id=1)
+
+    assert queue.nack(1, "companies_house")
+    assert queue.size == 2 and queue.in_flight == 0
+    assert queue.top_k(2) == [TaskDispatch(provider="companies_house", user_id=1)]
+    assert queue.dequeue() == TaskDispatch(provider="companies_house", user_id=1)
+
+    # A later resubmission does not displace the earlier, failed attempt.
+    queue.enqueue(submission("companies_house", 1, delta_minutes=5))
+    assert queue.nack(1, "companies_house")
+    assert queue.explain(1, "companies_house").key.timestamp == datetime(2025, 1, 1, 12, 0)
+    queue.dequeue()
+
+    assert queue.nack(1, "companies_house", requeue=False)
+    assert queue.dequeue() == TaskDispatch(provider="credit_check", user_id=1)
+    assert queue.nack(1, "credit_check", requeue=False)
+    assert queue.size == 0 and not queue.nack(1, "credit_check")
+
+
+def test_same_provider_is_not_dispatched_twice_at_once() -> None:
+    queue = DependencyAwareQueue()
+    queue.enqueue(submission("id_verification", 1))
+    assert queue.dequeue() is not None
+    queue.enqueue(submission("id_verification", 1, delta_minutes=1))
+
+    assert queue.dequeue() is None
+    queue.ack(1, "id_verification")
+    assert queue.dequeue() == TaskDispatch(provider="id_verification", user_id=1)
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_immediate_acks_keep_legacy_order(seed: int) -> None:
+    operations = without_dependants(random_operations(seed))
+
+    assert replay_queue(AckingQueue(), operations) == replay_queue(HeapQueue(), operations)
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_workers_never_get_a_task_before_its_dependencies(seed: int) -> None:
+    rng = random.Random(seed)
+    queue = DependencyAwareQueue()
+    in_flight: list[TaskDispatch] = []
+
+    for name, payload in random_operations(seed, steps=120):
+        if name == "purge":
+            continue
+        if name.startswith("enqueue"):
+            apply(queue, name, payload)
+        for dispatch in queue.dequeue_many(rng.randint(0, 2)):
+            key = (dispatch.user_id, dispatch.provider)
+            assert all(
+                (dispatch.user_id, dependency) not in in_flight_keys(in_flight)
+                for dependency in queue._registry.dependency_closure(dispatch.provider)
+            )
+            assert key not in in_flight_keys(in_flight)
+            in_flight.append(dispatch)
+        while in_flight and rng.random() < 0.5:
+            done = in_flight.pop(rng.randrange(len(in_flight)))
+            if rng.random() < 0.8:
+                assert queue.ack(done.user_id, done.provider)
+            else:
+                assert queue.nack(done.user_id, done.provider, requeue=rng.random() < 0.5)
+        assert queue.in_flight == len(in_flight)
+        assert_ready_index(queue)
+
+    for done in in_flight:
+        queue.ack(done.user_id, done.provider)
+    while queue.size:
+        for dispatch in queue.dequeue_many(queue.size):
+            queue.ack(dispatch.user_id, dispatch.provider)
+    assert queue.in_flight == 0
+
+
+def in_flight_keys(in_flight: list[TaskDispatch]) -> set[tuple[int, str]]:
+    return {(dispatch.user_id, dispatch.provider) for dispatch in in_flight}
+
+
+def test_parallel_workers_drain_the_queue() -> None:
+    queue = QueueSolutionEntrypoint(engine="dependencies")
+    queue.enqueue_many(
+        [
+            TaskSubmission(provider="credit_check", user_id=user_id, timestamp=iso_ts())
+            for user_id in range(200)
+        ]
+    )
+    finished: set[tuple[int, str]] = set()
+    early: list[TaskDispatch] = []
+    lock = threading.Lock()
+
+    def work() -> None:
+        while queue.size() or queue._queue.in_flight:
+            dispatch = queue.dequeue()
+            if dispatch is None:
+                continue
+            with lock:
+                if dispatch.provider == "credit_check" and (
+                    (dispatch.user_id, "companies_house") not in finished
+                ):
+                    early.append(dispatch)
+                finished.add((dispatch.user_id, dispatch.provider))
+            queue.ack(dispatch.user_id, dispatch.provider)
+
+    workers = [threading.Thread(target=work) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert early == [] and len(finished) == 400
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_state_round_trip_keeps_in_flight_tasks(seed: int) -> None:
+    rng = random.Random(seed)
+    queue = DependencyAwareQueue()
+    for name, payload in random_operations(seed, steps=60):
+        if name.startswith("enqueue"):
+            apply(queue, name, payload)
+        queue.dequeue_many(rng.randint(0, 2))
+
+    restored = DependencyAwareQueue()
+    restored.load_state(queue.export_state())
+    assert_ready_index(restored)
+    assert restored.export_state() == queue.export_state()
+    assert restored.in_flight == queue.in_flight
+
+    for user_id, provider in list(queue._in_flight):
+        requeue = rng.random() < 0.5
+        assert restored.nack(user_id, provider, requeue) == queue.nack(user_id, provider, requeue)
+    assert restored.dequeue_many(restored.size) == queue.dequeue_many(queue.size)
+
+
+def test_heap_queue_state_loads_with_nothing_in_flight() -> None:
+    heap = HeapQueue()
+    heap.enqueue(submission("credit_check", 1))
+    queue = DependencyAwareQueue()
+    queue.enqueue(submission("id_verification", 2))
+    queue.dequeue()
+
+    queue.load_state(heap.export_state())
+    assert queue.in_flight == 0
+    assert queue.dequeue_many(2) == [TaskDispatch(provider="companies_house", user_id=1)]
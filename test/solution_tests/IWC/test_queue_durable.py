@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import os
+import random
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from solutions.IWC.ordering_policy import DeprioritisationWindow, OrderingPolicy, SubTiers
+from solutions.IWC.queue_solution_durable import SNAPSHOT_FILE, DurableQueue
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.queue_solution_legacy import Priority
+from solutions.IWC.task_types import TaskDispatch, TaskSubmission
+
+from .utils import iso_ts, random_operations, replay, replay_queue
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_recovery_preserves_legacy_order(tmp_path: Path, seed: int) -> None:
+    rng = random.Random(seed)
+    operations = random_operations(seed, steps=120)
+    queue = DurableQueue(tmp_path, fsync_interval=None, snapshot_every=rng.choice([None, 5]))
+    results = []
+    for operation in operations:
+        results += replay_queue(queue, [operation])
+        if rng.random() < 0.1:
+            if rng.random() < 0.5:
+                queue.close()
+            # Otherwise abandon it as a crash would: every record is already synced.
+            queue = DurableQueue(tmp_path, fsync_interval=None, snapshot_every=rng.choice([None, 5]))
+    queue.close()
+
+    assert results == replay("legacy", operations)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_snapshots_store_any_policy_tiers(tmp_path: Path, seed: int) -> None:
+    policy = OrderingPolicy(
+        windows=(DeprioritisationWindow("bank_statements", seconds=300, tier=100_000),),
+        main_tier=-1,
+        sub_tiers=SubTiers(aged_out=-7, high=1, high_in_window=300, normal=3),
+    )
+    operations = random_operations(seed, steps=120)
+    queue = DurableQueue(tmp_path, fsync_interval=None, policy=policy, snapshot_every=5)
+    results = []
+    for start in range(0, len(operations), 30):
+        results += replay_queue(queue, operations[start : start + 30])
+        queue.close()
+        queue = DurableQueue(tmp_path, fsync_interval=None, policy=policy, snapshot_every=5)
+    queue.close()
+
+    assert results == replay_queue(HeapQueue(policy=policy), operations)
+
+
+def test_torn_log_tail_is_dropped(tmp_path: Path) -> None:
+    queue = DurableQueue(tmp_path, fsync_interval=None, snapshot_every=None)
+    queue.enqueue(TaskSubmission("id_verification", 1, iso_ts()))
+    queue.enqueue(TaskSubmission("id_verification", 2, iso_ts(delta_minutes=1)))
+    (segment,) = tmp_path.glob("wal.*.log")
+    segment.write_bytes(segment.read_bytes()[:-3])
+
+    recovered = DurableQueue(tmp_path, fsync_interval=None, snapshot_every=None)
+    assert recovered.size == 1
+    recovered.enqueue(TaskSubmission("id_verification", 3, iso_ts(delta_minutes=2)))
+    recovered.close()
+
+    assert DurableQueue(tmp_path, fsync_interval=None).dequeue_many(3) == [
+        TaskDispatch("id_verification", 1),
+        TaskDispatch("id_verification", 3),
+    ]
+
+
+def test_snapshot_replaces_covered_segments(tmp_path: Path) -> None:
+    with DurableQueue(tmp_path, snapshot_every=None) as queue:
+        queue.enqueue(TaskSubmission("bank_statements", 1, iso_ts()))
+        queue.snapshot()
+        queue.enqueue(TaskSubmission("id_verification", 2, iso_ts(delta_minutes=10)))
+
+    assert (tmp_path / SNAPSHOT_FILE).exists()
+    assert len(list(tmp_path.glob("wal.*.log"))) == 1
+    with DurableQueue(tmp_path) as queue:
+        assert queue.size == 2
+        assert queue.age == 600
+        assert queue.dequeue().user_id == 1
+
+
+def test_wait_for_commit_returns_once_synced(tmp_path: Path) -> None:
+    with DurableQueue(tmp_path, wait_for_commit=True, snapshot_every=None) as queue:
+        queue.enqueue(TaskSubmission("id_verification", 1, iso_ts()))
+        # No close: the group commit alone must have made the record durable.
+        assert DurableQueue(tmp_path, fsync_interval=None, snapshot_every=None).size == 1
+
+
+def test_unloggable_submission_is_rejected_before_it_is_queued(tmp_path: Path) -> None:
+    with DurableQueue(tmp_path, wait_for_commit=True, snapshot_every=None) as queue:
+        with pytest.raises(ValueError):
+            queue.enqueue(TaskSubmission("id_verification", 2**64, iso_ts()))
+        assert queue.size == 0
+        assert queue.enqueue(TaskSubmission("id_verification", 1, iso_ts())) == 1
+    assert DurableQueue(tmp_path, fsync_interval=None).size == 1
+
+
+def test_failed_group_commit_is_raised_to_callers(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def fail(descriptor: int) -> None:
+        raise OSError("disk gone")
+
+    queue = DurableQueue(tmp_path, fsync_interval=0.001, wait_for_commit=True, snapshot_every=None)
+    monkeypatch.setattr(os, "fsync", fail)
+    with pytest.raises(OSError):
+        queue.enqueue(TaskSubmission("id_verification", 1, iso_ts()))
+    with pytest.raises(OSError):
+        queue.enqueue(TaskSubmission("id_verification", 2, iso_ts()))
+    assert queue.size == 1
+
+
+def test_log_keeps_only_plain_ordering_fields(tmp_path: Path) -> None:
+    class Callback:
+        def __reduce__(self):
+            raise AssertionError("metadata must not be pickled")
+
+    items = [
+        TaskSubmission("id_verification", 1, iso_ts(delta_minutes=5), {"on_done": Callback()}),
+        TaskSubmission(
+            "bank_statements",
+            2,
+            datetime(2025, 1, 1, 12, 9),
+            {"priority": Priority.HIGH, "group_earliest_timestamp": iso_ts(delta_minutes=-1)},
+        ),
+        TaskSubmission("companies_house", 3, iso_ts(delta_minutes=2), {"priority": "urgent"}),
+        TaskSubmission("credit_check", 4, iso_ts(delta_minutes=3), {"priority": 1}),
+    ]
+    expected = HeapQueue()
+    expected.enqueue_many(items[:2])
+    for item in items[2:]:
+        expected.enqueue(item)
+    queue = DurableQueue(tmp_path, fsync_interval=None, snapshot_every=None)
+    queue.enqueue_many(items[:2])
+    for item in items[2:]:
+        queue.enqueue(item)
+
+    recovered = DurableQueue(tmp_path, fsync_interval=None, snapshot_every=None)
+    assert recovered.dequeue_many(10) == expected.dequeue_many(10)
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from entry_point_mapping import EntryPointMapping
+from solutions.IWC.indexed_heap import IndexedHeap
+from solutions.IWC.queue_solution_compact import CompactQueue
+from solutions.IWC.queue_solution_entrypoint import QUEUE_ENGINE_ENV_VAR, QueueSolutionEntrypoint
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.queue_solution_legacy import Queue
+from solutions.IWC.task_types import TaskSubmission, timestamp_key
+
+from .utils import iso_ts, random_operations, random_task, replay, to_submission
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_heap_engine_matches_legacy(seed: int) -> None:
+    operations = random_operations(seed)
+    assert replay("heap", operations) == replay("legacy", operations)
+
+
+def test_legacy_engine_is_the_default(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv(QUEUE_ENGINE_ENV_VAR, raising=False)
+    assert type(QueueSolutionEntrypoint()._queue) is Queue
+
+    monkeypatch.setenv(QUEUE_ENGINE_ENV_VAR, "heap")
+    assert type(QueueSolutionEntrypoint()._queue) is HeapQueue
+    assert type(QueueSolutionEntrypoint(engine="compact")._queue) is CompactQueue
+
+
+def test_unknown_engine_is_rejected() -> None:
+    with pytest.raises(ValueError):
+        QueueSolutionEntrypoint(engine="bogus")
+
+
+def test_indexed_heap_update_and_remove() -> None:
+    heap: IndexedHeap[str] = IndexedHeap()
+    for handle, key in [("a", 5), ("b", 3), ("c", 8), ("d", 1)]:
+        heap.push(handle, key)
+
+    heap.update("c", 0)
+    heap.update("d", 9)
+    heap.remove("b")
+
+    assert "b" not in heap
+    assert [heap.pop() for _ in range(len(heap))] == [("c", 0), ("a", 5), ("d", 9)]
+
+
+def test_dedup_index_follows_dequeue_and_purge() -> None:
+    queue = QueueSolutionEntrypoint(engine="heap")
+    task = {"provider": "id_verification", "user_id": 1, "timestamp": iso_ts()}
+
+    assert queue.enqueue(TaskSubmission(**task)) == 1
+    assert queue.enqueue(TaskSubmission(**task)) == 1
+    queue.dequeue()
+    assert queue.enqueue(TaskSubmission(**task)) == 1
+    queue.purge()
+    assert queue.enqueue(TaskSubmission(**task)) == 1
+
+
+def test_timestamp_key_drops_timezone_like_legacy() -> None:
+    naive = datetime(2025, 1, 1, 12, 0)
+
+    assert timestamp_key("2025-01-01T12:00:00+05:00") == timestamp_key(naive)
+    assert timestamp_key(naive + timedelta(microseconds=1)) - timestamp_key(naive) == 1
+
+
+@pytest.mark.parametrize("engine", ["legacy", "heap"])
+def test_mixed_timestamp_types(engine: str) -> None:
+    queue = QueueSolutionEntrypoint(engine=engine)
+    queue.enqueue(TaskSubmission("id_verification", 1, datetime(2025, 1, 1, 12, 0)))
+    queue.enqueue(TaskSubmission("companies_house", 2, iso_ts(delta_minutes=5)))
+
+    assert queue.age() == 300
+    assert queue.dequeue().user_id == 1
+
+
+def test_enqueue_many_bulk_insert_into_large_batch() -> None:
+    rng = random.Random(7)
+    batch = [random_task(rng) for _ in range(200)]
+    sequential = QueueSolutionEntrypoint(engine="heap")
+    for task in batch:
+        sequential.enqueue(to_submission(task))
+    bulk = QueueSolutionEntrypoint(engine="heap")
+
+    assert bulk.enqueue_many([to_submission(task) for task in batch]) == sequential.size()
+    assert [bulk.dequeue() for _ in range(bulk.size())] == [
+        sequential.dequeue() for _ in range(sequential.size())
+    ]
+
+
+def test_entry_point_mapping_batch_calls() -> None:
+    mapping = EntryPointMapping()
+    tasks = [
+        {"provider": "credit_check", "user_id": 1, "timestamp": iso_ts()},
+        {"provider": "id_verification", "user_id": 2, "timestamp": iso_ts(delta_minutes=1)},
+    ]
+
+    assert mapping.enqueue_many(tasks) == 3
+    assert mapping.dequeue_many(2) == [
+        {"provider": "companies_house", "user_id": 1},
+        {"provider": "credit_check", "user_id": 1},
+    ]
+    assert mapping.dequeue_many(5) == [{"provider": "id_verification", "user_id": 2}]
+    assert mapping.dequeue_many(1) == []
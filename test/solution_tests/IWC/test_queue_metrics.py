@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from solutions.IWC.queue_metrics import MetricsRegistry
+from solutions.IWC.queue_solution_entrypoint import QueueSolutionEntrypoint
+from solutions.IWC.task_types import TaskDispatch
+
+from .utils import submission
+
+
+def test_registry_renders_prometheus_text() -> None:
+    registry = MetricsRegistry(latency_buckets=(0.001, 0.01))
+    registry.increment("iwc_queue_submissions_total", (("provider", "credit_check"),), 2)
+    registry.set_gauge("iwc_queue_depth", 5)
+    registry.observe("iwc_queue_operation_seconds", 0.005, (("operation", "dequeue"),))
+    registry.observe("iwc_queue_operation_seconds", 0.5, (("operation", "dequeue"),))
+
+    assert registry.render().splitlines() == [
+        "# HELP iwc_queue_submissions_total Submissions received by provider.",
+        "# TYPE iwc_queue_submissions_total counter",
+        'iwc_queue_submissions_total{provider="credit_check"} 2',
+        "# HELP iwc_queue_depth Tasks currently queued.",
+        "# TYPE iwc_queue_depth gauge",
+        "iwc_queue_depth 5",
+        "# HELP iwc_queue_operation_seconds Entrypoint call latency by operation.",
+        "# TYPE iwc_queue_operation_seconds histogram",
+        'iwc_queue_operation_seconds_bucket{operation="dequeue",le="0.001"} 0',
+        'iwc_queue_operation_seconds_bucket{operation="dequeue",le="0.01"} 1',
+        'iwc_queue_operation_seconds_bucket{operation="dequeue",le="+Inf"} 2',
+        'iwc_queue_operation_seconds_sum{operation="dequeue"} 0.505',
+        'iwc_queue_operation_seconds_count{operation="dequeue"} 2',
+    ]
+
+
+def test_label_values_are_escaped() -> None:
+    registry = MetricsRegistry()
+    registry.increment("custom_total", (("name", 'a"b\\c'),))
+
+    assert 'custom_total{name="a\\"b\\\\c"} 1' in registry.render()
+
+
+def test_entrypoint_reports_operations_providers_and_engine_internals() -> None:
+    registry = MetricsRegistry()
+    queue = QueueSolutionEntrypoint(engine="heap", metrics=registry)
+    queue.enqueue(submission("credit_check", 1))  # also enqueues companies_house
+    queue.enqueue(submission("companies_house", 1, delta_minutes=1))  # dedup hit, kept
+    queue.enqueue(submission("bank_statements", 2))
+    queue.enqueue(submission("id_verification", 1))
+    queue.size()
+
+    assert registry.render()
+    assert registry.value("iwc_queue_tasks", (("tier", "999"),)) == 1
+    assert registry.value("iwc_queue_rule_of_3_users") == 1
+
+    assert queue.dequeue() == TaskDispatch(provider="companies_house", user_id=1)
+    registry.render()
+
+    assert registry.value("iwc_queue_submissions_total", (("provider", "credit_check"),)) == 1
+    assert registry.value("iwc_queue_submissions_total", (("provider", "companies_house"),)) == 1
+    assert registry.value("iwc_queue_tasks_offered_total", (("provider", "companies_house"),)) == 2
+    assert registry.value("iwc_queue_dedup_hits_total") == 1
+    assert registry.value("iwc_queue_rule_of_3_promotions_total") == 3
+    assert registry.value("iwc_queue_dispatched_total", (("provider", "companies_house"),)) == 1
+    assert registry.value("iwc_queue_tier_dispatched_total", (("tier", "0"),)) == 1
+    assert registry.value("iwc_queue_depth") == 3
+    assert registry.value("iwc_queue_age_seconds") == 0
+    assert registry.value("iwc_queue_tasks", (("tier", "0"),)) == 2
+
+
+def test_batch_enqueue_counts_dedup_hits_like_single_enqueues() -> None:
+    single, batch = MetricsRegistry(), MetricsRegistry()
+    items = [
+        submission("credit_check", 1, delta_minutes=2),
+        submission("companies_house", 1, delta_minutes=1),
+        submission("credit_check", 1),
+        submission("id_verification", 2),
+    ]
+    one_by_one = QueueSolutionEntrypoint(engine="heap", metrics=single)
+    for item in items:
+        one_by_one.enqueue(item)
+    QueueSolutionEntrypoint(engine="heap", metrics=batch).enqueue_many(items)
+
+    for name in ("iwc_queue_dedup_hits_total", "iwc_queue_tasks_offered_total"):
+        for labels in ((), (("provider", "companies_house"),)):
+            assert single.value(name, labels) == batch.value(name, labels)
+    assert batch.value("iwc_queue_dedup_hits_total") == 3
+
+
+def test_every_engine_reports_entrypoint_metrics() -> None:
+    for engine in ("legacy", "threadsafe"):
+        registry = MetricsRegistry()
+        queue = QueueSolutionEntrypoint(engine=engine, metrics=registry)
+        queue.enqueue_many([submission("id_verification", 1), submission("bank_statements", 2)])
+        queue.dequeue_many(2)
+        queue.purge()
+
+        text = registry.render()
+        assert 'iwc_queue_operation_seconds_count{operation="dequeue_many"} 1' in text
+        assert registry.value("iwc_queue_dispatched_total", (("provider", "bank_statements"),)) == 1
+
+
+def test_detached_sink_receives_nothing() -> None:
+    registry = MetricsRegistry()
+    queue = QueueSolutionEntrypoint(engine="heap", metrics=registry)
+    queue.attach_metrics(None)
+    queue.enqueue(submission("id_verification", 1))
+    queue.dequeue()
+    registry.render()
+
+    assert registry.value("iwc_queue_depth") is None
+    assert registry.value("iwc_queue_submissions_total", (("provider", "id_verification"),)) is None
+    assert registry.value("iwc_queue_tier_dispatched_total", (("tier", "0"),)) is None
+
+
+def test_attaching_a_sink_again_keeps_one_collector() -> None:
+    registry, other = MetricsRegistry(), MetricsRegistry()
+    queue = QueueSolutionEntrypoint(engine="heap", metrics=registry)
+    for sink in (registry, None, registry, other, registry, registry):
+        queue.attach_metrics(sink)
+    queue.enqueue(submission("id_verification", 1))
+    registry.render()
+    other.render()
+
+    assert len(registry._collectors) == len(other._collectors) == 1
+    assert registry.value("iwc_queue_depth") == 1 and other.value("iwc_queue_depth") is None
+    assert registry.value("iwc_queue_submissions_total", (("provider", "id_verification"),)) == 1
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import copy
+import itertools
+import random
+
+import pytest
+
+from solutions.IWC.indexed_heap import IndexedHeap
+from solutions.IWC.queue_solution_dependencies import DependencyAwareQueue
+from solutions.IWC.queue_solution_entrypoint import QueueSolutionEntrypoint
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.task_types import TaskDispatch, TaskSubmission
+
+from .utils import apply, iso_ts, random_operations
+
+
+def test_iter_sorted_walks_the_heap_in_key_order() -> None:
+    rng = random.Random(7)
+    heap: IndexedHeap[int] = IndexedHeap()
+    heap.push_many((handle, rng.randint(0, 50)) for handle in range(200))
+    before = list(heap)
+
+    keys = [key for _, key in heap.iter_sorted()]
+    assert keys == sorted(keys) and len(keys) == 200
+    assert list(heap) == before
+    assert heap.count_below(10) == sum(key < 10 for key in keys)
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_ordered_views_match_dispatch_and_leave_queue_untouched(seed: int) -> None:
+    queue = HeapQueue()
+    for name, payload in random_operations(seed, steps=60):
+        apply(queue, name, payload)
+        state = queue.export_state()
+
+        ordered = list(queue.iter_ordered())
+        assert queue.top_k(3) == ordered[:3]
+        assert queue.peek() == (ordered[0] if ordered else None)
+        assert queue.export_state() == state
+        assert copy.deepcopy(queue).dequeue_many(queue.size) == ordered
+
+
+class CountingKeys(list):
+    """Heap key list that counts how many keys are read back."""
+
+    reads = 0
+
+    def __getitem__(self, position):
+        self.reads += 1
+        return super().__getitem__(position)
+
+
+def count_key_reads(heap: IndexedHeap) -> CountingKeys:
+    heap._keys = CountingKeys(heap._keys)
+    return heap._keys
+
+
+def test_iter_ordered_is_lazy() -> None:
+    queue = HeapQueue()
+    queue.enqueue_many(
+        TaskSubmission(provider="id_verification", user_id=user_id, timestamp=iso_ts())
+        for user_id in range(10_000)
+    )
+    keys = count_key_reads(queue._heap)
+
+    first = list(itertools.islice(queue.iter_ordered(), 2))
+    assert first == [
+        TaskDispatch(provider="id_verification", user_id=0),
+        TaskDispatch(provider="id_verification", user_id=1),
+    ]
+    # A sort would read all 10,000 keys; the walk reads the top and its children.
+    assert keys.reads <= 10
+
+
+def test_iter_ordered_skips_blocked_tasks_without_visiting_them() -> None:
+    queue = DependencyAwareQueue()
+    queue.enqueue_many(
+        TaskSubmission(provider="credit_check", user_id=user_id, timestamp=iso_ts())
+        for user_id in range(5_000)
+    )
+    # Every credit_check now waits on its companies_house in flight, ahead
+    # of the one ready task in the global order.
+    assert len(queue.dequeue_many(5_000)) == 5_000
+    queue.enqueue(
+        TaskSubmission(provider="bank_statements", user_id=-1, timestamp=iso_ts(delta_minutes=1))
+    )
+    queued, ready = count_key_reads(queue._heap), count_key_reads(queue._candidates)
+
+    assert list(queue.iter_ordered()) == [TaskDispatch(provider="bank_statements", user_id=-1)]
+    assert queued.reads == 0 and ready.reads <= 3
+
+
+def test_entrypoint_views() -> None:
+    queue = QueueSolutionEntrypoint(engine="threadsafe")
+    assert queue.peek() is None
+    queue.enqueue(TaskSubmission(provider="credit_check", user_id=1, timestamp=iso_ts()))
+
+    assert queue.top_k(5) == list(queue.iter_ordered()) == [
+        TaskDispatch(provider="companies_house", user_id=1),
+        TaskDispatch(provider="credit_check", user_id=1),
+    ]
+    assert queue.peek() == queue.dequeue()
+    assert queue.top_k(0) == []
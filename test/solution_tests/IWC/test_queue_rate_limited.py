@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import random
+from collections import Counter
+from dataclasses import replace
+
+import pytest
+
+from solutions.IWC.provider_registry import ProviderRegistry
+from solutions.IWC.queue_solution_dependencies import DependencyAwareQueue
+from solutions.IWC.queue_solution_entrypoint import QueueSolutionEntrypoint
+from solutions.IWC.queue_solution_legacy import REGISTERED_PROVIDERS, Provider
+from solutions.IWC.queue_solution_rate_limited import RateLimitedQueue
+from solutions.IWC.task_types import TaskDispatch
+
+from .utils import apply, assert_ready_index, random_operations, submission
+
+LIMITS = {
+    "companies_house": {"max_in_flight": 2},
+    "credit_check": {"rate_limit": 2.0, "burst": 2},
+    "id_verification": {"max_in_flight": 3, "rate_limit": 4.0},
+}
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def limited_registry() -> ProviderRegistry:
+    return ProviderRegistry(
+        replace(provider, **LIMITS.get(provider.name, {})) for provider in REGISTERED_PROVIDERS
+    )
+
+
+class ReferenceLimits:
+    """Which providers may dispatch, tracked independently of the engine."""
+
+    def __init__(self, registry: ProviderRegistry, clock: FakeClock) -> None:
+        self.registry = registry
+        self.clock = clock
+        self.in_flight: Counter[str] = Counter()
+        self.tokens: dict[str, float] = {}
+        self.updated: dict[str, float] = {}
+
+    def _refill(self, provider: Provider) -> float:
+        now = self.clock()
+        tokens = self.tokens.get(provider.name, float(provider.burst))
+        elapsed = now - self.updated.get(provider.name, now)
+        self.tokens[provider.name] = min(provider.burst, tokens + elapsed * provider.rate_limit)
+        self.updated[provider.name] = now
+        return self.tokens[provider.name]
+
+    def eligible(self, name: str) -> bool:
+        provider = self.registry.get(name)
+        if provider.max_in_flight is not None and self.in_flight[name] >= provider.max_in_flight:
+            return False
+        return provider.rate_limit is None or self._refill(provider) >= 1
+
+    def dispatched(self, name: str) -> None:
+        provider = self.registry.get(name)
+        self.in_flight[name] += 1
+        if provider.rate_limit is not None:
+            self._refill(provider)
+            self.tokens[name] -= 1
+
+
+def test_saturated_provider_is_skipped_until_acked() -> None:
+    queue = RateLimitedQueue(registry=limited_registry(), clock=FakeClock())
+    for user_id in range(1, 5):
+        queue.enqueue(submission("companies_house", user_id, delta_minutes=user_id))
+    queue.enqueue(submission("bank_statements", 9, delta_minutes=20))
+
+    assert queue.dequeue_many(5) == [
+        TaskDispatch(provider="companies_house", user_id=1),
+        TaskDispatch(provider="companies_house", user_id=2),
+        TaskDispatch(provider="bank_statements", user_id=9),
+    ]
+    assert queue.dequeue() is None and queue.throttled_until() is None
+    assert queue.peek() is None
+
+    queue.ack(2, "companies_house")
+    assert queue.peek() == queue.dequeue() == TaskDispatch(provider="companies_house", user_id=3)
+    assert queue.dequeue() is None
+
+
+def test_token_bucket_reports_when_the_next_token_arrives() -> None:
+    clock = FakeClock()
+    registry = ProviderRegistry(REGISTERED_PROVIDERS)
+    registry.register(
+        Provider("id_verification", "https://fake.idv.co.uk", [], rate_limit=2.0, burst=2)
+    )
+    queue = RateLimitedQueue(registry=registry, clock=clock)
+    for user_id in range(1, 5):
+        queue.enqueue(submission("id_verification", user_id, delta_minutes=user_id))
+
+    # The burst of two goes out back to back, then one every half second.
+    assert queue.dequeue_many(4) == [
+        TaskDispatch(provider="id_verification", user_id=1),
+        TaskDispatch(provider="id_verification", user_id=2),
+    ]
+    assert queue.throttled_until() == 0.5
+
+    clock.now = 0.5
+    assert queue.throttled_until() is None
+    assert queue.dequeue() == TaskDispatch(provider="id_verification", user_id=3)
+    assert queue.dequeue() is None and queue.throttled_until() == 1.0
+
+
+def test_re_registered_limits_apply_to_a_running_queue() -> None:
+    clock = FakeClock()
+    registry = limited_registry()
+    registry.register(replace(registry.get("bank_statements"), rate_limit=2.0, burst=2))
+    queue = RateLimitedQueue(registry=registry, clock=clock)
+    for user_id in range(1, 5):
+        queue.enqueue(submission("companies_house", user_id, delta_minutes=user_id))
+        queue.enqueue(submission("bank_statements", user_id, delta_minutes=10 + user_id))
+    assert len(queue.dequeue_many(8)) == 4
+    assert queue.throttled_until() == 0.5
+
+    # More capacity unblocks a saturated provider without waiting for an ack.
+    registry.register(replace(registry.get("companies_house"), max_in_flight=3))
+    assert queue.dequeue() == TaskDispatch(provider="companies_house", user_id=3)
+    assert queue.dequeue() is None
+
+    # A slower bucket keeps its tokens and moves the next wake-up out.
+    registry.register(replace(registry.get("bank_statements"), rate_limit=1.0, burst=1))
+    assert queue.throttled_until() == 1.0
+    clock.now = 0.5
+    assert queue.dequeue() is None
+
+    # Dropping the limits releases everything that was waiting on them.
+    registry.register(replace(registry.get("bank_statements"), rate_limit=None))
+    registry.register(replace(registry.get("companies_house"), max_in_flight=None))
+    assert queue.dequeue_many(3) == [
+        TaskDispatch(provider="companies_house", user_id=4),
+        TaskDispatch(provider="bank_statements", user_id=3),
+        TaskDispatch(provider="bank_statements", user_id=4),
+    ]
+
+
+def test_entrypoint_engine() -> None:
+    queue = QueueSolutionEntrypoint(engine="rate_limited")
+    queue.enqueue(submission("credit_check", 1))
+
+    assert queue.dequeue() == TaskDispatch(provider="companies_house", user_id=1)
+    assert queue.dequeue() is None and queue.throttled_until() is None
+    assert queue.ack(1, "companies_house")
+    assert queue.dequeue() == TaskDispatch(provider="credit_check", user_id=1)
+
+
+def test_invalid_limits_are_rejected() -> None:
+    with pytest.raises(ValueError):
+        ProviderRegistry([Provider("x", "https://x", [], rate_limit=0)])
+    with pytest.raises(ValueError):
+        limited_registry().register(Provider("x", "https://x", [], max_in_flight=0))
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_without_limits_dispatch_matches_dependency_engine(seed: int) -> None:
+    rng = random.Random(seed)
+    queues = [RateLimitedQueue(clock=FakeClock()), DependencyAwareQueue()]
+    in_flight: list[TaskDispatch] = []
+
+    for name, payload in random_operations(seed, steps=120):
+        for queue in queues:
+            apply(queue, name, payload)
+        count = rng.randint(0, 2)
+        dispatched = [queue.dequeue_many(count) for queue in queues]
+        assert dispatched[0] == dispatched[1]
+        in_flight.extend(dispatched[0])
+        while in_flight and rng.random() < 0.5:
+            done = in_flight.pop(rng.randrange(len(in_flight)))
+            for queue in queues:
+                assert queue.ack(done.user_id, done.provider)
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_dispatch_takes_the_best_task_within_the_limits(seed: int) -> None:
+    rng = random.Random(seed)
+    clock = FakeClock()
+    registry = limited_registry()
+    queue = RateLimitedQueue(registry=registry, clock=clock)
+    reference = ReferenceLimits(registry, clock)
+    in_flight: list[TaskDispatch] = []
+
+    for name, payload in random_operations(seed, steps=150):
+        if not name.startswith("dequeue"):
+            apply(queue, name, payload)
+        clock.now += rng.choice([0.0, 0.0, 0.25, 0.5])
+        for _ in range(rng.randint(0, 3)):
+            eligible = {task for task in queue._heap if reference.eligible(task.provider)}
+            dispatch = queue.dequeue()
+            held = [task for task in eligible if task in queue._candidates]
+            if dispatch is None:
+                assert held == []
+                continue
+            assert reference.eligible(dispatch.provider)
+            winner = queue._in_flight[dispatch.user_id, dispatch.provider]
+            assert all(winner.heap_key < task.heap_key for task in held)
+            reference.dispatched(dispatch.provider)
+            in_flight.append(dispatch)
+        while in_flight and rng.random() < 0.4:
+            done = in_flight.pop(rng.randrange(len(in_flight)))
+            reference.in_flight[done.provider] -= 1
+            if rng.random() < 0.8:
+                assert queue.ack(done.user_id, done.provider)
+            else:
+                assert queue.nack(done.user_id, done.provider, requeue=rng.random() < 0.5)
+        assert_ready_index(queue)
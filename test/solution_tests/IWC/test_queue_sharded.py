@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import pytest
+
+from solutions.IWC.queue_solution_entrypoint import QueueSolutionEntrypoint
+from solutions.IWC.queue_solution_sharded import ShardedQueue
+from solutions.IWC.task_types import TaskDispatch, TaskSubmission
+
+from .utils import iso_ts, random_operations, replay, replay_queue
+
+
+@pytest.mark.parametrize("seed", range(150))
+def test_in_process_shards_match_legacy(seed: int) -> None:
+    operations = random_operations(seed)
+    queue = ShardedQueue(shards=3, processes=False)
+
+    assert replay_queue(queue, operations) == replay("legacy", operations)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_process_shards_match_legacy(seed: int) -> None:
+    operations = random_operations(seed, steps=200)
+    with ShardedQueue(shards=2) as queue:
+        assert replay_queue(queue, operations) == replay("legacy", operations)
+
+
+def test_invalid_submission_leaves_shards_untouched() -> None:
+    with ShardedQueue(shards=2) as queue:
+        with pytest.raises(ValueError):
+            queue.enqueue(TaskSubmission("credit_check", 1, "not a timestamp"))
+        queue.enqueue(TaskSubmission("credit_check", 1, iso_ts()))
+
+        assert queue.size == 2
+
+
+@pytest.mark.parametrize("processes", [True, False])
+def test_invalid_submission_in_a_batch_fails_its_shard_only(processes: bool) -> None:
+    with ShardedQueue(shards=2, processes=processes) as queue:
+        with pytest.raises(ValueError):
+            queue.enqueue_many(
+                [
+                    TaskSubmission("id_verification", 0, "not a timestamp"),
+                    TaskSubmission("id_verification", 1, iso_ts()),
+                ]
+            )
+        # User 1's shard stored its task and every reply was read.
+        assert queue.size == 1
+        assert queue.enqueue(TaskSubmission("id_verification", 2, iso_ts(delta_minutes=1))) == 2
+        assert queue.dequeue_many(3) == [
+            TaskDispatch(provider="id_verification", user_id=1),
+            TaskDispatch(provider="id_verification", user_id=2),
+        ]
+
+
+def test_entrypoint_close_stops_the_shard_processes() -> None:
+    with QueueSolutionEntrypoint(engine="sharded") as queue:
+        queue.enqueue(TaskSubmission("id_verification", 1, iso_ts()))
+        processes = [shard._process for shard in queue._queue._shards]
+        assert all(process.is_alive() for process in processes)
+    assert not any(process.is_alive() for process in processes)
+    queue.close()  # idempotent
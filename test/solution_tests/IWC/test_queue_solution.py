@@ -1,8 +1,20 @@
 from __future__ import annotations
 
+import pytest
+
+from solutions.IWC.queue_solution_entrypoint import QUEUE_ENGINE_ENV_VAR
+
 from .utils import call_dequeue, call_enqueue, call_size, iso_ts, run_queue, call_age
 
 
+@pytest.fixture(autouse=True, params=["legacy", "heap"])
+def engine(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch) -> str:
+    """Run every scenario on the default legacy engine and on the heap engine."""
+    monkeypatch.setenv(QUEUE_ENGINE_ENV_VAR, request.param)
+    return request.param
+
+
+
 def test_enqueue_size_dequeue_flow() -> None:
     run_queue([
         call_enqueue("companies_house", 1, iso_ts(delta_minutes=0)).expect(1),
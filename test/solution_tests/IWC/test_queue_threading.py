@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import random
+import sys
+import threading
+from collections import Counter
+
+from solutions.IWC.queue_metrics import MetricsRegistry
+from solutions.IWC.queue_solution_heap import HeapQueue
+from solutions.IWC.queue_solution_threaded import ThreadSafeQueue
+from solutions.IWC.task_types import TaskSubmission
+
+from .utils import PROVIDERS, assert_consistent, iso_ts
+
+
+class RecordingHeapQueue(HeapQueue):
+    """Logs its mutating calls with their results, in the order the lock let them in."""
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.calls: list[tuple[str, tuple, object]] = []
+        self.callers: list[int] = []
+
+    def _record(self, name: str, args: tuple, result: object) -> None:
+        self.calls.append((name, args, result))
+        self.callers.append(threading.get_ident())
+
+    def enqueue_expanded(self, expanded, first_seq=None):
+        expanded = list(expanded)
+        result = super().enqueue_expanded(expanded, first_seq)
+        self._record("enqueue_expanded", (expanded,), result)
+        return result
+
+    def enqueue_many_expanded(self, expanded, seqs=None):
+        result = super().enqueue_many_expanded(expanded, seqs)
+        self._record("enqueue_many_expanded", (list(expanded),), result)
+        return result
+
+    def dequeue(self):
+        result = super().dequeue()
+        self._record("dequeue", (), result)
+        return result
+
+    def cancel(self, user_id, provider=None):
+        result = super().cancel(user_id, provider)
+        self._record("cancel", (user_id, provider), result)
+        return result
+
+
+class RecordingThreadSafeQueue(ThreadSafeQueue):
+    engine_type = RecordingHeapQueue
+
+
+def test_concurrent_enqueue_and_dequeue_keep_invariants() -> None:
+    queue = ThreadSafeQueue()
+    producers, consumers, per_producer = 12, 4, 300
+    expected: Counter[tuple[str, int]] = Counter()
+    dispatched: list[tuple[str, int]] = []
+    dispatched_lock = threading.Lock()
+    producers_done = threading.Event()
+
+    submissions: list[list[TaskSubmission]] = []
+    for index in range(producers):
+        rng = random.Random(index)
+        batch = []
+        for offset in range(per_producer):
+            # Unique users per submission, so nothing is deduplicated away.
+            user_id = index * per_producer + offset
+            provider = rng.choice(PROVIDERS)
+            batch.append(TaskSubmission(provider, user_id, iso_ts(delta_minutes=rng.randint(0, 10))))
+            expected[provider, user_id] += 1
+            if provider == "credit_check":
+                expected["companies_house", user_id] += 1
+        submissions.append(batch)
+
+    def produce(batch: list[TaskSubmission]) -> None:
+        for position, task in enumerate(batch):
+            if position % 10 == 0:
+                queue.enqueue_many([task])
+            else:
+                queue.enqueue(task)
+
+    def consume() -> None:
+        while True:
+            tasks = queue.dequeue_many(3)
+            if tasks:
+                with dispatched_lock:
+                    dispatched.extend((task.provider, task.user_id) for task in tasks)
+            elif producers_done.is_set() and queue.size == 0:
+                return
+
+    threads = [threading.Thread(target=consume) for _ in range(consumers)]
+    threads += [threading.Thread(target=produce, args=(batch,)) for batch in submissions]
+    for thread in threads:
+        thread.start()
+    for thread in threads[consumers:]:
+        thread.join()
+    producers_done.set()
+    for thread in threads[:consumers]:
+        thread.join()
+
+    assert Counter(dispatched) == expected
+    assert queue.dequeue() is None
+    assert_consistent(queue._queue)
+
+
+def test_threads_sharing_users_match_a_serial_replay() -> None:
+    queue = RecordingThreadSafeQueue()
+    metrics = MetricsRegistry()
+    queue.instrument(metrics)
+    users = 20
+
+    def random_submission(rng: random.Random) -> TaskSubmission:
+        return TaskSubmission(
+            rng.choice(PROVIDERS),
+            rng.randint(1, users),
+            iso_ts(delta_minutes=rng.randint(0, 10)),
+            {"priority": 1} if rng.random() < 0.05 else {},
+        )
+
+    start_line = threading.Barrier(16)
+
+    def work(seed: int) -> None:
+        rng = random.Random(seed)
+        start_line.wait()
+        for _ in range(300):
+            roll = rng.random()
+            if roll < 0.5:
+                queue.enqueue(random_submission(rng))
+            elif roll < 0.6:
+                queue.enqueue_many([random_submission(rng) for _ in range(rng.randint(1, 6))])
+            elif roll < 0.95:
+                queue.dequeue_many(rng.randint(1, 3))
+            else:
+                queue.cancel(rng.randint(1, users), rng.choice([None, *PROVIDERS]))
+
+    threads = [threading.Thread(target=work, args=(seed,)) for seed in range(16)]
+    # Switch threads far more often than the default 5ms, mid-call included.
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    recorded = queue._queue
+    assert_consistent(recorded)
+    # The threads took turns mid-run (back to back, 16 threads would hand
+    # over 15 times) and kept landing on the same users.
+    callers = recorded.callers
+    assert sum(before != after for before, after in zip(callers, callers[1:])) > 30
+    assert metrics.value("iwc_queue_dedup_hits_total") > 500
+    assert metrics.value("iwc_queue_rule_of_3_promotions_total") > 200
+    # Whatever the interleaving, the results are those of running the calls
+    # one at a time in the order they took the lock.
+    serial = HeapQueue()
+    for name, args, result in recorded.calls:
+        assert getattr(serial, name)(*args) == result
+    assert list(serial.iter_ordered()) == list(queue.iter_ordered())
@@ -1,19 +1,30 @@
 from __future__ import annotations
 
+import random
 from datetime import datetime, timezone, timedelta
 from typing import Any, Callable, Iterable
 
+from solutions.IWC.queue_solution_dependencies import DependencyAwareQueue
 from solutions.IWC.queue_solution_entrypoint import QueueSolutionEntrypoint
+from solutions.IWC.queue_solution_heap import HeapQueue
 from solutions.IWC.task_types import TaskDispatch, TaskSubmission
 
 
 DEFAULT_SCENARIO_BASE = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
 
+PROVIDERS = ["bank_statements", "companies_house", "credit_check", "id_verification"]
+
 
 def iso_ts(*, base: datetime = DEFAULT_SCENARIO_BASE, delta_minutes: int = 0) -> str:
     return str(base + timedelta(minutes=delta_minutes))
 
 
+def submission(provider: str, user_id: int, delta_minutes: int = 0) -> TaskSubmission:
+    return TaskSubmission(
+        provider=provider, user_id=user_id, timestamp=iso_ts(delta_minutes=delta_minutes)
+    )
+
+
 class QueueActionBuilder:
     def __init__(
         self,
@@ -75,4 +86,147 @@ def run_queue(actions: Iterable[dict[str, Any]]) -> None:
             )
 
 
-__all__ = ["iso_ts", "call_enqueue", "call_size", "call_dequeue", "run_queue", "call_age"]
+def to_submission(payload: dict) -> TaskSubmission:
+    return TaskSubmission(**{**payload, "metadata": dict(payload["metadata"])})
+
+
+def random_task(rng: random.Random) -> dict:
+    return {
+        "provider": rng.choice(PROVIDERS),
+        "user_id": rng.randint(1, 4),
+        "timestamp": iso_ts(delta_minutes=rng.randint(0, 12)),
+        "metadata": {"priority": 1} if rng.random() < 0.05 else {},
+    }
+
+
+def random_operations(seed: int, steps: int = 80) -> list[tuple[str, object]]:
+    rng = random.Random(seed)
+    operations: list[tuple[str, object]] = []
+    for _ in range(steps):
+        roll = rng.random()
+        if roll < 0.5:
+            operations.append(("enqueue", random_task(rng)))
+        elif roll < 0.6:
+            batch = [random_task(rng) for _ in range(rng.randint(0, 8))]
+            operations.append(("enqueue_many", batch))
+        elif roll < 0.85:
+            operations.append(("dequeue", None))
+        elif roll < 0.9:
+            operations.append(("dequeue_many", rng.randint(0, 4)))
+        elif roll < 0.95:
+            operations.append(("age", None))
+        elif roll < 0.99:
+            operations.append(("size", None))
+        else:
+            operations.append(("purge", None))
+    return operations
+
+
+def operations_with_cancels(seed: int, steps: int = 100) -> list[tuple[str, object]]:
+    rng = random.Random(seed)
+    operations = []
+    for operation in random_operations(seed, steps):
+        operations.append(operation)
+        if rng.random() < 0.2:
+            provider = rng.choice([None, *PROVIDERS])
+            operations.append(("cancel", (rng.randint(1, 4), provider)))
+    return operations
+
+
+def replay(engine: str, operations: list[tuple[str, object]]) -> list[object]:
+    queue = QueueSolutionEntrypoint(engine=engine)
+    results = []
+    for name, payload in operations:
+        method = getattr(queue, name)
+        if payload is None:
+            results.append(method())
+        elif isinstance(payload, int):
+            results.append(method(payload))
+        elif isinstance(payload, list):
+            results.append(method([to_submission(task) for task in payload]))
+        else:
+            results.append(method(to_submission(payload)))
+    return results
+
+
+def replay_queue(queue, operations: list[tuple[str, object]]) -> list[object]:
+    """Like ``replay`` but on a queue engine, where ``size``/``age`` are properties."""
+    results = []
+    for name, payload in operations:
+        if name in ("size", "age"):
+            results.append(getattr(queue, name))
+        elif payload is None:
+            results.append(getattr(queue, name)())
+        elif isinstance(payload, int):
+            results.append(queue.dequeue_many(payload))
+        elif isinstance(payload, list):
+            results.append(queue.enqueue_many([to_submission(task) for task in payload]))
+        else:
+            results.append(queue.enqueue(to_submission(payload)))
+    return results
+
+
+def replay_with_cancels(queue, operations: list[tuple[str, object]]) -> list[object]:
+    results = []
+    for operation in operations:
+        name, payload = operation
+        if name == "cancel":
+            results.append(queue.cancel(*payload))
+        else:
+            results += replay_queue(queue, [operation])
+    return results
+
+
+def apply(queue: HeapQueue, name: str, payload: object) -> None:
+    if name == "enqueue":
+        queue.enqueue(to_submission(payload))
+    elif name == "enqueue_many":
+        queue.enqueue_many([to_submission(item) for item in payload])
+    elif name == "dequeue_many":
+        queue.dequeue_many(payload)
+    elif name in ("dequeue", "purge"):
+        getattr(queue, name)()
+
+
+def assert_consistent(queue: HeapQueue) -> None:
+    tasks = list(queue._heap)
+    assert sum(len(queue._user_tasks(user_id)) for user_id in queue._users) == len(tasks)
+    for task in tasks:
+        assert queue._user_task(task.user_id, task.provider) is task
+    windowed = [task for task in tasks if task.window >= 0]
+    assert sum(map(len, queue._in_window)) + sum(map(len, queue._aged_out)) == len(windowed)
+
+
+def assert_ready_index(queue: DependencyAwareQueue) -> None:
+    assert_consistent(queue)
+    for task in queue._heap:
+        blocked = (task.user_id, task.provider) in queue._in_flight or any(
+            queue._user_task(task.user_id, dependency) is not None
+            or (task.user_id, dependency) in queue._in_flight
+            for dependency in queue._registry.dependency_closure(task.provider)
+        )
+        assert (task in queue._candidates) is not blocked
+        if not blocked:
+            assert queue._candidates.key_of(task) == task.heap_key
+
+
+__all__ = [
+    "PROVIDERS",
+    "iso_ts",
+    "submission",
+    "call_enqueue",
+    "call_size",
+    "call_dequeue",
+    "run_queue",
+    "call_age",
+    "to_submission",
+    "random_task",
+    "random_operations",
+    "operations_with_cancels",
+    "replay",
+    "replay_queue",
+    "replay_with_cancels",
+    "apply",
+    "assert_consistent",
+    "assert_ready_index",
+]
@@ -0,0 +1,70 @@
+"""Seeded synthetic task workloads for the IWC queue benchmarks."""
+
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from solutions.IWC.task_types import TaskSubmission
+
+BANK_STATEMENTS = "bank_statements"
+
+
+@dataclass(frozen=True)
+class WorkloadConfig:
+    """Shape of a synthetic workload; the same config always yields the same tasks.
+
+    Ordinary users stick to a single provider, so they hold at most the two
+    tasks a ``credit_check`` expands to and never reach the rule-of-3 count.
+    ``rule_of_3_user_fraction`` of the users instead spread their submissions
+    over every provider and get promoted once three of their tasks are queued.
+    """
+
+    seed: int = 0
+    users: int = 10_000
+    # Relative weights of the non-bank providers.
+    provider_weights: tuple[tuple[str, float], ...] = (
+        ("companies_house", 1.0),
+        ("credit_check", 1.0),
+        ("id_verification", 1.0),
+    )
+    bank_statement_share: float = 0.2
+    timestamp_spread_seconds: int = 3_600
+    rule_of_3_user_fraction: float = 0.05
+    start: datetime = datetime(2025, 1, 1, 12, 0)
+
+
+class WorkloadGenerator:
+    """Endless stream of ``TaskSubmission`` drawn according to a ``WorkloadConfig``."""
+
+    def __init__(self, config: WorkloadConfig = WorkloadConfig()) -> None:
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._providers = [name for name, _ in config.provider_weights]
+        self._weights = [weight for _, weight in config.provider_weights]
+        self._all_providers = [BANK_STATEMENTS, *self._providers]
+        # user_id -> fixed provider, or None for rule-of-3 users.
+        self._user_providers = [
+            None if self._rng.random() < config.rule_of_3_user_fraction else self._provider()
+            for _ in range(config.users)
+        ]
+
+    def _provider(self) -> str:
+        if self._rng.random() < self.config.bank_statement_share:
+            return BANK_STATEMENTS
+        return self._rng.choices(self._providers, self._weights)[0]
+
+    def submission(self) -> TaskSubmission:
+        rng = self._rng
+        user_id = rng.randrange(len(self._user_providers))
+        provider = self._user_providers[user_id] or rng.choice(self._all_providers)
+        offset = timedelta(seconds=rng.randrange(self.config.timestamp_spread_seconds + 1))
+        return TaskSubmission(
+            provider=provider,
+            user_id=user_id + 1,
+            timestamp=(self.config.start + offset).isoformat(),
+        )
+
+    def submissions(self, count: int) -> list[TaskSubmission]:
+        return [self.submission() for _ in range(count)]